@@ -0,0 +1,255 @@
+"""
+Load test: sync vs async checkout and ITN views under ASGI
+
+Runs Django's ASGI handler in-process against a throw-away SQLite database
+and sends the same requests from many concurrent clients to the sync views
+and to their async versions, reporting throughput and latency percentiles.
+
+Under ASGI, Django runs the sync code of each request in a thread of its
+own; the async views run on the event loop and leave it for each query
+(Django's async ORM methods run the query in that same per-request thread).
+The ITN scenario validates each notification with a fake PayFast server that
+answers after ``--latency`` seconds, which the async view waits for in the
+default executor. SQLite lets one writer in at a time, so the ITN numbers
+mostly measure its lock; point DATABASES at PostgreSQL for a fairer write
+test.
+
+Run from the repository root:
+
+    python benchmarks/bench_asgi.py [--clients 50] [--requests 1000] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.urls import include, path  # noqa: E402
+
+
+def setup_django(db_path):
+    settings.configure(
+        DEBUG=False,
+        USE_TZ=True,
+        SECRET_KEY='bench',
+        ALLOWED_HOSTS=['*'],
+        ROOT_URLCONF=__name__,
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'django.contrib.sessions',
+            'payfast',
+        ],
+        MIDDLEWARE=[
+            'django.contrib.sessions.middleware.SessionMiddleware',
+            'django.middleware.common.CommonMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+        ],
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'APP_DIRS': True,
+        }],
+        DATABASES={'default': {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': db_path,
+            # Concurrent writers wait for the lock instead of failing
+            'OPTIONS': {'timeout': 30, 'transaction_mode': 'IMMEDIATE'},
+        }},
+        DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+        PAYFAST_VALIDATE_IP=False,
+        PAYFAST_VALIDATE_WITH_SERVER=True,
+    )
+    django.setup()
+
+
+def url_patterns():
+    from payfast import views
+
+    return [
+        # The views reverse payfast:* names for the callback URLs
+        path('payfast/', include('payfast.urls')),
+        path('sync/checkout/<int:pk>', views.payfast_payment_view),
+        path('async/checkout/<int:pk>', views.apayfast_payment_view),
+        path('sync/notify/', views.PayFastNotifyView.as_view()),
+        path('async/notify/', views.AsyncPayFastNotifyView.as_view()),
+    ]
+
+
+def fake_payfast(latency):
+    """Make the validation client wait ``latency`` seconds, then answer VALID"""
+    import requests
+    from payfast.validation import get_validation_client
+
+    def post(*args, **kwargs):
+        time.sleep(latency)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'VALID'
+        response.encoding = 'utf-8'
+        return response
+
+    get_validation_client().session.post = post
+
+
+def seed(pending):
+    """Create a logged-in buyer and ``pending`` payments per scenario and mode"""
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+    from django.contrib.sessions.backends.db import SessionStore
+    from payfast.models import PayFastPayment
+
+    user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'secret')
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+
+    PayFastPayment.objects.bulk_create([
+        PayFastPayment(
+            user=user, m_payment_id=f'{prefix}-{i}', amount=Decimal('99.99'),
+            item_name='Item', email_address='buyer@example.com',
+        )
+        for prefix in ('checkout', 'sync', 'async')
+        for i in range(pending)
+    ], batch_size=1000)
+    checkout_ids = list(
+        PayFastPayment.objects.filter(m_payment_id__startswith='checkout-').values_list('pk', flat=True)
+    )
+    return session.session_key, checkout_ids
+
+
+async def call(app, method, path, body=b'', headers=()):
+    """Send one request through the ASGI app and return its status code"""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'shop.example.com'), *headers],
+        'client': ('197.97.145.144', 50000),
+        'server': ('shop.example.com', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # No disconnect: wait until Django stops listening
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+
+    await app(scope, receive, send)
+    return response['status']
+
+
+async def run_load(app, requests_, clients):
+    """Send the requests from ``clients`` concurrent clients"""
+    pending = iter(requests_)
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for request in pending:
+            started = time.perf_counter()
+            status = await call(app, *request)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) * 1000,
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'errors': errors,
+    }
+
+
+def checkout_requests(mode, start, count, session_key, payment_ids):
+    cookie = (b'cookie', f'sessionid={session_key}'.encode())
+    return [
+        ('GET', f'/{mode}/checkout/{payment_ids[i % len(payment_ids)]}', b'', [cookie])
+        for i in range(start, start + count)
+    ]
+
+
+def notify_requests(mode, start, count):
+    content_type = (b'content-type', b'application/x-www-form-urlencoded')
+    return [
+        ('POST', f'/{mode}/notify/', urlencode({
+            'm_payment_id': f'{mode}-{i}',
+            'pf_payment_id': str(1000000 + i),
+            'payment_status': 'COMPLETE',
+            'item_name': 'Item',
+            'amount_gross': '99.99',
+            'amount_fee': '-2.30',
+            'amount_net': '97.69',
+        }).encode(), [content_type])
+        for i in range(start, start + count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the fake PayFast server takes to validate an ITN')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, 'bench.sqlite3'))
+        from django.core.asgi import get_asgi_application
+        from django.core.management import call_command
+
+        call_command('migrate', verbosity=0)
+        session_key, payment_ids = seed(args.requests + args.clients)
+        fake_payfast(args.latency)
+
+        global urlpatterns
+        urlpatterns = url_patterns()
+        app = get_asgi_application()
+
+        scenarios = [
+            ('checkout page', lambda *span: checkout_requests(*span, session_key, payment_ids)),
+            (f'ITN, {args.latency * 1000:.0f} ms PayFast', notify_requests),
+        ]
+
+        print(f'{args.requests:,} requests per run, {args.clients} concurrent clients\n')
+        print(f'{"scenario":<22} {"view":<6} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        for name, build in scenarios:
+            for mode in ('sync', 'async'):
+                # Warm caches and the thread pool on payments of their own
+                asyncio.run(run_load(app, build(mode, args.requests, args.clients), args.clients))
+                result = asyncio.run(run_load(app, build(mode, 0, args.requests), args.clients))
+                print(
+                    f'{name:<22} {mode:<6} {result["rps"]:>8.0f} {result["p50"]:>8.1f} '
+                    f'{result["p99"]:>8.1f} {result["errors"]:>7}'
+                )
+
+
+urlpatterns = []
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark: PayFastPayment lookups before and after the 0006 index migration
+
+Builds a synthetic payments table in a throw-away SQLite database at the
+0005 schema, times the lookups the app actually does, migrates to 0006 and
+times them again.
+
+Run from the repository root:
+
+    python benchmarks/bench_indexes.py [--rows 2000000] [--users 20000] [--lookups 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+STATUSES = ['complete'] * 80 + ['failed'] * 8 + ['cancelled'] * 7 + ['pending'] * 5
+
+
+def setup_django(path):
+    settings.configure(
+        DEBUG=False,
+        USE_TZ=True,
+        SECRET_KEY='bench',
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'payfast',
+        ],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}},
+        DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+    )
+    django.setup()
+
+
+def seed(rows, users, batch=50000):
+    """Insert synthetic users and payments with raw executemany"""
+    from django.contrib.auth import get_user_model
+    from django.db import connection, transaction
+    from payfast.models import PayFastPayment
+
+    User = get_user_model()
+    User.objects.bulk_create(
+        [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(users)],
+        batch_size=5000,
+    )
+    user_ids = list(User.objects.values_list('pk', flat=True))
+
+    table = PayFastPayment._meta.db_table
+    columns = [
+        'user_id', 'm_payment_id', 'pf_payment_id', 'amount', 'item_name', 'item_description',
+        'name_first', 'name_last', 'email_address', 'cell_number', 'status', 'payment_status',
+        'created_at', 'updated_at', 'custom_str1', 'custom_str2', 'custom_str3', 'custom_str4',
+        'custom_str5',
+    ]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns))
+    )
+    start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+    rng = random.Random(42)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(0, rows, batch):
+            params = []
+            for i in range(offset, min(offset + batch, rows)):
+                created = (start + timedelta(seconds=i * 15)).isoformat()
+                params.append((
+                    rng.choice(user_ids), f'PF{i:09d}', str(1000000 + i), '99.99', 'Item', '',
+                    'John', 'Doe', 'buyer@example.com', '', rng.choice(STATUSES), '',
+                    created, created, '', '', '', '', '',
+                ))
+            cursor.executemany(sql, params)
+    return user_ids, start + timedelta(seconds=rows * 15)
+
+
+def lookups(rows, user_ids, end, count):
+    """The queries the app runs, with random keys"""
+    from payfast.models import PayFastPayment
+
+    rng = random.Random(7)
+    ids = [rng.randrange(rows) for _ in range(count)]
+    users = [rng.choice(user_ids) for _ in range(count)]
+    cutoff = end - timedelta(days=30)
+    objects = PayFastPayment.objects
+
+    return {
+        'ITN: get by m_payment_id': [
+            lambda i=i: objects.get(m_payment_id=f'PF{i:09d}') for i in ids
+        ],
+        'lookup by pf_payment_id': [
+            lambda i=i: objects.get(pf_payment_id=str(1000000 + i)) for i in ids
+        ],
+        'checkout: (m_payment_id, user, pending)': [
+            lambda i=i, u=u: objects.filter(m_payment_id=f'PF{i:09d}', user_id=u, status='pending').exists()
+            for i, u in zip(ids, users)
+        ],
+        'expiry: (user, pending, created_at <)': [
+            lambda u=u: objects.filter(user_id=u, status='pending', created_at__lt=cutoff).count()
+            for u in users
+        ],
+        'user history by status, newest 20': [
+            lambda u=u: list(objects.filter(user_id=u, status='complete').order_by('-created_at')[:20])
+            for u in users
+        ],
+    }
+
+
+def run(rows, user_ids, end, count):
+    results = {}
+    for name, calls in lookups(rows, user_ids, end, count).items():
+        started = time.perf_counter()
+        for call in calls:
+            call()
+        results[name] = (time.perf_counter() - started) / len(calls) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--lookups', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, 'bench.sqlite3'))
+        from django.core.management import call_command
+
+        call_command('migrate', 'auth', verbosity=0)
+        call_command('migrate', 'payfast', '0005', verbosity=0)
+        started = time.perf_counter()
+        user_ids, end = seed(args.rows, args.users)
+        print(f'Seeded {args.rows:,} payments for {args.users:,} users in {time.perf_counter() - started:.1f}s')
+
+        before = run(args.rows, user_ids, end, args.lookups)
+
+        started = time.perf_counter()
+        call_command('migrate', 'payfast', '0006', verbosity=0)
+        print(f'Migrated to 0006 (unique + composite/partial indexes) in {time.perf_counter() - started:.1f}s')
+
+        after = run(args.rows, user_ids, end, args.lookups)
+
+    print(f'\n{"lookup":<42} {"before ms":>10} {"after ms":>10} {"speed-up":>9}')
+    for name in before:
+        print(f'{name:<42} {before[name]:>10.3f} {after[name]:>10.3f} {before[name] / after[name]:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
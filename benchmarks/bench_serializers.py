@@ -0,0 +1,125 @@
+"""
+Benchmark: DRF ModelSerializer vs the compiled read-only serializers
+
+Seeds a throw-away SQLite database, then serializes the same rows with the
+DRF serializer (model instances, select_related) and with the compiled
+serializer (values() rows) and checks both produce the same output.
+
+Run from the repository root:
+
+    python benchmarks/bench_serializers.py [--rows 10000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+STATUSES = ['complete'] * 80 + ['failed'] * 8 + ['cancelled'] * 7 + ['pending'] * 5
+
+
+def setup_django(path):
+    settings.configure(
+        DEBUG=False,
+        USE_TZ=True,
+        TIME_ZONE='Africa/Johannesburg',
+        SECRET_KEY='bench',
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'payfast',
+        ],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}},
+        DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+    )
+    django.setup()
+
+
+def seed(rows, users=200):
+    from django.contrib.auth import get_user_model
+    from payfast.models import PayFastPayment
+
+    User = get_user_model()
+    User.objects.bulk_create([
+        User(username=f'user{i}', email=f'user{i}@example.com', first_name='Jane', last_name=f'Buyer{i}')
+        for i in range(users)
+    ])
+    user_ids = list(User.objects.values_list('pk', flat=True)) + [None] * (users // 4)
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+    payments = []
+    for i in range(rows):
+        status = rng.choice(STATUSES)
+        created = start + timedelta(seconds=i * 15)
+        payments.append(PayFastPayment(
+            user_id=rng.choice(user_ids), m_payment_id=f'PF{i:09d}', pf_payment_id=str(1000000 + i),
+            amount=Decimal('99.99'), amount_gross=Decimal('99.99'), amount_fee=Decimal('-2.30'),
+            amount_net=Decimal('97.69'), item_name='Item', item_description='Monthly plan',
+            name_first='John', name_last='Doe', email_address='buyer@example.com', status=status,
+            created_at=created, completed_at=created if status == 'complete' else None,
+        ))
+    # bulk_create skips the rollup signals, which this benchmark does not need
+    PayFastPayment.objects.bulk_create(payments, batch_size=2000)
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, 'bench.sqlite3'))
+        from django.core.management import call_command
+
+        call_command('migrate', verbosity=0)
+        seed(args.rows)
+
+        from payfast.models import PayFastPayment
+        from payfast.serializers import (
+            PayFastPaymentExportSerializer, PayFastPaymentListSerializer, UserPaymentHistorySerializer,
+            compile_serializer,
+        )
+
+        queryset = PayFastPayment.objects.order_by('-created_at', '-id')
+        cases = [
+            ('PayFastPaymentListSerializer', PayFastPaymentListSerializer, queryset.select_related('user')),
+            ('UserPaymentHistorySerializer', UserPaymentHistorySerializer, queryset),
+            ('PayFastPaymentExportSerializer', PayFastPaymentExportSerializer, queryset.select_related('user')),
+        ]
+
+        print(f'{args.rows:,} rows, best of {args.repeat}, query included\n')
+        print(f'{"serializer":<32} {"DRF ms":>9} {"compiled ms":>12} {"speed-up":>9}')
+        for name, serializer_class, drf_queryset in cases:
+            compiled = compile_serializer(serializer_class)
+            drf_ms, expected = best_of(
+                args.repeat, lambda: serializer_class(drf_queryset.all(), many=True).data
+            )
+            compiled_ms, result = best_of(
+                args.repeat, lambda: compiled.serialize(compiled.values(queryset.all()))
+            )
+            if result != expected:
+                sys.exit(f'{name}: compiled output differs from DRF')
+            print(f'{name:<32} {drf_ms:>9.1f} {compiled_ms:>12.1f} {drf_ms / compiled_ms:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Micro-benchmark: SignatureEngine vs the original generate_signature loop
+
+Run from the repository root:
+
+    python benchmarks/bench_signature.py [--rows 20000] [--repeat 5]
+"""
+import argparse
+import hashlib
+import os
+import sys
+import timeit
+import urllib.parse
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payfast.signature import SignatureEngine  # noqa: E402
+
+
+def legacy_generate_signature(dataArray, passPhrase=''):
+    """The original implementation from payfast/utils.py"""
+    payload = ""
+    for key in dataArray:
+        payload += key + "=" + urllib.parse.quote_plus(str(dataArray[key]).replace("+", " ")) + "&"
+    payload = payload[:-1]
+    if passPhrase != '':
+        payload += f"&passphrase={passPhrase}"
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def make_rows(count):
+    """Build checkout-shaped payloads that share the merchant fields"""
+    return [
+        {
+            'merchant_id': '10000100',
+            'merchant_key': '46f0cd694581a',
+            'return_url': f'https://shop.example.com/payfast/payment/success/{i}',
+            'cancel_url': f'https://shop.example.com/payfast/payment/cancel/{i}',
+            'notify_url': 'https://shop.example.com/payfast/notify/',
+            'name_first': 'John',
+            'name_last': 'Doe',
+            'email_address': f'customer{i}@example.com',
+            'm_payment_id': f'PF{i:09d}',
+            'amount': str(Decimal('99.99') + i % 100),
+            'item_name': 'Premium Subscription',
+            'item_description': '1 month premium access',
+            'custom_str1': f'cart_{i}',
+            'custom_int1': str(i),
+        }
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    passphrase = 'jt7NOE43FZPn'
+    engine = SignatureEngine(passphrase=passphrase)
+
+    expected = [legacy_generate_signature(row, passphrase) for row in rows]
+    assert [engine.generate(row) for row in rows] == expected
+    assert engine.generate_many(rows) == expected
+
+    cases = [
+        ('legacy loop', lambda: [legacy_generate_signature(row, passphrase) for row in rows]),
+        ('engine.generate', lambda: [engine.generate(row) for row in rows]),
+        ('engine.generate_many', lambda: engine.generate_many(rows)),
+    ]
+
+    baseline = None
+    print(f'{args.rows} rows, best of {args.repeat}')
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(
+            f'{name:<22} {best * 1000:8.1f} ms  '
+            f'{args.rows / best:10.0f} rows/s  {baseline / best:5.2f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
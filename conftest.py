@@ -16,4 +16,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
 
 # Setup Django
 if not settings.configured:
-    django.setup()
\ No newline at end of file
+    django.setup()
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_recent_notifications():
+    """Forget ITNs accepted by earlier tests; each test has its own database"""
+    from payfast.itn import recent_notifications
+    recent_notifications.clear()
+    yield
@@ -2,7 +2,11 @@
 # payfast/admin.py
 # ============================================================================
 
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.http import HttpResponseRedirect
+from .archive import get_archive, record_to_notification
+from .exceptions import PaymentConflictError
 from .models import PayFastPayment, PayFastNotification
 
 admin.site.site_header = "PayFast"
@@ -10,10 +14,39 @@ admin.site.site_title = "PayFast Portal"
 admin.site.index_title = "Welcome to PayFast Payment Portal"
 
 
+class PayFastPaymentAdminForm(forms.ModelForm):
+    """
+    Change form that carries the version the page was rendered with
+
+    The posted version is what save() compares against, so saving a page
+    opened before an ITN changed the payment is refused instead of writing
+    the old status back. PayFastPayment.clean() rejects status changes
+    STATUS_TRANSITIONS does not allow.
+    """
+
+    class Meta:
+        model = PayFastPayment
+        fields = '__all__'
+        widgets = {'version': forms.HiddenInput}
+
+    def clean(self):
+        cleaned_data = super().clean()
+        version = cleaned_data.get('version')
+        if self.instance.pk is not None and version is not None and version != self.instance.version:
+            raise forms.ValidationError(
+                'This payment was changed by someone else after you opened it. '
+                'Reload the page and make your changes again.',
+                code='conflict',
+            )
+        return cleaned_data
+
+
 @admin.register(PayFastPayment)
 class PayFastPaymentAdmin(admin.ModelAdmin):
     """Admin configuration for PayFastPayment model"""
     
+    form = PayFastPaymentAdminForm
+    
     list_display = [
         'm_payment_id',
         'user',
@@ -51,6 +84,7 @@ class PayFastPaymentAdmin(admin.ModelAdmin):
                 'user',
                 'status',
                 'payment_status',
+                'version',
             )
         }),
         ('Amount Details', {
@@ -98,6 +132,20 @@ class PayFastPaymentAdmin(admin.ModelAdmin):
             )
         }),
     )
+    
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        # A writer that commits between the form's version check and the
+        # save still makes save() fail; the admin's transaction is rolled back
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except PaymentConflictError:
+            self.message_user(
+                request,
+                'This payment was changed by someone else while it was being saved. '
+                'Review it and make your changes again.',
+                messages.ERROR,
+            )
+            return HttpResponseRedirect(request.get_full_path())
 
 
 @admin.register(PayFastNotification)
@@ -108,25 +156,33 @@ class PayFastNotificationAdmin(admin.ModelAdmin):
         'id',
         'payment',
         'is_valid',
+        'processing_state',
         'ip_address',
         'created_at',
     ]
     
     list_filter = [
         'is_valid',
+        'processing_state',
         'created_at',
     ]
     
     search_fields = [
         'payment__m_payment_id',
+        'pf_payment_id',
         'ip_address',
     ]
     
     readonly_fields = [
         'payment',
         'raw_data',
+        'pf_payment_id',
+        'payment_status',
+        'payload_hash',
         'is_valid',
         'validation_errors',
+        'processing_state',
+        'processed_at',
         'ip_address',
         'created_at',
     ]
@@ -137,6 +193,8 @@ class PayFastNotificationAdmin(admin.ModelAdmin):
                 'payment',
                 'is_valid',
                 'validation_errors',
+                'processing_state',
+                'processed_at',
                 'ip_address',
                 'created_at',
             )
@@ -144,6 +202,38 @@ class PayFastNotificationAdmin(admin.ModelAdmin):
         ('Raw Data', {
             'fields': (
                 'raw_data',
+                'pf_payment_id',
+                'payment_status',
+                'payload_hash',
             )
         }),
-    )
\ No newline at end of file
+    )
+    
+    def get_object(self, request, object_id, from_field=None):
+        """Fall back to the archive for notifications moved out of the database"""
+        obj = super().get_object(request, object_id, from_field)
+        if obj is None and from_field is None:
+            obj = self.get_archived_object(object_id)
+            if obj is not None:
+                self.message_user(request, 'This notification is archived and read-only.', messages.INFO)
+        return obj
+    
+    def get_archived_object(self, object_id):
+        archive = get_archive()
+        if archive is None:
+            return None
+        try:
+            record = archive.get(int(object_id))
+        except (TypeError, ValueError):
+            return None
+        return record_to_notification(record) if record else None
+    
+    def has_change_permission(self, request, obj=None):
+        if getattr(obj, 'is_archived', False):
+            return False
+        return super().has_change_permission(request, obj)
+    
+    def has_delete_permission(self, request, obj=None):
+        if getattr(obj, 'is_archived', False):
+            return False
+        return super().has_delete_permission(request, obj)
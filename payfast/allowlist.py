@@ -0,0 +1,215 @@
+# ============================================================================
+# payfast/allowlist.py
+# ============================================================================
+
+"""
+PayFast source-IP allowlist
+
+PayFast sends ITNs from a small set of hosts and published IP ranges. The
+allowlist turns those into a sorted list of integer intervals so each lookup
+is a single bisect. Host names are resolved on a background thread, started
+when the app loads, that refreshes the index every PAYFAST_IP_ALLOWLIST_TTL
+seconds; the request path only ever reads the current index and never waits
+on DNS.
+"""
+
+import bisect
+import ipaddress
+import logging
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Hosts PayFast sends notifications from
+PAYFAST_HOSTS = (
+    'www.payfast.co.za',
+    'sandbox.payfast.co.za',
+    'w1w.payfast.co.za',
+    'w2w.payfast.co.za',
+)
+
+# IP ranges published by PayFast for ITN callbacks
+PAYFAST_IP_RANGES = (
+    '197.97.145.144/28',
+    '41.74.179.192/27',
+    '102.216.36.0/28',
+    '102.216.36.128/28',
+    '144.126.193.139/32',
+)
+
+
+def socket_resolver(host):
+    """
+    Resolve a host name to its IP addresses using the system resolver
+
+    Args:
+        host: Host name to resolve
+
+    Returns:
+        List of IP address strings
+    """
+    infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    return sorted({info[4][0] for info in infos})
+
+
+def _parse_ip(ip_address):
+    """Parse an address, unwrapping IPv4-mapped IPv6 addresses"""
+    ip = ipaddress.ip_address(ip_address)
+    if ip.version == 6 and ip.ipv4_mapped:
+        return ip.ipv4_mapped
+    return ip
+
+
+class IPIntervalIndex:
+    """
+    Immutable index of IP networks stored as merged integer intervals
+
+    Example:
+        index = IPIntervalIndex(['197.97.145.144/28', '41.74.179.200'])
+        '197.97.145.150' in index  # True
+    """
+
+    def __init__(self, networks=()):
+        """
+        Build the index.
+
+        Args:
+            networks: Iterable of addresses or CIDR ranges (IPv4 or IPv6)
+        """
+        intervals = {4: [], 6: []}
+        for network in networks:
+            network = ipaddress.ip_network(network, strict=False)
+            intervals[network.version].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+
+        self._starts = {}
+        self._ends = {}
+        for version, ranges in intervals.items():
+            starts, ends = [], []
+            for start, end in sorted(ranges):
+                # Merge overlapping and adjacent ranges
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._starts[version] = starts
+            self._ends[version] = ends
+
+    def __contains__(self, ip_address):
+        try:
+            ip = _parse_ip(ip_address)
+        except (TypeError, ValueError):
+            return False
+
+        value = int(ip)
+        starts = self._starts[ip.version]
+        position = bisect.bisect_right(starts, value) - 1
+        return position >= 0 and value <= self._ends[ip.version][position]
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+
+class PayFastIPAllowlist:
+    """
+    Allowlist of PayFast source IPs with background DNS refresh
+
+    The configured IP ranges are available immediately. Host names are
+    resolved by ``refresh()``, which ``start()`` runs on a daemon thread right
+    away and then every ``ttl`` seconds; until the first resolve finishes,
+    checks are answered from the ranges alone. If a host fails to resolve,
+    its previously resolved addresses are kept.
+
+    Example:
+        allowlist = PayFastIPAllowlist(resolver=lambda host: ['127.0.0.1'])
+        allowlist.refresh()
+        allowlist.is_allowed('127.0.0.1')  # True
+    """
+
+    def __init__(self, hosts=PAYFAST_HOSTS, ip_ranges=PAYFAST_IP_RANGES,
+                 resolver=socket_resolver, ttl=3600):
+        """
+        Initialize the allowlist.
+
+        Args:
+            hosts: Host names to resolve
+            ip_ranges: Addresses or CIDR ranges that are always allowed
+            resolver: Callable taking a host name and returning IP strings
+            ttl: Seconds between background refreshes
+        """
+        self.hosts = tuple(hosts)
+        self.ip_ranges = tuple(ip_ranges)
+        self.resolver = resolver
+        self.ttl = ttl
+
+        self._resolved = {}
+        self._index = IPIntervalIndex(self.ip_ranges)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """
+        Resolve all hosts and swap in a new index
+
+        Returns:
+            The new IPIntervalIndex
+        """
+        for host in self.hosts:
+            try:
+                self._resolved[host] = tuple(self.resolver(host))
+            except (OSError, ValueError) as e:
+                logger.warning('Could not resolve PayFast host %s: %s', host, e)
+
+        addresses = [ip for ips in self._resolved.values() for ip in ips]
+        # Readers pick up the new index with a single attribute lookup
+        self._index = IPIntervalIndex(self.ip_ranges + tuple(addresses))
+        return self._index
+
+    def start(self):
+        """Start the background refresh thread, unless it is already running"""
+        with self._lock:
+            # A thread inherited through fork() is not alive in the child
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='payfast-ip-allowlist', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('PayFast IP allowlist refresh failed')
+            if self._stop.wait(self.ttl):
+                return
+
+    def is_allowed(self, ip_address):
+        """
+        Check whether an address belongs to PayFast
+
+        Args:
+            ip_address: IP address string
+
+        Returns:
+            Boolean indicating if the address is allowed
+        """
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            self.start()
+        return ip_address in self._index
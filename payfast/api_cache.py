@@ -0,0 +1,114 @@
+# ============================================================================
+# payfast/api_cache.py
+# ============================================================================
+
+"""
+Conditional GET and versioned response caching for the payments API
+
+Every write to a payment bumps two change counters in the cache: one for the
+payment's user and one covering all payments. A list response is identified
+by the counter of the scope it reads, so its ETag changes exactly when a
+payment in that scope changes, without touching the database. Serialized
+list responses are cached under the counter value, per user and query
+string; a bump makes the old entries unreachable and they simply expire.
+
+Counters are bumped when the write happens and again when its transaction
+commits, so a read that runs in between cannot cache pre-commit data under
+the new version. A counter that is evicted restarts from the current time in
+nanoseconds, which is larger than any value it held before.
+"""
+
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import quote_etag
+
+from payfast import conf
+
+ALL = '*'
+
+
+def _cache():
+    return caches[conf.PAYFAST_API_CACHE_ALIAS]
+
+
+def version_key(scope):
+    """Cache key of a change counter (a user id, or ALL)"""
+    return f'payfast:api:version:{scope}'
+
+
+def get_version(scope=ALL):
+    """
+    Current change counter of a scope
+
+    Args:
+        scope: User id whose payments are read, or ALL
+
+    Returns:
+        Integer that changes whenever a payment in the scope changes
+    """
+    cache = _cache()
+    key = version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns())
+        version = cache.get(key)
+    return version
+
+
+def _bump(scopes):
+    cache = _cache()
+    for scope in scopes:
+        key = version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, time.time_ns()):
+                cache.incr(key)
+
+
+def bump_versions(user_ids, using=None):
+    """
+    Mark the payments of these users (and all payments) as changed
+
+    Args:
+        user_ids: Iterable of user ids of changed payments (None is ignored)
+        using: Database alias of the write
+    """
+    scopes = [ALL] + sorted({user_id for user_id in user_ids if user_id is not None})
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes), using=using)
+
+
+def make_etag(*parts):
+    """Strong, quoted ETag from the values that determine a representation"""
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def response_cache_key(request, version):
+    """
+    Cache key of a serialized response
+
+    The absolute URL (paginated responses hold absolute links), the user and
+    the negotiated format are part of the key.
+    """
+    digest = hashlib.md5(
+        f'{request.user.pk}:{request.accepted_renderer.format}:{request.build_absolute_uri()}'.encode()
+    ).hexdigest()
+    return f'payfast:api:response:{version}:{digest}'
+
+
+def get_cached_response(key):
+    """Cached response data, or None"""
+    if not conf.PAYFAST_API_CACHE_TIMEOUT:
+        return None
+    return _cache().get(key)
+
+
+def set_cached_response(key, data):
+    """Cache response data for PAYFAST_API_CACHE_TIMEOUT seconds"""
+    if conf.PAYFAST_API_CACHE_TIMEOUT:
+        _cache().set(key, data, conf.PAYFAST_API_CACHE_TIMEOUT)
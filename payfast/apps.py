@@ -11,5 +11,12 @@ class PayFastConfig(AppConfig):
     verbose_name = 'PayFast Payments'
 
     def ready(self):
+        import payfast.checks  # Register system checks
         import payfast.signals  # Import signals
+        from payfast import conf
+        from payfast.utils import get_ip_allowlist
+
+        if conf.PAYFAST_VALIDATE_IP:
+            # Resolve PayFast's hosts in the background before the first ITN
+            get_ip_allowlist().start()
 
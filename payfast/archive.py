@@ -0,0 +1,352 @@
+# ============================================================================
+# payfast/archive.py
+# ============================================================================
+
+"""
+Archival of old PayFastNotification rows to compressed JSONL segments
+
+The ``payfast_archive_notifications`` command moves notifications older than
+the retention period out of the database into append-only segment files in
+PAYFAST_ARCHIVE_DIR. A segment is a JSONL file compressed in independent
+blocks (gzip members or zstd frames), so the whole file can still be read
+with ``zcat``/``zstdcat`` while a single record only needs one block to be
+decompressed. Each segment has a sidecar ``.idx`` file with one
+``id<TAB>block offset<TAB>block length`` line per record.
+
+Segment names carry their id range
+(``notifications-000000000001-000000004096.jsonl.gz``), so finding the
+segment for an id never opens the other files. Segments are written to a
+temporary file, fsynced and renamed into place before any row is deleted.
+A new segment carries an ``.open`` marker until its rows have been deleted
+from the database (``close_segment()``), so an interrupted run knows exactly
+which segments still have rows left, whatever their id ranges.
+"""
+
+import bisect
+import gzip
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+from payfast import conf
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+# Notification columns stored in each archived record
+ARCHIVE_FIELDS = (
+    'id',
+    'payment_id',
+    'raw_data',
+    'pf_payment_id',
+    'payment_status',
+    'payload_hash',
+    'is_valid',
+    'validation_errors',
+    'processing_state',
+    'processed_at',
+    'ip_address',
+    'created_at',
+)
+
+EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+SEGMENT_RE = re.compile(r'^notifications-(\d{12})-(\d{12})(\.jsonl\.(?:gz|zst))$')
+
+
+def _compressor(compression):
+    if compression == 'gzip':
+        return lambda data: gzip.compress(data, compresslevel=6)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured(
+                "PAYFAST_ARCHIVE_COMPRESSION = 'zstd' requires the zstandard package "
+                "(pip install dj-payfast[zstd])"
+            )
+        return zstandard.ZstdCompressor(level=3).compress
+    raise ImproperlyConfigured(f'Unknown archive compression: {compression}')
+
+
+def _decompress(extension, data):
+    if extension == '.jsonl.gz':
+        return gzip.decompress(data)
+    if zstandard is None:
+        raise ImproperlyConfigured('Reading .zst archive segments requires the zstandard package')
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+class Segment:
+    """One archived segment file and its offset index"""
+
+    def __init__(self, directory, first_id, last_id, extension):
+        self.first_id = first_id
+        self.last_id = last_id
+        self.extension = extension
+        self.path = os.path.join(
+            directory, f'notifications-{first_id:012d}-{last_id:012d}{extension}'
+        )
+        self.index_path = self.path + '.idx'
+        self.open_path = self.path + '.open'
+        self._index = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<Segment {os.path.basename(self.path)}>'
+
+    def load_index(self):
+        """
+        Load the sidecar index
+
+        Returns:
+            Tuple of (ids, offsets, lengths) lists sorted by id
+        """
+        with self._lock:
+            if self._index is None:
+                ids, offsets, lengths = [], [], []
+                with open(self.index_path) as index:
+                    for line in index:
+                        pk, offset, length = line.split('\t')
+                        ids.append(int(pk))
+                        offsets.append(int(offset))
+                        lengths.append(int(length))
+                self._index = (ids, offsets, lengths)
+            return self._index
+
+    def ids(self):
+        return self.load_index()[0]
+
+    def _read_block(self, handle, offset, length):
+        handle.seek(offset)
+        data = _decompress(self.extension, handle.read(length))
+        return [json.loads(line) for line in data.splitlines() if line]
+
+    def get(self, pk):
+        """
+        Fetch one record by id, decompressing only its block
+
+        Returns:
+            Record dictionary, or None if the id is not in this segment
+        """
+        ids, offsets, lengths = self.load_index()
+        position = bisect.bisect_left(ids, pk)
+        if position == len(ids) or ids[position] != pk:
+            return None
+        with open(self.path, 'rb') as handle:
+            for record in self._read_block(handle, offsets[position], lengths[position]):
+                if record['id'] == pk:
+                    return record
+        return None
+
+    def __iter__(self):
+        """Yield every record in id order, one block at a time"""
+        _, offsets, lengths = self.load_index()
+        blocks = OrderedDict((offset, length) for offset, length in zip(offsets, lengths))
+        with open(self.path, 'rb') as handle:
+            for offset, length in blocks.items():
+                yield from self._read_block(handle, offset, length)
+
+
+class NotificationArchive:
+    """
+    Directory of archived notification segments
+
+    Example:
+        archive = NotificationArchive('/var/lib/payfast/archive')
+        archive.get(42)                       # one record or None
+        for record in archive.iter_records(start_id=1000, end_id=2000):
+            ...
+    """
+
+    def __init__(self, directory, compression='gzip', block_size=256):
+        """
+        Initialize the archive.
+
+        Args:
+            directory: Directory holding the segment files
+            compression: 'gzip' or 'zstd' for new segments
+            block_size: Records per independently compressed block
+        """
+        self.directory = directory
+        self.compression = compression
+        self.block_size = block_size
+        self._segments = {}
+
+    def segments(self):
+        """
+        List the finished segments in id order
+
+        Returns:
+            List of Segment instances
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_RE.match(name)
+            if not match or not os.path.exists(os.path.join(self.directory, name + '.idx')):
+                continue
+            key = (int(match.group(1)), int(match.group(2)), match.group(3))
+            if key not in self._segments:
+                self._segments[key] = Segment(self.directory, *key)
+            found.append(self._segments[key])
+        return sorted(found, key=lambda segment: segment.first_id)
+
+    def open_segments(self):
+        """
+        List the segments whose rows may still be in the database
+
+        Returns:
+            List of Segment instances with an ``.open`` marker
+        """
+        return [segment for segment in self.segments() if os.path.exists(segment.open_path)]
+
+    def close_segment(self, segment):
+        """Remove the ``.open`` marker once the segment's rows are deleted"""
+        try:
+            os.remove(segment.open_path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, pk):
+        """
+        Fetch one archived notification record by id
+
+        Returns:
+            Record dictionary, or None if the id is not archived
+        """
+        for segment in self.segments():
+            if segment.first_id <= pk <= segment.last_id:
+                record = segment.get(pk)
+                if record is not None:
+                    return record
+        return None
+
+    def iter_records(self, start_id=None, end_id=None, since=None, until=None):
+        """
+        Stream archived records in id order
+
+        Args:
+            start_id: Lowest id to include
+            end_id: Highest id to include
+            since: Only records created at or after this aware datetime
+            until: Only records created before this aware datetime
+
+        Yields:
+            Record dictionaries
+        """
+        for segment in self.segments():
+            if start_id is not None and segment.last_id < start_id:
+                continue
+            if end_id is not None and segment.first_id > end_id:
+                continue
+            for record in segment:
+                if start_id is not None and record['id'] < start_id:
+                    continue
+                if end_id is not None and record['id'] > end_id:
+                    continue
+                if since is not None or until is not None:
+                    created_at = parse_datetime(record['created_at'])
+                    if since is not None and created_at < since:
+                        continue
+                    if until is not None and created_at >= until:
+                        continue
+                yield record
+
+    def write_segment(self, records):
+        """
+        Write records to a new segment and its index, atomically
+
+        The segment is left open; call close_segment() once its rows have
+        been deleted from the database.
+
+        Args:
+            records: Non-empty list of record dictionaries sorted by id
+
+        Returns:
+            The new Segment
+        """
+        compress = _compressor(self.compression)
+        extension = EXTENSIONS[self.compression]
+        os.makedirs(self.directory, exist_ok=True)
+
+        segment = Segment(self.directory, records[0]['id'], records[-1]['id'], extension)
+        index_lines = []
+        offset = 0
+        with open(segment.path + '.tmp', 'wb') as handle:
+            for start in range(0, len(records), self.block_size):
+                block = records[start:start + self.block_size]
+                data = compress(b''.join(
+                    json.dumps(record, cls=DjangoJSONEncoder, separators=(',', ':')).encode() + b'\n'
+                    for record in block
+                ))
+                handle.write(data)
+                index_lines.extend(f'{record["id"]}\t{offset}\t{len(data)}\n' for record in block)
+                offset += len(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        with open(segment.index_path + '.tmp', 'w') as handle:
+            handle.writelines(index_lines)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        # Marked open before it becomes visible, so a crash at any later point
+        # leaves the segment listed by open_segments()
+        with open(segment.open_path, 'w') as handle:
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        # The index is renamed last; readers ignore segments without one
+        os.replace(segment.path + '.tmp', segment.path)
+        os.replace(segment.index_path + '.tmp', segment.index_path)
+        return segment
+
+
+def get_archive():
+    """
+    Get the archive configured by PAYFAST_ARCHIVE_DIR
+
+    Returns:
+        NotificationArchive, or None if archiving is not configured
+    """
+    if not conf.PAYFAST_ARCHIVE_DIR:
+        return None
+    return _get_archive(conf.PAYFAST_ARCHIVE_DIR, conf.PAYFAST_ARCHIVE_COMPRESSION)
+
+
+@lru_cache(maxsize=None)
+def _get_archive(directory, compression):
+    # Shared so loaded segment indexes are reused between lookups
+    return NotificationArchive(directory, compression=compression)
+
+
+def record_to_notification(record):
+    """
+    Build an unsaved, read-only PayFastNotification from an archived record
+
+    Args:
+        record: Archived record dictionary
+
+    Returns:
+        PayFastNotification instance (not stored in the database)
+    """
+    from payfast.models import PayFastNotification
+
+    values = dict(record)
+    for field in ('processed_at', 'created_at'):
+        if values.get(field):
+            values[field] = parse_datetime(values[field])
+    notification = PayFastNotification(**values)
+    notification.is_archived = True
+    return notification
+
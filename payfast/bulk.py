@@ -0,0 +1,64 @@
+# ============================================================================
+# payfast/bulk.py
+# ============================================================================
+
+"""
+Bulk status changes for PayFastPayment
+
+Payments are changed in chunks of PAYFAST_API_BULK_UPDATE_CHUNK_SIZE, each in
+its own short transaction, so a large request never holds row locks for
+longer than one chunk takes. Only pending payments are moved; the others are
+counted as skipped. ``payment_status_changed`` is sent for every payment that
+actually changed, after its chunk has committed (see payfast.transitions).
+"""
+
+from django.db import transaction
+
+from payfast import conf
+from payfast.models import PayFastPayment
+
+
+def bulk_update_status(m_payment_ids, to_status, chunk_size=None):
+    """
+    Move pending payments to a new status in chunked transactions
+
+    Args:
+        m_payment_ids: Iterable of merchant payment ids
+        to_status: New status ('cancelled' or 'failed' from the API)
+        chunk_size: Ids per transaction (default: PAYFAST_API_BULK_UPDATE_CHUNK_SIZE)
+
+    Returns:
+        Dictionary with ``updated``, ``skipped`` and ``not_found`` counts and
+        the ``not_found_ids`` list
+    """
+    chunk_size = max(1, chunk_size or conf.PAYFAST_API_BULK_UPDATE_CHUNK_SIZE)
+    # Drop repeated ids, keeping the request order
+    ids = list(dict.fromkeys(m_payment_ids))
+
+    result = {'updated': 0, 'skipped': 0, 'not_found': 0, 'not_found_ids': []}
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        _update_chunk(chunk, to_status, result)
+    return result
+
+
+def _update_chunk(chunk, to_status, result):
+    """Apply one chunk in one transaction and count it in ``result``"""
+    with transaction.atomic():
+        # Lock the chunk's rows (in primary key order) so the statuses read
+        # here are the ones the UPDATE sees
+        statuses = dict(
+            PayFastPayment.objects.select_for_update()
+            .filter(m_payment_id__in=chunk)
+            .order_by('pk')
+            .values_list('m_payment_id', 'status')
+        )
+        changed = [m_payment_id for m_payment_id in chunk if statuses.get(m_payment_id) == 'pending']
+        if changed:
+            PayFastPayment.objects.filter(m_payment_id__in=changed).transition(to_status)
+
+    not_found = [m_payment_id for m_payment_id in chunk if m_payment_id not in statuses]
+    result['updated'] += len(changed)
+    result['skipped'] += len(statuses) - len(changed)
+    result['not_found'] += len(not_found)
+    result['not_found_ids'].extend(not_found)
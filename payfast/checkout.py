@@ -0,0 +1,186 @@
+# ============================================================================
+# payfast/checkout.py
+# ============================================================================
+
+"""
+Signed checkout forms for dj-payfast
+
+The checkout page is reloaded far more often than a payment changes, so the
+signed form fields and the rendered HTML form are cached per payment. The
+cache key includes the payment's ``updated_at``: any save (or transition) of
+the payment produces a new key, so a stale form is never served and old
+entries simply expire.
+"""
+
+from django.core.cache import caches
+from django.urls import reverse
+from django.utils.html import escape, format_html_join
+
+from payfast import conf
+from payfast.utils import generate_signature, generate_signatures
+
+
+def checkout_cache_key(request, payment):
+    """
+    Build the cache key for a payment's checkout form
+
+    The callback URLs are absolute, so the scheme and host are part of the key.
+
+    Args:
+        request: HttpRequest the form is rendered for
+        payment: PayFastPayment instance
+
+    Returns:
+        Cache key string
+    """
+    return 'payfast:checkout:{}:{}:{}://{}'.format(
+        payment.pk,
+        payment.updated_at.timestamp() if payment.updated_at else '',
+        request.scheme,
+        request.get_host(),
+    )
+
+
+def build_checkout_data(request, payment):
+    """
+    Build the signed PayFast form fields for a payment
+
+    Args:
+        request: HttpRequest used to build absolute callback URLs
+        payment: PayFastPayment instance
+
+    Returns:
+        Dictionary of form fields, including ``signature``
+    """
+    data = _checkout_fields(request, payment)
+    data['signature'] = generate_signature(data, conf.PAYFAST_PASSPHRASE)
+    return data
+
+
+def _checkout_fields(request, payment):
+    """Unsigned form fields for a payment, in the order PayFast signs them"""
+    data = {
+        # Merchant details
+        'merchant_id': conf.PAYFAST_MERCHANT_ID,
+        'merchant_key': conf.PAYFAST_MERCHANT_KEY,
+
+        # Callback URLs
+        'return_url': request.build_absolute_uri(
+            reverse('payfast:payment_success', kwargs={'pk': payment.pk})
+        ),
+        'cancel_url': request.build_absolute_uri(
+            reverse('payfast:payment_cancel', kwargs={'pk': payment.pk})
+        ),
+        'notify_url': request.build_absolute_uri(reverse('payfast:notify')),
+
+        # Buyer details
+        'name_first': payment.name_first or 'John',
+        'name_last': payment.name_last or 'Doe',
+        'email_address': payment.email_address,
+
+        # Transaction details
+        'm_payment_id': payment.m_payment_id,
+        'amount': '{:.2f}'.format(payment.amount),
+        'item_name': payment.item_name,
+        'item_description': payment.item_description,
+    }
+
+    # Add custom fields if present
+    if payment.custom_str1:
+        data['custom_str1'] = payment.custom_str1
+    if payment.custom_int1:
+        data['custom_int1'] = str(payment.custom_int1)
+    return data
+
+
+def render_checkout_form(data):
+    """
+    Render the HTML form that posts the signed fields to PayFast
+
+    Args:
+        data: Signed form fields from build_checkout_data()
+
+    Returns:
+        HTML string
+    """
+    inputs = format_html_join(
+        '', '<input name="{}" type="hidden" value="{}" />', data.items()
+    )
+    return (
+        f'<form action="{escape(conf.PAYFAST_URL)}" method="post">{inputs}'
+        f'''
+        <button type="submit" class="btn btn-pay" id="pay-btn">
+            <i class="bi bi-lock-fill"></i>
+            <span>Pay R{escape(data['amount'])} with PayFast</span>
+        </button>
+    </form>'''
+    )
+
+
+def get_checkout_form(request, payment):
+    """
+    Get the signed form fields and rendered form for a payment, cached
+
+    Args:
+        request: HttpRequest the form is rendered for
+        payment: PayFastPayment instance
+
+    Returns:
+        Tuple of (form fields dictionary, HTML form string)
+    """
+    cache = caches[conf.PAYFAST_CHECKOUT_CACHE_ALIAS]
+    key = checkout_cache_key(request, payment)
+
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    data = build_checkout_data(request, payment)
+    form = (data, render_checkout_form(data))
+    cache.set(key, form, conf.PAYFAST_CHECKOUT_CACHE_TIMEOUT)
+    return form
+
+
+async def aget_checkout_form(request, payment):
+    """Async version of get_checkout_form()"""
+    cache = caches[conf.PAYFAST_CHECKOUT_CACHE_ALIAS]
+    key = checkout_cache_key(request, payment)
+
+    cached = await cache.aget(key)
+    if cached is not None:
+        return cached
+
+    data = build_checkout_data(request, payment)
+    form = (data, render_checkout_form(data))
+    await cache.aset(key, form, conf.PAYFAST_CHECKOUT_CACHE_TIMEOUT)
+    return form
+
+
+def prime_checkout_forms(request, payments):
+    """
+    Sign and cache the checkout forms for many new payments at once
+
+    All payments are signed in one pass of the shared signature engine and
+    the forms are stored with a single ``set_many``, so the checkout page of a
+    bulk-created payment is served from the cache.
+
+    Args:
+        request: HttpRequest the forms are rendered for
+        payments: Saved PayFastPayment instances
+
+    Returns:
+        List of signed form field dictionaries, in the order of ``payments``
+    """
+    fields = [_checkout_fields(request, payment) for payment in payments]
+    signatures = generate_signatures(fields, conf.PAYFAST_PASSPHRASE)
+    for data, signature in zip(fields, signatures):
+        data['signature'] = signature
+
+    caches[conf.PAYFAST_CHECKOUT_CACHE_ALIAS].set_many(
+        {
+            checkout_cache_key(request, payment): (data, render_checkout_form(data))
+            for payment, data in zip(payments, fields)
+        },
+        conf.PAYFAST_CHECKOUT_CACHE_TIMEOUT,
+    )
+    return fields
@@ -0,0 +1,54 @@
+# ============================================================================
+# payfast/checks.py
+# ============================================================================
+
+import django
+from django.core.checks import Error, Tags, register
+
+from payfast import conf
+
+
+@register(Tags.compatibility)
+def check_validation_failure_mode(app_configs, **kwargs):
+    """
+    Refuse PAYFAST_VALIDATION_FAILURE_MODE = 'defer' without the ITN queue
+
+    Deferred notifications are only retried by payfast_process_notifications,
+    which is run with PAYFAST_ITN_QUEUE_MODE. Without it they would be
+    acknowledged to PayFast and never applied.
+    """
+    errors = []
+    mode = conf.PAYFAST_VALIDATION_FAILURE_MODE
+    if mode not in ('defer', 'reject'):
+        errors.append(Error(
+            f"PAYFAST_VALIDATION_FAILURE_MODE must be 'defer' or 'reject', not {mode!r}",
+            id='payfast.E001',
+        ))
+    elif mode == 'defer' and not conf.PAYFAST_ITN_QUEUE_MODE:
+        errors.append(Error(
+            "PAYFAST_VALIDATION_FAILURE_MODE = 'defer' needs PAYFAST_ITN_QUEUE_MODE",
+            hint=(
+                "Deferred ITNs are only retried by payfast_process_notifications. "
+                "Enable PAYFAST_ITN_QUEUE_MODE and run the worker, or use 'reject' "
+                "so PayFast retries them."
+            ),
+            id='payfast.E002',
+        ))
+    return errors
+
+
+@register(Tags.compatibility)
+def check_async_views(app_configs, **kwargs):
+    """
+    Refuse PAYFAST_ASYNC_VIEWS on Django versions without the async APIs
+
+    The async checkout and ITN views use the async ORM and async iterators in
+    responses, which need Django 4.2.
+    """
+    if conf.PAYFAST_ASYNC_VIEWS and django.VERSION < (4, 2):
+        return [Error(
+            'PAYFAST_ASYNC_VIEWS needs Django 4.2 or later',
+            hint='Upgrade Django or serve the sync views (PAYFAST_ASYNC_VIEWS = False).',
+            id='payfast.E003',
+        )]
+    return []
@@ -12,3 +12,100 @@ PAYFAST_TEST_MODE = getattr(settings, 'PAYFAST_TEST_MODE', True)
 # PayFast URLs
 PAYFAST_URL = 'https://sandbox.payfast.co.za/eng/process' if PAYFAST_TEST_MODE else 'https://www.payfast.co.za/eng/process'
 PAYFAST_VALIDATE_URL = 'https://sandbox.payfast.co.za/eng/query/validate' if PAYFAST_TEST_MODE else 'https://www.payfast.co.za/eng/query/validate'
+
+# ITN processing
+# When queue mode is enabled the notify view only stores the raw payload and
+# the payfast_process_notifications management command applies it later.
+PAYFAST_ITN_QUEUE_MODE = getattr(settings, 'PAYFAST_ITN_QUEUE_MODE', False)
+PAYFAST_ITN_WORKER_CONCURRENCY = getattr(settings, 'PAYFAST_ITN_WORKER_CONCURRENCY', 4)
+PAYFAST_ITN_WORKER_BATCH_SIZE = getattr(settings, 'PAYFAST_ITN_WORKER_BATCH_SIZE', 100)
+
+# ITN source-IP validation
+PAYFAST_VALIDATE_IP = getattr(settings, 'PAYFAST_VALIDATE_IP', True)
+PAYFAST_VALID_HOSTS = getattr(settings, 'PAYFAST_VALID_HOSTS', None)
+PAYFAST_VALID_IP_RANGES = getattr(settings, 'PAYFAST_VALID_IP_RANGES', None)
+PAYFAST_IP_RESOLVER = getattr(settings, 'PAYFAST_IP_RESOLVER', 'payfast.allowlist.socket_resolver')
+PAYFAST_IP_ALLOWLIST_TTL = getattr(settings, 'PAYFAST_IP_ALLOWLIST_TTL', 3600)
+# Number of reverse proxies in front of Django that append to X-Forwarded-For
+# (0: the client IP is REMOTE_ADDR and the header is ignored)
+PAYFAST_TRUSTED_PROXY_COUNT = getattr(settings, 'PAYFAST_TRUSTED_PROXY_COUNT', 0)
+
+# Server-side ITN validation against PAYFAST_VALIDATE_URL
+PAYFAST_VALIDATE_WITH_SERVER = getattr(settings, 'PAYFAST_VALIDATE_WITH_SERVER', False)
+PAYFAST_VALIDATION_CONNECT_TIMEOUT = getattr(settings, 'PAYFAST_VALIDATION_CONNECT_TIMEOUT', 3.05)
+PAYFAST_VALIDATION_READ_TIMEOUT = getattr(settings, 'PAYFAST_VALIDATION_READ_TIMEOUT', 5)
+PAYFAST_VALIDATION_MAX_RETRIES = getattr(settings, 'PAYFAST_VALIDATION_MAX_RETRIES', 2)
+PAYFAST_VALIDATION_POOL_SIZE = getattr(settings, 'PAYFAST_VALIDATION_POOL_SIZE', 10)
+PAYFAST_VALIDATION_BREAKER_THRESHOLD = getattr(settings, 'PAYFAST_VALIDATION_BREAKER_THRESHOLD', 5)
+PAYFAST_VALIDATION_BREAKER_RESET = getattr(settings, 'PAYFAST_VALIDATION_BREAKER_RESET', 30)
+# 'reject' answers 503 so PayFast retries; 'defer' queues the ITN for the
+# background worker and needs PAYFAST_ITN_QUEUE_MODE (system check payfast.E002)
+PAYFAST_VALIDATION_FAILURE_MODE = getattr(settings, 'PAYFAST_VALIDATION_FAILURE_MODE', 'reject')
+
+# Number of recently accepted ITNs remembered in-process to acknowledge retries cheaply
+PAYFAST_ITN_DEDUP_CACHE_SIZE = getattr(settings, 'PAYFAST_ITN_DEDUP_CACHE_SIZE', 10000)
+
+# Signed checkout forms are cached per payment (keyed on pk and updated_at)
+PAYFAST_CHECKOUT_CACHE_ALIAS = getattr(settings, 'PAYFAST_CHECKOUT_CACHE_ALIAS', 'default')
+PAYFAST_CHECKOUT_CACHE_TIMEOUT = getattr(settings, 'PAYFAST_CHECKOUT_CACHE_TIMEOUT', 3600)
+
+# Archival of old notifications (payfast_archive_notifications)
+PAYFAST_ARCHIVE_DIR = getattr(settings, 'PAYFAST_ARCHIVE_DIR', None)
+PAYFAST_ARCHIVE_COMPRESSION = getattr(settings, 'PAYFAST_ARCHIVE_COMPRESSION', 'gzip')
+PAYFAST_ARCHIVE_RETENTION_DAYS = getattr(settings, 'PAYFAST_ARCHIVE_RETENTION_DAYS', 90)
+
+# Payments API pagination: 'cursor' (keyset on created_at, id) or 'page'
+# (the original page-number envelope with exact totals)
+PAYFAST_API_PAGINATION = getattr(settings, 'PAYFAST_API_PAGINATION', 'cursor')
+PAYFAST_API_ESTIMATED_TOTAL = getattr(settings, 'PAYFAST_API_ESTIMATED_TOTAL', False)
+PAYFAST_API_COUNT_CACHE_TIMEOUT = getattr(settings, 'PAYFAST_API_COUNT_CACHE_TIMEOUT', 60)
+
+# Bulk payment creation (POST payments/bulk/); the item limit also applies
+# to bulk status updates
+PAYFAST_API_BULK_MAX_ITEMS = getattr(settings, 'PAYFAST_API_BULK_MAX_ITEMS', 1000)
+PAYFAST_API_BULK_INSERT_BATCH_SIZE = getattr(settings, 'PAYFAST_API_BULK_INSERT_BATCH_SIZE', 500)
+
+# Bulk status updates (POST payments/bulk-status/): ids per short transaction
+PAYFAST_API_BULK_UPDATE_CHUNK_SIZE = getattr(settings, 'PAYFAST_API_BULK_UPDATE_CHUNK_SIZE', 500)
+
+# Payment time series: buckets are cut in this time zone (default: TIME_ZONE);
+# hour buckets are only kept when PAYFAST_STATS_HOURLY is on
+PAYFAST_STATS_TIME_ZONE = getattr(settings, 'PAYFAST_STATS_TIME_ZONE', None)
+PAYFAST_STATS_HOURLY = getattr(settings, 'PAYFAST_STATS_HOURLY', False)
+
+# Counter rows each rollup total and time-series bucket is spread over, so
+# concurrent ITNs rarely update the same row
+PAYFAST_STATS_STRIPES = getattr(settings, 'PAYFAST_STATS_STRIPES', 8)
+
+# Streaming exports (GET payments/export/, payfast_export_payments): rows
+# fetched per database round trip
+PAYFAST_EXPORT_CHUNK_SIZE = getattr(settings, 'PAYFAST_EXPORT_CHUNK_SIZE', 2000)
+
+# Serialize list responses from values() rows with the compiled read-only
+# serializer instead of DRF model instances
+PAYFAST_API_COMPILED_SERIALIZERS = getattr(settings, 'PAYFAST_API_COMPILED_SERIALIZERS', True)
+
+# Payments API response cache: change counters and serialized list responses
+# (seconds; 0 keeps ETags but stores no responses)
+PAYFAST_API_CACHE_ALIAS = getattr(settings, 'PAYFAST_API_CACHE_ALIAS', 'default')
+PAYFAST_API_CACHE_TIMEOUT = getattr(settings, 'PAYFAST_API_CACHE_TIMEOUT', 300)
+
+# Seconds a payment status polled by the return page stays cached (entries
+# are replaced whenever the payment changes)
+PAYFAST_STATUS_CACHE_TIMEOUT = getattr(settings, 'PAYFAST_STATUS_CACHE_TIMEOUT', 3600)
+
+# Payment status events (payment/events/<pk>): broker class, longest wait in
+# seconds and seconds between fallback status reads
+PAYFAST_EVENTS_BROKER = getattr(settings, 'PAYFAST_EVENTS_BROKER', 'payfast.events.LocalBroker')
+PAYFAST_EVENTS_TIMEOUT = getattr(settings, 'PAYFAST_EVENTS_TIMEOUT', 30)
+PAYFAST_EVENTS_POLL_INTERVAL = getattr(settings, 'PAYFAST_EVENTS_POLL_INTERVAL', 2)
+
+# Route checkout/, checkout/<pk> and the ITN endpoints to their async views
+# (needs ASGI and Django 4.2+)
+PAYFAST_ASYNC_VIEWS = getattr(settings, 'PAYFAST_ASYNC_VIEWS', False)
+
+# Background threads that send payment_completed/failed/cancelled after the
+# transition commits (0 sends them inline, on commit), and how many sends
+# may wait for a thread before they run inline
+PAYFAST_SIGNAL_WORKERS = getattr(settings, 'PAYFAST_SIGNAL_WORKERS', 4)
+PAYFAST_SIGNAL_QUEUE_SIZE = getattr(settings, 'PAYFAST_SIGNAL_QUEUE_SIZE', 1000)
@@ -0,0 +1,190 @@
+# ============================================================================
+# payfast/events.py
+# ============================================================================
+
+"""
+Payment status events for Server-Sent Events and long-poll clients
+
+When a status change commits, its payment status (payfast.status) is
+published to a broker. Waiting clients are coroutines subscribed to their
+payment and are woken the moment it arrives. They do not block a worker
+thread and do not keep a database connection open while they wait.
+
+The default LocalBroker only reaches subscribers in the same process. Set
+PAYFAST_EVENTS_BROKER to a broker that shares events between processes (e.g.
+Redis pub/sub), or rely on the fallback: every PAYFAST_EVENTS_POLL_INTERVAL
+seconds a waiting client re-reads the status (from the status cache, or the
+database on a miss), so a change made by another process is delivered
+within one interval.
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from payfast import conf
+from payfast.status import get_payment_status
+
+# Yielded by watch_payment_status() on poll ticks without a change
+HEARTBEAT = object()
+
+
+class Subscription:
+    """Queue of events for one payment, read from one event loop"""
+
+    def __init__(self, broker, pk):
+        self.broker = broker
+        self.pk = pk
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, data):
+        """Hand an event to the subscriber (from any thread)"""
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, data)
+        except RuntimeError:
+            # The subscriber's event loop has closed
+            self.close()
+
+    async def get(self, timeout):
+        """Next event, or None after ``timeout`` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalBroker:
+    """
+    In-process publish/subscribe of payment status events
+
+    Other brokers need the same three methods: ``subscribe(pk)`` called on
+    the event loop, returning a Subscription-like object; ``unsubscribe``;
+    and a thread-safe ``publish(data)``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, pk):
+        subscription = Subscription(self, pk)
+        with self._lock:
+            self._subscriptions[pk].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.pk)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.pk]
+
+    def publish(self, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(data['id'], ()))
+        for subscription in subscriptions:
+            subscription.put(data)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Get the process-wide broker configured by PAYFAST_EVENTS_BROKER
+
+    Returns:
+        Broker instance
+    """
+    global _broker
+
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(conf.PAYFAST_EVENTS_BROKER)()
+    return _broker
+
+
+def publish_payment_statuses(statuses):
+    """Publish committed status_data() dictionaries to waiting clients"""
+    broker = get_broker()
+    for data in statuses:
+        broker.publish(data)
+
+
+def _read_status(pk):
+    try:
+        return get_payment_status(pk)
+    finally:
+        # Do not keep connections open while the client goes on waiting
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+
+
+async def aread_payment_status(pk):
+    """get_payment_status() for async code, releasing the database connection"""
+    return await sync_to_async(_read_status)(pk)
+
+
+async def watch_payment_status(pk, timeout=None, poll_interval=None):
+    """
+    Follow a payment until it leaves ``pending``
+
+    Yields the current status first. That is None if there is no such
+    payment, and it ends the stream if the status is no longer pending. Each
+    later change is yielded as it happens, with HEARTBEAT once per poll
+    interval in between. The stream ends after a status other than
+    ``pending`` or when ``timeout`` runs out.
+
+    Args:
+        pk: PayFastPayment primary key
+        timeout: Seconds to wait in total (default: PAYFAST_EVENTS_TIMEOUT)
+        poll_interval: Seconds between fallback reads
+            (default: PAYFAST_EVENTS_POLL_INTERVAL)
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (timeout if timeout is not None else conf.PAYFAST_EVENTS_TIMEOUT)
+    poll_interval = poll_interval or conf.PAYFAST_EVENTS_POLL_INTERVAL
+
+    # Subscribe before the first read so a change between the two is not lost
+    with get_broker().subscribe(pk) as subscription:
+        data = await aread_payment_status(pk)
+        yield data
+        if data is None or data['status'] != 'pending':
+            return
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            event = await subscription.get(min(poll_interval, remaining))
+            polled = event is None
+            if polled:
+                event = await aread_payment_status(pk)
+                if event is None:
+                    return
+            if event['status'] == data['status']:
+                if polled:
+                    yield HEARTBEAT
+                continue
+            data = event
+            yield data
+            if data['status'] != 'pending':
+                return
@@ -114,6 +114,24 @@ class DuplicatePaymentError(PayFastError):
     pass
 
 
+class DuplicateNotificationError(PayFastError):
+    """
+    Raised when an ITN has already been received and processed.
+    
+    PayFast re-sends a notification until it gets a 200 response. A
+    duplicate has the same pf_payment_id, payment_status and payload
+    as a notification already accepted, and should be acknowledged
+    without being applied again.
+    
+    Example:
+        try:
+            process_notification(notification)
+        except DuplicateNotificationError:
+            return HttpResponse('OK')
+    """
+    pass
+
+
 class InvalidPaymentStatusError(PayFastError):
     """
     Raised when a payment status is invalid or unexpected.
@@ -190,6 +208,24 @@ class PayFastAPIError(PayFastError):
     pass
 
 
+class PayFastValidationUnavailable(PayFastAPIError):
+    """
+    Raised when PayFast's validation service cannot be reached.
+    
+    This exception is raised when server-side ITN validation times out,
+    keeps failing after retries, or the circuit breaker is open because
+    PayFast has been failing recently. The notification is neither valid
+    nor invalid and should be retried later.
+    
+    Example:
+        try:
+            client.validate(post_data)
+        except PayFastValidationUnavailable:
+            defer_notification(notification)
+    """
+    pass
+
+
 class PaymentAlreadyProcessedError(PayFastError):
     """
     Raised when attempting to process a payment that has already been processed.
@@ -204,6 +240,23 @@ class PaymentAlreadyProcessedError(PayFastError):
     pass
 
 
+class PaymentConflictError(PayFastError):
+    """
+    Raised when a payment is saved after another writer changed it.
+    
+    Every write to a payment bumps its version, and save() only updates the
+    row if it still has the version the instance was loaded with. Reload
+    the payment and apply the change again.
+    
+    Example:
+        try:
+            payment.save()
+        except PaymentConflictError:
+            payment.refresh_from_db()
+    """
+    pass
+
+
 class InvalidCallbackURLError(PayFastError):
     """
     Raised when a callback URL is invalid or malformed.
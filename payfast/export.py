@@ -0,0 +1,149 @@
+# ============================================================================
+# payfast/export.py
+# ============================================================================
+
+"""
+Streaming CSV / NDJSON export of PayFastPayment
+
+Exports produce the columns of PayFastPaymentExportSerializer, formatted
+exactly as the serializer would, but rows are read with ``values()`` and
+``iterator(chunk_size=...)`` and formatted by the compiled serializer (see
+payfast.serializers.compiled). No model instances are created, so memory use
+is the same for a thousand rows or ten million. Unlike the serializer, every
+row has every column: ``user_id`` and ``user_email`` are null for payments
+without a user. Used by ``GET payments/export/`` and the
+``payfast_export_payments`` command.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from payfast import conf
+from payfast.models import PayFastPayment
+from payfast.serializers import PayFastPaymentExportSerializer, compile_serializer
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def get_export_serializer():
+    """Compiled PayFastPaymentExportSerializer, with every column in every row"""
+    return compile_serializer(PayFastPaymentExportSerializer, keep_missing=True)
+
+
+EXPORT_FIELDS = get_export_serializer().field_names
+
+
+def export_queryset(start=None, end=None, statuses=None):
+    """
+    Payments to export, oldest first
+
+    Args:
+        start: First local date of ``created_at`` to include
+        end: Last local date of ``created_at`` to include
+        statuses: Optional list of statuses to include
+
+    Returns:
+        PayFastPayment queryset ordered by primary key
+    """
+    queryset = PayFastPayment.objects.order_by('pk')
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end is not None:
+        queryset = queryset.filter(
+            created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+        )
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    return queryset
+
+
+def iter_export_rows(queryset, chunk_size=None):
+    """
+    Stream export rows as tuples in EXPORT_FIELDS order
+
+    Args:
+        queryset: PayFastPayment queryset (e.g. from export_queryset())
+        chunk_size: Rows fetched per database round trip
+            (default: PAYFAST_EXPORT_CHUNK_SIZE)
+
+    Yields:
+        Tuples of serializer-formatted values
+    """
+    serializer = get_export_serializer()
+    getters = [getter for _, getter in serializer.getters]
+    rows = serializer.values(queryset).iterator(chunk_size=chunk_size or conf.PAYFAST_EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield tuple([getter(row) for getter in getters])
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_csv(rows, batch_size=1000):
+    """
+    Encode export rows as CSV, header first
+
+    Args:
+        rows: Iterable of tuples from iter_export_rows()
+        batch_size: Rows joined into each yielded string
+
+    Yields:
+        CSV text chunks
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    for batch in _batched(rows, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+def iter_ndjson(rows, batch_size=1000):
+    """
+    Encode export rows as newline-delimited JSON objects
+
+    Args:
+        rows: Iterable of tuples from iter_export_rows()
+        batch_size: Rows joined into each yielded string
+
+    Yields:
+        NDJSON text chunks
+    """
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=str).encode
+    for batch in _batched(rows, batch_size):
+        yield ''.join([dumps(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in batch])
+
+
+def iter_export(export_format, queryset, chunk_size=None):
+    """
+    Stream an export in the given format
+
+    Args:
+        export_format: 'csv' or 'ndjson'
+        queryset: PayFastPayment queryset to export
+        chunk_size: Rows fetched per database round trip
+
+    Returns:
+        Iterator of text chunks
+    """
+    rows = iter_export_rows(queryset, chunk_size)
+    encode = iter_csv if export_format == 'csv' else iter_ndjson
+    return encode(rows)
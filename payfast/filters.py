@@ -0,0 +1,98 @@
+# ============================================================================
+# payfast/filters.py
+# ============================================================================
+
+"""
+Query-parameter filtering for the payments API
+
+Only filters that an index can serve are offered, so a filtered page is
+always an index range or lookup, never a walk over the whole table.
+INDEXED_FILTERS lists each parameter with the index behind it;
+tests/test_api.py checks the query plans of every combination.
+"""
+
+from django.db import connections
+from django.db.models import Q
+from rest_framework.filters import BaseFilterBackend
+
+from payfast.serializers import PaymentFilterSerializer
+
+# Query parameter -> index it is served by
+INDEXED_FILTERS = {
+    'status': 'payfast_pay_status_created_idx',
+    'created_after': 'payfast_pay_created_id_idx',
+    'created_before': 'payfast_pay_created_id_idx',
+    'completed_after': 'payfast_pay_completed_idx',
+    'completed_before': 'payfast_pay_completed_idx',
+    'user': 'payfast_pay_user_status_idx',
+    'email_address': 'payfast_pay_email_idx',
+    'm_payment_id_prefix': 'm_payment_id (unique)',
+}
+
+
+def prefix_q(field, prefix, using='default'):
+    """
+    Q object for values of ``field`` starting with ``prefix``
+
+    SQLite's LIKE ignores case and so cannot use an ordinary index; there the
+    prefix is also expressed as the equivalent range ``prefix <= value <
+    next(prefix)``, which can. Other backends use their own LIKE-prefix
+    index support (Django adds a ``varchar_pattern_ops`` index on
+    PostgreSQL).
+    """
+    q = Q(**{f'{field}__startswith': prefix})
+    if connections[using].vendor != 'sqlite':
+        return q
+    head = prefix
+    while head and ord(head[-1]) == 0x10FFFF:
+        head = head[:-1]
+    q &= Q(**{f'{field}__gte': prefix})
+    if head:
+        q &= Q(**{f'{field}__lt': head[:-1] + chr(ord(head[-1]) + 1)})
+    return q
+
+
+def filter_payments(queryset, filters):
+    """
+    Apply validated PaymentFilterSerializer data to a payment queryset
+
+    Args:
+        queryset: PayFastPayment queryset
+        filters: Validated filter values
+
+    Returns:
+        Filtered queryset
+    """
+    if filters.get('status'):
+        queryset = queryset.filter(status__in=filters['status'])
+    for name, lookup in [
+        ('created_after', 'created_at__gte'),
+        ('created_before', 'created_at__lt'),
+        ('user', 'user_id'),
+        ('email_address', 'email_address'),
+    ]:
+        if filters.get(name) is not None:
+            queryset = queryset.filter(**{lookup: filters[name]})
+
+    completed = {}
+    if filters.get('completed_after') is not None:
+        completed['completed_at__gte'] = filters['completed_after']
+    if filters.get('completed_before') is not None:
+        completed['completed_at__lt'] = filters['completed_before']
+    if completed:
+        # As a plain WHERE the planner may walk the (created_at, id) index to
+        # skip the sort and test every row; the id subquery makes it a range
+        # on the completed_at index instead
+        queryset = queryset.filter(pk__in=queryset.model.objects.filter(**completed).values('pk'))
+    if filters.get('m_payment_id_prefix'):
+        queryset = queryset.filter(prefix_q('m_payment_id', filters['m_payment_id_prefix'], queryset.db))
+    return queryset
+
+
+class PaymentFilterBackend(BaseFilterBackend):
+    """Filter the payments API with PaymentFilterSerializer query parameters"""
+
+    def filter_queryset(self, request, queryset, view):
+        params = PaymentFilterSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return filter_payments(queryset, params.validated_data)
@@ -0,0 +1,522 @@
+# ============================================================================
+# payfast/itn.py
+# ============================================================================
+
+"""
+ITN (Instant Transaction Notification) processing for dj-payfast
+
+PayFastNotifyView either processes a notification inline or, when
+PAYFAST_ITN_QUEUE_MODE is enabled, only stores the raw payload and answers
+PayFast straight away. Queued notifications are applied later by the
+``payfast_process_notifications`` management command, which uses the same
+``process_notification`` function as the inline path. The async notify view
+uses ``aenqueue_notification`` and ``aprocess_notification``.
+
+PayFast re-sends an ITN until it gets a 200 response. Accepted notifications
+are keyed on ``(pf_payment_id, payment_status, payload hash)``; a unique
+constraint on PayFastNotification guarantees each key is applied once, and a
+small in-process LRU acknowledges most retries without touching the database.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Subquery
+from django.utils import timezone
+
+from payfast import conf
+from payfast.exceptions import (
+    DuplicateNotificationError,
+    IPValidationError,
+    PaymentNotFoundError,
+    PayFastError,
+    PayFastValidationError,
+    PayFastValidationUnavailable,
+)
+from payfast.models import PayFastPayment, PayFastNotification
+from payfast.utils import validate_ip
+from payfast.validation import validate_with_payfast
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# Deduplication
+# ============================================================================
+
+class RecentNotifications:
+    """Thread-safe, bounded LRU of recently accepted notification keys"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+recent_notifications = RecentNotifications(conf.PAYFAST_ITN_DEDUP_CACHE_SIZE)
+
+
+def notification_key(post_data):
+    """
+    Build the deduplication key for an ITN payload
+
+    Args:
+        post_data: Dictionary of POST data received from PayFast
+
+    Returns:
+        Tuple of (pf_payment_id, payment_status, payload_hash)
+    """
+    payload = json.dumps(post_data, sort_keys=True, separators=(',', ':'), default=str)
+    return (
+        post_data.get('pf_payment_id') or '',
+        post_data.get('payment_status') or '',
+        hashlib.sha256(payload.encode()).hexdigest(),
+    )
+
+
+def is_duplicate(post_data):
+    """
+    Cheap in-process check for an ITN that was already accepted
+
+    A miss does not mean the ITN is new; the unique constraint checked when
+    the notification is saved is the source of truth.
+
+    Args:
+        post_data: Dictionary of POST data received from PayFast
+
+    Returns:
+        Boolean indicating if the ITN was recently accepted by this process
+    """
+    return notification_key(post_data) in recent_notifications
+
+
+def _save_accepted(notification, key):
+    """
+    Save an accepted notification under its deduplication key
+
+    Raises:
+        DuplicateNotificationError: If a notification with the same key exists
+    """
+    notification.pf_payment_id, notification.payment_status, notification.payload_hash = key
+    try:
+        with transaction.atomic():
+            notification.save()
+    except IntegrityError:
+        recent_notifications.add(key)
+        raise DuplicateNotificationError('Duplicate notification')
+
+
+# ============================================================================
+# Processing
+# ============================================================================
+
+def enqueue_notification(post_data, ip_address):
+    """
+    Store a raw ITN payload for background processing
+
+    Args:
+        post_data: Dictionary of POST data received from PayFast
+        ip_address: IP address the notification came from
+
+    Returns:
+        The queued PayFastNotification
+
+    Raises:
+        DuplicateNotificationError: If the same ITN was already queued
+    """
+    key = notification_key(post_data)
+    if key in recent_notifications:
+        raise DuplicateNotificationError('Duplicate notification')
+
+    notification = PayFastNotification(
+        raw_data=post_data,
+        ip_address=ip_address,
+        processing_state='queued',
+    )
+    _save_accepted(notification, key)
+    recent_notifications.add(key)
+    return notification
+
+
+async def aenqueue_notification(post_data, ip_address):
+    """Async version of enqueue_notification()"""
+    if notification_key(post_data) in recent_notifications:
+        raise DuplicateNotificationError('Duplicate notification')
+    return await sync_to_async(enqueue_notification)(post_data, ip_address)
+
+
+def process_notification(notification):
+    """
+    Validate a notification and apply it to its payment
+
+    The notification is saved whether or not it is valid, so every ITN
+    received from PayFast is logged. Duplicates of an accepted notification
+    are not saved again and never reach the payment. The payment only moves
+    up the status chain of PayFastPayment.TRANSITIONS (a FAILED notification
+    never undoes a completed payment); when this notification wins that
+    transition, ``payment_status_changed`` is sent once it commits.
+
+    Args:
+        notification: PayFastNotification (saved or unsaved) holding the raw data
+
+    Returns:
+        Boolean indicating if the notification changed the payment's status
+
+    Raises:
+        DuplicateNotificationError: If the notification was already accepted
+        IPValidationError: If the notification did not come from PayFast
+        PaymentNotFoundError: If no payment matches m_payment_id
+        PayFastValidationError: If PayFast did not confirm the notification
+        PayFastValidationUnavailable: If PayFast could not be asked; with
+            PAYFAST_VALIDATION_FAILURE_MODE = 'defer' the notification is
+            left in the queue for the background worker
+    """
+    post_data = notification.raw_data
+    key = _new_notification_key(notification)
+
+    try:
+        # Validate IP address
+        if not validate_ip(notification.ip_address):
+            raise IPValidationError('Invalid IP address')
+
+        # Validate with PayFast server
+        if conf.PAYFAST_VALIDATE_WITH_SERVER and not validate_with_payfast(post_data):
+            raise PayFastValidationError('Server validation failed')
+    except PayFastError as e:
+        _record_failure(notification, key, e)
+        raise
+
+    return _accept_notification(notification, key)
+
+
+async def aprocess_notification(notification):
+    """
+    Async version of process_notification()
+
+    PayFast is asked from a worker thread of its own, so a slow validation
+    round trip does not hold up the thread that runs sync code for async
+    views. The payment update and notification insert share one transaction,
+    which Django only supports in sync code, so they run in a single
+    ``sync_to_async`` call.
+
+    Args:
+        notification: Unsaved PayFastNotification holding the raw data
+
+    Returns:
+        Boolean indicating if the notification changed the payment's status
+
+    Raises:
+        The same exceptions as process_notification()
+    """
+    post_data = notification.raw_data
+    key = _new_notification_key(notification)
+
+    try:
+        if not validate_ip(notification.ip_address):
+            raise IPValidationError('Invalid IP address')
+
+        if conf.PAYFAST_VALIDATE_WITH_SERVER:
+            valid = await sync_to_async(validate_with_payfast, thread_sensitive=False)(post_data)
+            if not valid:
+                raise PayFastValidationError('Server validation failed')
+    except PayFastError as e:
+        await sync_to_async(_record_failure)(notification, key, e)
+        raise
+
+    return await sync_to_async(_accept_notification)(notification, key)
+
+
+def _new_notification_key(notification):
+    """Deduplication key of a notification, unless it was recently accepted"""
+    key = notification_key(notification.raw_data)
+    if notification.pk is None and key in recent_notifications:
+        raise DuplicateNotificationError('Duplicate notification')
+    return key
+
+
+def _accept_notification(notification, key):
+    """Apply a validated notification (transition() sends its signals)"""
+    try:
+        from_status = _apply_notification(notification, key)
+    except PayFastError as e:
+        _record_failure(notification, key, e)
+        raise
+
+    recent_notifications.add(key)
+    return from_status is not None
+
+
+def _record_failure(notification, key, error):
+    """Log a notification that was not applied (duplicates are not logged again)"""
+    if isinstance(error, DuplicateNotificationError):
+        return
+    if isinstance(error, PayFastValidationUnavailable):
+        # Neither valid nor invalid: queue it for the worker or let PayFast retry
+        notification.is_valid = False
+        notification.validation_errors = str(error)
+        if conf.PAYFAST_VALIDATION_FAILURE_MODE == 'defer':
+            notification.processing_state = 'queued'
+            _save_accepted(notification, key)
+        else:
+            notification.processing_state = 'failed'
+            notification.processed_at = timezone.now()
+            notification.payload_hash = None
+            notification.save()
+        return
+    _save_rejected(notification, error)
+
+
+def _apply_notification(notification, key):
+    """
+    Apply an accepted notification in one short transaction
+
+    The payment is moved with a conditional UPDATE (apply_itn()) and the
+    notification is inserted with its payment foreign key resolved by a
+    subquery, so the happy path never reads the payment row. If the insert
+    hits the deduplication constraint the UPDATE is rolled back with it.
+
+    Returns:
+        Status this notification moved the payment from, or None
+
+    Raises:
+        DuplicateNotificationError: If a notification with the same key exists
+        PaymentNotFoundError: If no payment matches m_payment_id
+    """
+    post_data = notification.raw_data
+    m_payment_id = post_data.get('m_payment_id')
+    payments = PayFastPayment.objects.filter(m_payment_id=m_payment_id)
+
+    notification.pf_payment_id, notification.payment_status, notification.payload_hash = key
+    notification.payment_id = Subquery(payments.values('pk')[:1])
+    notification.is_valid = True
+    notification.validation_errors = ''
+    notification.processing_state = 'processed'
+    notification.processed_at = timezone.now()
+
+    try:
+        with transaction.atomic():
+            from_status = payments.apply_itn(post_data)
+            if from_status is None and not payments.exists():
+                raise PaymentNotFoundError('Payment not found')
+            notification.save()
+    except IntegrityError:
+        recent_notifications.add(key)
+        raise DuplicateNotificationError('Duplicate notification')
+    finally:
+        # The subquery was evaluated by the database; load the real id lazily
+        notification.__dict__.pop('payment_id', None)
+    return from_status
+
+
+def _save_rejected(notification, error):
+    """Log a rejected notification without a deduplication hash"""
+    notification.payment_id = None
+    notification.is_valid = False
+    notification.validation_errors = str(error)
+    notification.processing_state = 'failed'
+    notification.processed_at = timezone.now()
+    notification.payload_hash = None
+    notification.save()
+
+
+# ============================================================================
+# Queue helpers
+# ============================================================================
+
+def queue_depth():
+    """
+    Count notifications waiting for the background worker
+
+    Returns:
+        Dictionary mapping each processing state to its number of notifications
+    """
+    depth = {state: 0 for state, _ in PayFastNotification.PROCESSING_STATE_CHOICES}
+    rows = (
+        PayFastNotification.objects
+        .filter(processing_state__in=['queued', 'processing'])
+        .order_by()
+        .values_list('processing_state')
+        .annotate(total=Count('pk'))
+    )
+    for state, total in rows:
+        depth[state] = total
+    return depth
+
+
+def claim_notifications(limit):
+    """
+    Claim up to ``limit`` queued notifications for this worker
+
+    Claimed notifications move to the ``processing`` state so that other
+    workers skip them. Databases that support ``SKIP LOCKED`` claim the whole
+    batch in one transaction; others fall back to a conditional update per row.
+
+    Args:
+        limit: Maximum number of notifications to claim
+
+    Returns:
+        List of claimed notification ids, oldest first
+    """
+    queued = PayFastNotification.objects.filter(processing_state='queued').order_by('pk')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(
+                queued.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit]
+            )
+            PayFastNotification.objects.filter(pk__in=ids).update(processing_state='processing')
+        return ids
+
+    claimed = []
+    for pk in queued.values_list('pk', flat=True)[:limit]:
+        updated = PayFastNotification.objects.filter(
+            pk=pk, processing_state='queued'
+        ).update(processing_state='processing')
+        if updated:
+            claimed.append(pk)
+    return claimed
+
+
+def process_queued_notification(notification_id):
+    """
+    Process a single claimed notification by id
+
+    Args:
+        notification_id: Primary key of a notification in the processing state
+
+    Returns:
+        The resulting processing state: 'processed', 'failed', or 'queued'
+        when validation was deferred
+    """
+    notification = PayFastNotification.objects.get(pk=notification_id)
+    try:
+        process_notification(notification)
+    except PayFastError:
+        return notification.processing_state
+    except Exception as e:
+        # Keep the worker alive and leave the row inspectable in the admin
+        logger.exception('Failed to process notification %s', notification_id)
+        PayFastNotification.objects.filter(pk=notification_id).update(
+            processing_state='failed',
+            validation_errors=f'Processing error: {e}',
+            processed_at=timezone.now(),
+        )
+        return 'failed'
+    return notification.processing_state
+
+
+def requeue_stale_notifications():
+    """
+    Move notifications left in the processing state back to the queue
+
+    Use this after a worker crashed part-way through a batch.
+
+    Returns:
+        Number of notifications re-queued
+    """
+    return PayFastNotification.objects.filter(
+        processing_state='processing'
+    ).update(processing_state='queued')
+
+
+# ============================================================================
+# Replay
+# ============================================================================
+
+REPLAY_OUTCOMES = ('applied', 'unchanged', 'duplicate', 'rejected', 'deferred', 'error')
+
+
+def replay_notification(notification):
+    """
+    Re-verify and re-apply one stored or archived notification
+
+    Replaying is idempotent: a payment never moves down the status chain and an
+    already accepted payload is caught by the deduplication constraint.
+
+    Args:
+        notification: PayFastNotification, saved or rebuilt from the archive
+
+    Returns:
+        Outcome, one of REPLAY_OUTCOMES
+    """
+    try:
+        won = process_notification(notification)
+    except DuplicateNotificationError:
+        return 'duplicate'
+    except PayFastValidationUnavailable:
+        return 'deferred' if notification.processing_state == 'queued' else 'rejected'
+    except PayFastError:
+        return 'rejected'
+    except Exception:
+        logger.exception('Failed to replay notification %s', notification.pk)
+        return 'error'
+    return 'applied' if won else 'unchanged'
+
+
+def replay_notifications(notification_ids):
+    """
+    Replay a batch of stored notifications in id order
+
+    Each notification is validated and committed on its own, as
+    process_notification() does for a live ITN, so no transaction stays open
+    across the validation calls to PayFast and live ITNs never wait behind a
+    replay.
+
+    Args:
+        notification_ids: Iterable of PayFastNotification primary keys
+
+    Returns:
+        Dictionary mapping each outcome in REPLAY_OUTCOMES to its count
+    """
+    notifications = PayFastNotification.objects.filter(pk__in=list(notification_ids)).order_by('pk')
+    return _replay_batch(notifications)
+
+
+def replay_archived_notifications(records):
+    """
+    Replay a batch of archived notification records
+
+    Archived rows are no longer in the database, so each replay is logged as
+    a new notification.
+
+    Args:
+        records: Iterable of record dictionaries from payfast.archive
+
+    Returns:
+        Dictionary mapping each outcome in REPLAY_OUTCOMES to its count
+    """
+    return _replay_batch(
+        PayFastNotification(raw_data=record['raw_data'], ip_address=record['ip_address'])
+        for record in records
+    )
+
+
+def _replay_batch(notifications):
+    results = dict.fromkeys(REPLAY_OUTCOMES, 0)
+    for notification in notifications:
+        results[replay_notification(notification)] += 1
+    return results
+
@@ -0,0 +1,123 @@
+# ============================================================================
+# payfast/management/commands/payfast_archive_notifications.py
+# ============================================================================
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from payfast import conf
+from payfast.archive import ARCHIVE_FIELDS, EXTENSIONS, NotificationArchive
+from payfast.models import PayFastNotification
+from payfast.utils import iter_id_chunks
+
+
+class Command(BaseCommand):
+    help = 'Move old ITN notifications from the database to compressed archive segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=conf.PAYFAST_ARCHIVE_RETENTION_DAYS,
+            help='Archive notifications received more than this many days ago',
+        )
+        parser.add_argument(
+            '--archive-dir',
+            default=conf.PAYFAST_ARCHIVE_DIR,
+            help='Directory for segment files (default: PAYFAST_ARCHIVE_DIR)',
+        )
+        parser.add_argument(
+            '--compression',
+            choices=sorted(EXTENSIONS),
+            default=conf.PAYFAST_ARCHIVE_COMPRESSION,
+            help='Compression for new segments',
+        )
+        parser.add_argument(
+            '--segment-size',
+            type=int,
+            default=100000,
+            help='Maximum number of notifications per segment file',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of rows read or deleted per query',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the notifications that would be archived',
+        )
+
+    def handle(self, *args, **options):
+        if not options['archive_dir']:
+            raise CommandError('Set PAYFAST_ARCHIVE_DIR or pass --archive-dir')
+
+        archive = NotificationArchive(options['archive_dir'], compression=options['compression'])
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        chunk_size = max(1, options['chunk_size'])
+        segment_size = max(1, options['segment_size'])
+
+        # Queued notifications have not been applied yet and stay in the database
+        queryset = PayFastNotification.objects.filter(created_at__lt=cutoff).exclude(
+            processing_state__in=['queued', 'processing']
+        )
+        total = queryset.count()
+        self.stdout.write(f'{total} notification(s) older than {cutoff:%Y-%m-%d %H:%M} to archive')
+        if options['dry_run']:
+            return
+
+        self.chunk_size = chunk_size
+        leftover = self.finish_interrupted_run(archive)
+        if leftover:
+            self.stdout.write(f'Deleted {leftover} row(s) already archived by an interrupted run')
+
+        started = time.monotonic()
+        archived = 0
+        records = []
+        for ids in iter_id_chunks(queryset, chunk_size):
+            records.extend(queryset.filter(pk__in=ids).order_by('pk').values(*ARCHIVE_FIELDS))
+            if len(records) >= segment_size:
+                archived += self.flush(archive, records[:segment_size])
+                records = records[segment_size:]
+        if records:
+            archived += self.flush(archive, records)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {archived} notification(s) archived in {elapsed:.1f}s'
+        ))
+
+    def flush(self, archive, records):
+        """Write one segment, then delete its rows"""
+        segment = archive.write_segment(records)
+        deleted = self.delete_ids([record['id'] for record in records])
+        archive.close_segment(segment)
+        self.stdout.write(f'Wrote {segment.path} ({len(records)} notifications, {deleted} rows deleted)')
+        return len(records)
+
+    def finish_interrupted_run(self, archive):
+        """
+        Delete rows of segments that are still open and close them
+
+        A segment stays open from before it is renamed into place until its
+        rows are deleted, so these are exactly the segments a crashed run
+        left behind.
+        """
+        deleted = 0
+        for segment in archive.open_segments():
+            deleted += self.delete_ids(segment.ids())
+            archive.close_segment(segment)
+        return deleted
+
+    def delete_ids(self, ids):
+        """Delete notifications by id in short, chunked statements"""
+        deleted = 0
+        for start in range(0, len(ids), self.chunk_size):
+            chunk = ids[start:start + self.chunk_size]
+            deleted += PayFastNotification.objects.filter(pk__in=chunk).delete()[0]
+        return deleted
@@ -0,0 +1,77 @@
+# ============================================================================
+# payfast/management/commands/payfast_export_payments.py
+# ============================================================================
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payfast import conf
+from payfast.export import FORMATS, export_queryset, iter_export
+from payfast.models import PayFastPayment
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Stream payments to a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=sorted(FORMATS),
+            default='csv',
+            help='Output format',
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write (default: standard output)',
+        )
+        parser.add_argument(
+            '--start',
+            type=parse_date,
+            help='First local date of creation to include (YYYY-MM-DD)',
+        )
+        parser.add_argument(
+            '--end',
+            type=parse_date,
+            help='Last local date of creation to include (YYYY-MM-DD)',
+        )
+        parser.add_argument(
+            '--status',
+            action='append',
+            choices=[value for value, _ in PayFastPayment.STATUS_CHOICES],
+            help='Only export payments with this status (may be repeated)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=conf.PAYFAST_EXPORT_CHUNK_SIZE,
+            help='Number of rows read per query',
+        )
+
+    def handle(self, *args, **options):
+        if options['start'] and options['end'] and options['start'] > options['end']:
+            raise CommandError('--start must not be after --end')
+
+        queryset = export_queryset(
+            start=options['start'],
+            end=options['end'],
+            statuses=options['status'],
+        )
+        chunks = iter_export(options['format'], queryset, chunk_size=options['chunk_size'])
+
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(f'Exported payments to {options["output"]}')
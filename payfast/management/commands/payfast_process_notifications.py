@@ -0,0 +1,110 @@
+# ============================================================================
+# payfast/management/commands/payfast_process_notifications.py
+# ============================================================================
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from payfast import conf
+from payfast.itn import (
+    claim_notifications,
+    process_queued_notification,
+    queue_depth,
+    requeue_stale_notifications,
+)
+
+
+def _process(notification_id):
+    """Process one notification on a worker thread and release its DB connection"""
+    try:
+        return process_queued_notification(notification_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Process ITN notifications queued by PayFastNotifyView (PAYFAST_ITN_QUEUE_MODE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=conf.PAYFAST_ITN_WORKER_CONCURRENCY,
+            help='Maximum number of notifications processed at the same time',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=conf.PAYFAST_ITN_WORKER_BATCH_SIZE,
+            help='Number of notifications claimed from the queue at a time',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Seconds to wait before polling an empty queue again',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the queue and exit instead of polling forever',
+        )
+        parser.add_argument(
+            '--requeue',
+            action='store_true',
+            help='Move notifications left in the processing state back to the queue first',
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Print the queue depth and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for state, total in queue_depth().items():
+                self.stdout.write(f'{state}: {total}')
+            return
+
+        if options['requeue']:
+            requeued = requeue_stale_notifications()
+            self.stdout.write(f'Re-queued {requeued} notification(s)')
+
+        concurrency = max(1, options['concurrency'])
+        processed = failed = deferred = 0
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                ids = claim_notifications(options['batch_size'])
+                if not ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+
+                if concurrency == 1:
+                    results = [process_queued_notification(pk) for pk in ids]
+                else:
+                    results = list(executor.map(_process, ids))
+
+                processed += results.count('processed')
+                failed += results.count('failed')
+                deferred += results.count('queued')
+                self.stdout.write(
+                    f'Processed {len(results)} notification(s) '
+                    f'({processed} applied, {failed} rejected so far)'
+                )
+
+                if 'queued' in results:
+                    # PayFast validation is unavailable; back off instead of
+                    # immediately re-claiming the deferred notifications
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {processed} applied, {failed} rejected, {deferred} deferred'
+        ))
@@ -0,0 +1,50 @@
+# ============================================================================
+# payfast/management/commands/payfast_rebuild_stats.py
+# ============================================================================
+
+from django.core.management.base import BaseCommand
+
+from payfast.models import PayFastPaymentBucket, PayFastPaymentStats
+from payfast.models.stats import get_bucket_granularities
+
+
+class Command(BaseCommand):
+    help = 'Recompute the payment statistics rollup and time-series buckets from the payments table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report rows that differ from the payments table',
+        )
+
+    def handle(self, *args, **options):
+        current = PayFastPaymentStats.objects.totals()
+        if options['dry_run']:
+            computed = PayFastPaymentStats.objects.compute()
+        else:
+            computed = PayFastPaymentStats.objects.rebuild()
+
+        drifted = 0
+        for status, values in computed.items():
+            if current.get(status) != values:
+                drifted += 1
+                self.stdout.write(
+                    f'{status}: {self.describe(current.get(status))} -> {self.describe(values)}'
+                )
+
+        if options['dry_run']:
+            self.stdout.write(f'{drifted} status row(s) differ')
+            return
+
+        # Buckets are rewritten whole; e.g. after changing PAYFAST_STATS_TIME_ZONE
+        for granularity in get_bucket_granularities():
+            written = PayFastPaymentBucket.objects.rebuild(granularity)
+            self.stdout.write(f'Rebuilt {written} {granularity} bucket(s)')
+        self.stdout.write(self.style.SUCCESS(f'Done: {drifted} status row(s) corrected'))
+
+    def describe(self, values):
+        if values is None:
+            return 'missing'
+        count, amount, fees, net = values
+        return f'{count} payments, amount {amount}, fees {fees}, net {net}'
@@ -0,0 +1,223 @@
+# ============================================================================
+# payfast/management/commands/payfast_replay_notifications.py
+# ============================================================================
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, time as dt_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from payfast.utils import iter_id_chunks
+
+
+def _init_worker():
+    """Set up Django in a freshly spawned worker process"""
+    import django
+    django.setup()
+
+
+def _replay_chunk(chunk, archived=False):
+    """Replay one chunk of ids (or archived records) in a worker process"""
+    # Imported here so spawned workers can unpickle this function before
+    # Django's app registry is ready
+    from django.db import connections
+    from payfast.itn import replay_archived_notifications, replay_notifications
+
+    try:
+        replay = replay_archived_notifications if archived else replay_notifications
+        return len(chunk), replay(chunk)
+    finally:
+        connections.close_all()
+
+
+def _iter_record_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parse_when(value):
+    """Parse an ISO date or datetime into an aware datetime"""
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date or datetime: {value}')
+        when = datetime.combine(day, dt_time.min)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+class Command(BaseCommand):
+    help = 'Re-verify and re-apply stored ITN notifications (e.g. after an outage)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start-id',
+            type=int,
+            help='Lowest notification id to replay',
+        )
+        parser.add_argument(
+            '--end-id',
+            type=int,
+            help='Highest notification id to replay',
+        )
+        parser.add_argument(
+            '--since',
+            help='Only replay notifications received at or after this ISO date/datetime',
+        )
+        parser.add_argument(
+            '--until',
+            help='Only replay notifications received before this ISO date/datetime',
+        )
+        parser.add_argument(
+            '--state',
+            action='append',
+            choices=['queued', 'processing', 'processed', 'failed'],
+            help='Processing state to replay; repeat for several (default: failed and queued)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of notifications handed to a worker at a time',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes (1 replays in this process)',
+        )
+        parser.add_argument(
+            '--archived',
+            action='store_true',
+            help='Replay notifications from the archive (PAYFAST_ARCHIVE_DIR) instead of the database',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the notifications that would be replayed',
+        )
+
+    def get_queryset(self, options):
+        from payfast.models import PayFastNotification
+
+        queryset = PayFastNotification.objects.filter(
+            processing_state__in=options['state'] or ['failed', 'queued']
+        )
+        if options['start_id'] is not None:
+            queryset = queryset.filter(pk__gte=options['start_id'])
+        if options['end_id'] is not None:
+            queryset = queryset.filter(pk__lte=options['end_id'])
+        if options['since']:
+            queryset = queryset.filter(created_at__gte=_parse_when(options['since']))
+        if options['until']:
+            queryset = queryset.filter(created_at__lt=_parse_when(options['until']))
+        return queryset
+
+    def get_archived_records(self, options):
+        from payfast.archive import get_archive
+
+        archive = get_archive()
+        if archive is None:
+            raise CommandError('--archived needs PAYFAST_ARCHIVE_DIR to be set')
+        states = options['state'] or ['failed', 'queued']
+        return (
+            record
+            for record in archive.iter_records(
+                start_id=options['start_id'],
+                end_id=options['end_id'],
+                since=_parse_when(options['since']) if options['since'] else None,
+                until=_parse_when(options['until']) if options['until'] else None,
+            )
+            if record['processing_state'] in states
+        )
+
+    def handle(self, *args, **options):
+        from django.db import connection
+        from payfast.itn import REPLAY_OUTCOMES, replay_archived_notifications, replay_notifications
+
+        archived = options['archived']
+        if archived:
+            # Segments are read twice (count, then replay) rather than held in memory
+            total = sum(1 for _ in self.get_archived_records(options))
+        else:
+            queryset = self.get_queryset(options)
+            total = queryset.count()
+        self.stdout.write(f'{total} notification(s) to replay')
+        if options['dry_run'] or not total:
+            return
+
+        chunk_size = max(1, options['chunk_size'])
+        processes = max(1, options['processes'])
+        if processes > 1 and connection.vendor == 'sqlite':
+            # SQLite allows a single writer; extra processes only add lock errors
+            self.stderr.write('SQLite does not support concurrent writers; using 1 process')
+            processes = 1
+        totals = dict.fromkeys(REPLAY_OUTCOMES, 0)
+        self.done = 0
+        self.started = time.monotonic()
+
+        def record(count, results):
+            self.done += count
+            for outcome, number in results.items():
+                totals[outcome] += number
+            self.report_progress(total)
+
+        if archived:
+            chunks = _iter_record_chunks(self.get_archived_records(options), chunk_size)
+            replay = replay_archived_notifications
+        else:
+            chunks = iter_id_chunks(queryset, chunk_size)
+            replay = replay_notifications
+
+        if processes == 1:
+            for chunk in chunks:
+                record(len(chunk), replay(chunk))
+        else:
+            self.replay_in_pool(chunks, processes, record, archived)
+
+        elapsed = time.monotonic() - self.started
+        summary = ', '.join(f'{totals[outcome]} {outcome}' for outcome in REPLAY_OUTCOMES)
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {self.done} replayed in {elapsed:.1f}s '
+            f'({self.done / elapsed if elapsed else 0:.0f}/s): {summary}'
+        ))
+
+    def replay_in_pool(self, chunks, processes, record, archived=False):
+        """Fan chunks out to a process pool, keeping a bounded number in flight"""
+        from django.db import connections
+
+        # Workers open their own connections; don't share ours across processes
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(
+            max_workers=processes, mp_context=context, initializer=_init_worker
+        ) as executor:
+            pending = set()
+            for chunk in chunks:
+                pending.add(executor.submit(_replay_chunk, chunk, archived))
+                if len(pending) >= processes * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(*future.result())
+            for future in pending:
+                record(*future.result())
+
+    def report_progress(self, total):
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0
+        self.stdout.write(
+            f'Replayed {self.done}/{total} ({self.done * 100 // total}%) - {rate:.0f}/s'
+        )
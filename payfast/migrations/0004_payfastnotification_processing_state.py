@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0003_alter_payfastpayment_m_payment_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payfastnotification',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payfastnotification',
+            name='processing_state',
+            field=models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('processed', 'Processed'), ('failed', 'Failed')], db_index=True, default='processed', max_length=20),
+        ),
+    ]
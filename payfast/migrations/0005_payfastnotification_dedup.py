@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0004_payfastnotification_processing_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payfastnotification',
+            name='payload_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of raw_data', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='payfastnotification',
+            name='payment_status',
+            field=models.CharField(blank=True, default='', help_text='PayFast payment status', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='payfastnotification',
+            name='pf_payment_id',
+            field=models.CharField(blank=True, default='', help_text='PayFast payment ID', max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='payfastnotification',
+            constraint=models.UniqueConstraint(fields=('pf_payment_id', 'payment_status', 'payload_hash'), name='payfast_unique_notification'),
+        ),
+    ]
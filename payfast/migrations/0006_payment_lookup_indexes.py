@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:48
+
+import payfast.utils
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_m_payment_ids(apps, schema_editor):
+    """Fail with a readable message instead of an IntegrityError"""
+    PayFastPayment = apps.get_model('payfast', 'PayFastPayment')
+    duplicates = list(
+        PayFastPayment.objects.using(schema_editor.connection.alias)
+        .order_by()
+        .values_list('m_payment_id', flat=True)
+        .annotate(total=Count('pk'))
+        .filter(total__gt=1)[:10]
+    )
+    if duplicates:
+        raise RuntimeError(
+            'Cannot make PayFastPayment.m_payment_id unique; duplicated values '
+            f'(first 10): {", ".join(duplicates)}. Rename or remove the '
+            'duplicates and run migrate again.'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0005_payfastnotification_dedup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_m_payment_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payfastpayment',
+            name='m_payment_id',
+            field=models.CharField(default=payfast.utils.generate_pf_id, help_text='Unique payment ID from merchant', max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='payfastpayment',
+            name='pf_payment_id',
+            field=models.CharField(blank=True, db_index=True, help_text='PayFast payment ID', max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='payfastpayment',
+            index=models.Index(fields=['user', 'status', '-created_at'], name='payfast_pay_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payfastpayment',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['user', 'created_at'], name='payfast_pay_pending_user_idx'),
+        ),
+    ]
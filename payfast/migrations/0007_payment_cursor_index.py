@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0006_payment_lookup_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payfastpayment',
+            index=models.Index(fields=['-created_at', '-id'], name='payfast_pay_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:02
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+STATUSES = ['pending', 'complete', 'failed', 'cancelled']
+
+
+def fill_payment_stats(apps, schema_editor):
+    """Build the rollup from existing payments with one aggregate query"""
+    PayFastPayment = apps.get_model('payfast', 'PayFastPayment')
+    PayFastPaymentStats = apps.get_model('payfast', 'PayFastPaymentStats')
+    alias = schema_editor.connection.alias
+
+    aggregates = {}
+    for status in STATUSES:
+        in_status = Q(status=status)
+        aggregates[f'{status}_count'] = Count('pk', filter=in_status)
+        aggregates[f'{status}_amount'] = Sum('amount', filter=in_status)
+        aggregates[f'{status}_fees'] = Sum('amount_fee', filter=in_status)
+        aggregates[f'{status}_net'] = Sum('amount_net', filter=in_status)
+    totals = PayFastPayment.objects.using(alias).order_by().aggregate(**aggregates)
+
+    PayFastPaymentStats.objects.using(alias).bulk_create([
+        PayFastPaymentStats(
+            status=status,
+            payment_count=totals[f'{status}_count'],
+            total_amount=totals[f'{status}_amount'] or Decimal('0.00'),
+            total_fees=totals[f'{status}_fees'] or Decimal('0.00'),
+            total_net=totals[f'{status}_net'] or Decimal('0.00'),
+        )
+        for status in STATUSES
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0007_payment_cursor_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayFastPaymentStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('complete', 'Complete'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], max_length=20, unique=True)),
+                ('payment_count', models.BigIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('total_fees', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('total_net', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'PayFast Payment Statistics',
+                'verbose_name_plural': 'PayFast Payment Statistics',
+            },
+        ),
+        migrations.RunPython(fill_payment_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:04
+
+from decimal import Decimal
+
+try:
+    import zoneinfo
+except ImportError:  # Python 3.8
+    from backports import zoneinfo
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import ExtractHour, TruncDate
+
+STATUS_COLUMNS = {
+    'pending': 'pending_count',
+    'complete': 'completed_count',
+    'failed': 'failed_count',
+    'cancelled': 'cancelled_count',
+}
+
+
+def fill_payment_buckets(apps, schema_editor):
+    """Build the time-series buckets from existing payments"""
+    PayFastPayment = apps.get_model('payfast', 'PayFastPayment')
+    PayFastPaymentBucket = apps.get_model('payfast', 'PayFastPaymentBucket')
+    alias = schema_editor.connection.alias
+    tz = zoneinfo.ZoneInfo(getattr(settings, 'PAYFAST_STATS_TIME_ZONE', None) or settings.TIME_ZONE)
+    granularities = ['day', 'hour'] if getattr(settings, 'PAYFAST_STATS_HOURLY', False) else ['day']
+
+    aggregates = {
+        'payment_count': Count('pk'),
+        'total_amount': Sum('amount'),
+        'completed_amount': Sum('amount', filter=Q(status='complete')),
+    }
+    for status, column in STATUS_COLUMNS.items():
+        aggregates[column] = Count('pk', filter=Q(status=status))
+
+    for granularity in granularities:
+        payments = PayFastPayment.objects.using(alias).order_by().annotate(
+            _date=TruncDate('created_at', tzinfo=tz)
+        )
+        group_by = ['_date']
+        if granularity == 'hour':
+            payments = payments.annotate(_hour=ExtractHour('created_at', tzinfo=tz))
+            group_by.append('_hour')
+        PayFastPaymentBucket.objects.using(alias).bulk_create([
+            PayFastPaymentBucket(
+                granularity=granularity,
+                date=row.pop('_date'),
+                hour=row.pop('_hour', 0),
+                total_amount=row.pop('total_amount') or Decimal('0.00'),
+                completed_amount=row.pop('completed_amount') or Decimal('0.00'),
+                **row
+            )
+            for row in payments.values(*group_by).annotate(**aggregates)
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0008_payment_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayFastPaymentBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('day', 'Day'), ('hour', 'Hour')], default='day', max_length=4)),
+                ('date', models.DateField(help_text='Local date in PAYFAST_STATS_TIME_ZONE')),
+                ('hour', models.PositiveSmallIntegerField(default=0, help_text='Local hour (0 for day buckets)')),
+                ('payment_count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('pending_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('completed_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('failed_count', models.IntegerField(default=0)),
+                ('cancelled_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'PayFast Payment Time Bucket',
+                'verbose_name_plural': 'PayFast Payment Time Buckets',
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'date', 'hour'), name='payfast_bucket_unique')],
+            },
+        ),
+        migrations.RunPython(fill_payment_buckets, migrations.RunPython.noop),
+    ]
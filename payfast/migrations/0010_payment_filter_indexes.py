@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0009_payment_buckets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payfastpayment',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='payfast_pay_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payfastpayment',
+            index=models.Index(fields=['completed_at'], name='payfast_pay_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payfastpayment',
+            index=models.Index(fields=['email_address', '-created_at'], name='payfast_pay_email_idx'),
+        ),
+    ]
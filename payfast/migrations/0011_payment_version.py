@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0010_payment_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payfastpayment',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped by every write, for compare-and-swap updates'),
+        ),
+    ]
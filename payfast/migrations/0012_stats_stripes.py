@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def add_stats_stripes(apps, schema_editor):
+    """Create the empty stripes of every existing status row"""
+    PayFastPaymentStats = apps.get_model('payfast', 'PayFastPaymentStats')
+    alias = schema_editor.connection.alias
+    stripes = max(1, getattr(settings, 'PAYFAST_STATS_STRIPES', 8))
+    statuses = PayFastPaymentStats.objects.using(alias).values_list('status', flat=True)
+    PayFastPaymentStats.objects.using(alias).bulk_create([
+        PayFastPaymentStats(status=status, stripe=stripe)
+        for status in statuses
+        for stripe in range(1, stripes)
+    ])
+
+
+def fold_stripes(model, alias, key, columns):
+    """Add every stripe of each key into one row at stripe 0"""
+    folded = {}
+    for row in model.objects.using(alias).order_by('stripe'):
+        first = folded.setdefault(tuple(getattr(row, field) for field in key), row)
+        if first is not row:
+            for column in columns:
+                setattr(first, column, getattr(first, column) + getattr(row, column))
+            row.delete()
+    for row in folded.values():
+        row.stripe = 0
+        row.save()
+
+
+def remove_stats_stripes(apps, schema_editor):
+    """Fold the stripes back into one row per status and bucket"""
+    alias = schema_editor.connection.alias
+    fold_stripes(
+        apps.get_model('payfast', 'PayFastPaymentStats'), alias, ['status'],
+        ['payment_count', 'total_amount', 'total_fees', 'total_net'],
+    )
+    fold_stripes(
+        apps.get_model('payfast', 'PayFastPaymentBucket'), alias, ['granularity', 'date', 'hour'],
+        ['payment_count', 'total_amount', 'pending_count', 'completed_count',
+         'completed_amount', 'failed_count', 'cancelled_count'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payfast', '0011_payment_version'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='payfastpaymentbucket',
+            name='payfast_bucket_unique',
+        ),
+        migrations.AddField(
+            model_name='payfastpaymentbucket',
+            name='stripe',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Counter row, see PAYFAST_STATS_STRIPES'),
+        ),
+        migrations.AddField(
+            model_name='payfastpaymentstats',
+            name='stripe',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Counter row, see PAYFAST_STATS_STRIPES'),
+        ),
+        migrations.AlterField(
+            model_name='payfastpaymentstats',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('complete', 'Complete'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='payfastpaymentbucket',
+            constraint=models.UniqueConstraint(fields=('granularity', 'date', 'hour', 'stripe'), name='payfast_bucket_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='payfastpaymentstats',
+            constraint=models.UniqueConstraint(fields=('status', 'stripe'), name='payfast_stats_unique'),
+        ),
+        migrations.RunPython(add_stats_stripes, remove_stats_stripes),
+    ]
@@ -1,6 +1,9 @@
 from .once_off_payments import PayFastPayment, PayFastNotification
+from .stats import PayFastPaymentBucket, PayFastPaymentStats
 
 __all__ = [
     'PayFastPayment', 
-    'PayFastNotification'
+    'PayFastNotification',
+    'PayFastPaymentStats',
+    'PayFastPaymentBucket',
 ]
\ No newline at end of file
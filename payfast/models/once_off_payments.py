@@ -3,18 +3,152 @@
 # payfast/models.py
 # ============================================================================
 
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import F
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.shortcuts import reverse
 from django.db import transaction
 
 
+from payfast.exceptions import InvalidPaymentStatusError, PaymentConflictError
 from payfast.utils import generate_pf_id
 
 User = get_user_model()
 
 
+# Allowed status changes. The statuses form one chain, pending < cancelled <
+# failed < complete, and a payment only ever moves up it. Writers that race on
+# the same payment therefore end in the highest status any of them asked for,
+# whatever order their updates commit in.
+STATUS_TRANSITIONS = {
+    'pending': ('cancelled', 'failed', 'complete'),
+    'cancelled': ('failed', 'complete'),
+    'failed': ('complete',),
+    'complete': (),
+}
+
+
+def transition_sources(to_status):
+    """Statuses a payment may move to ``to_status`` from, lowest first"""
+    return [status for status, targets in STATUS_TRANSITIONS.items() if to_status in targets]
+
+
+class PayFastPaymentQuerySet(models.QuerySet):
+    """QuerySet with single-statement status transitions"""
+    
+    def transition(self, to_status, from_status='pending', version=None, **fields):
+        """
+        Move matching payments from one status to another with one UPDATE
+        
+        Only rows still in ``from_status`` (and still at ``version``, when
+        given) are changed, so concurrent callers cannot both win the same
+        transition. Only ``status``, ``version``, ``updated_at``,
+        ``completed_at`` (when completing) and the given fields are written.
+        The payment rollups (PayFastPaymentStats and PayFastPaymentBucket)
+        are updated in the same transaction, the API change counters of the
+        payments' users are bumped, and on commit the cached statuses are
+        replaced and the transition signals (payment_status_changed,
+        payment_completed, ...) are sent with the payments as committed.
+        
+        Args:
+            to_status: New status
+            from_status: Status the rows must currently have
+            version: Version the rows must currently have (compare-and-swap)
+            **fields: Extra columns to write
+        
+        Returns:
+            Number of payments that made the transition
+        
+        Raises:
+            InvalidPaymentStatusError: If STATUS_TRANSITIONS does not allow
+                the move
+        """
+        if to_status not in STATUS_TRANSITIONS.get(from_status, ()):
+            raise InvalidPaymentStatusError(f'A payment cannot move from {from_status} to {to_status}')
+        now = fields.setdefault('updated_at', timezone.now())
+        fields['status'] = to_status
+        fields['version'] = F('version') + 1
+        if to_status == 'complete':
+            fields.setdefault('completed_at', now)
+        candidates = self.filter(status=from_status)
+        if version is not None:
+            candidates = candidates.filter(version=version)
+        with transaction.atomic(using=self.db, savepoint=False):
+            # Lock the rows and read them first: the old status counts fees
+            # and net amounts the UPDATE may overwrite, and the caller's
+            # filters (e.g. on the old status) stop matching once it has run
+            old = {
+                pk: (fee, net)
+                for pk, fee, net in candidates.select_for_update().order_by('pk').values_list(
+                    'pk', 'amount_fee', 'amount_net'
+                )
+            }
+            if not old:
+                return 0
+            rows = self.model._default_manager.using(self.db).filter(pk__in=list(old))
+            changed = rows.filter(status=from_status)
+            if version is not None:
+                changed = changed.filter(version=version)
+            updated = changed.update(**fields)
+            if updated:
+                # Rows this call changed carry its exact updated_at; they stay
+                # locked until commit, so these are the rows that commit
+                payments = list(rows.filter(status=to_status, updated_at=now).select_related('user').order_by('pk'))
+                from payfast.models.stats import record_payments
+                record_payments(
+                    added=[payment.stats_values() for payment in payments],
+                    removed=[
+                        (from_status, payment.amount, *old[payment.pk], payment.created_at)
+                        for payment in payments
+                    ],
+                )
+                from payfast.api_cache import bump_versions
+                from payfast.status import cache_payment_statuses, status_data
+                bump_versions([payment.user_id for payment in payments], using=self.db)
+                cache_payment_statuses(
+                    [
+                        status_data(payment.pk, payment.m_payment_id, to_status, now, payment.version, payment.user_id)
+                        for payment in payments
+                    ],
+                    using=self.db,
+                )
+                from payfast.transitions import schedule_transition_signals
+                schedule_transition_signals(payments, from_status, to_status, using=self.db)
+        return updated
+    
+    def apply_itn(self, post_data):
+        """
+        Apply an ITN to its payment with conditional UPDATEs
+        
+        The payment is moved from the lowest status STATUS_TRANSITIONS allows
+        it to leave for the ITN's status; an ITN that would move it down the
+        chain (e.g. FAILED after COMPLETE) changes nothing.
+        
+        Args:
+            post_data: Dictionary of ITN data from PayFast
+        
+        Returns:
+            Status this call moved the payment from, or None if it did not
+            change the payment
+        """
+        to_status = 'complete' if post_data.get('payment_status') == 'COMPLETE' else 'failed'
+        payments = self.filter(m_payment_id=post_data.get('m_payment_id'))
+        fields = {
+            'pf_payment_id': post_data.get('pf_payment_id'),
+            'payment_status': post_data.get('payment_status') or '',
+            'amount_gross': post_data.get('amount_gross') or None,
+            'amount_fee': post_data.get('amount_fee') or None,
+            'amount_net': post_data.get('amount_net') or None,
+        }
+        for from_status in transition_sources(to_status):
+            # m_payment_id is unique: stop at the first UPDATE that matched
+            if payments.transition(to_status, from_status=from_status, **fields):
+                return from_status
+        return None
+
+
 class PayFastPayment(models.Model):
     """Model to store PayFast payment transactions"""
     
@@ -25,6 +159,8 @@ class PayFastPayment(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
+    TRANSITIONS = STATUS_TRANSITIONS
+    
     # Primary fields
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='payfast_payments')
     
@@ -32,8 +168,8 @@ class PayFastPayment(models.Model):
     merchant_id = models.CharField(max_length=100, unique=True, null=True, blank=True, help_text='Merchant ID')
 
     # PayFast transaction details
-    m_payment_id = models.CharField(max_length=100, default=generate_pf_id, help_text='Unique payment ID from merchant')
-    pf_payment_id = models.CharField(max_length=100, blank=True, null=True, help_text='PayFast payment ID')
+    m_payment_id = models.CharField(max_length=100, unique=True, default=generate_pf_id, help_text='Unique payment ID from merchant')
+    pf_payment_id = models.CharField(max_length=100, blank=True, null=True, db_index=True, help_text='PayFast payment ID')
     signature = models.CharField(max_length=100, blank=True, null=True, help_text='PayFast payment sign')
     
     # Payment details
@@ -55,6 +191,7 @@ class PayFastPayment(models.Model):
     # Status and metadata
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
     payment_status = models.CharField(max_length=50, blank=True, help_text='PayFast payment status')
+    version = models.PositiveIntegerField(default=0, help_text='Bumped by every write, for compare-and-swap updates')
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -73,27 +210,186 @@ class PayFastPayment(models.Model):
     custom_int4 = models.IntegerField(null=True, blank=True)
     custom_int5 = models.IntegerField(null=True, blank=True)
     
+    objects = PayFastPaymentQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'PayFast Payment'
         verbose_name_plural = 'PayFast Payments'
+        indexes = [
+            # Keyset pagination of the payments API on (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='payfast_pay_created_id_idx'),
+            # A user's payments by status, newest first; also serves
+            # clear_expired_pending_payments (user, status, created_at <)
+            models.Index(fields=['user', 'status', '-created_at'], name='payfast_pay_user_status_idx'),
+            # Pending payments only: the checkout session lookup and expiry
+            # sweep stay small no matter how many completed payments exist
+            models.Index(
+                fields=['user', 'created_at'],
+                condition=models.Q(status='pending'),
+                name='payfast_pay_pending_user_idx',
+            ),
+            # API filters (payfast.filters.INDEXED_FILTERS): status in page
+            # order, completion date ranges and buyer email
+            models.Index(fields=['status', '-created_at', '-id'], name='payfast_pay_status_created_idx'),
+            models.Index(fields=['completed_at'], name='payfast_pay_completed_idx'),
+            models.Index(fields=['email_address', '-created_at'], name='payfast_pay_email_idx'),
+        ]
     
     def __str__(self):
         return f'Payment {self.m_payment_id} - {self.status}'
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the payment rollups currently count for this row
+        instance._stats_snapshot = instance.stats_values()
+        # Owner whose API change counter covers this row (None if deferred)
+        instance._api_user_id = instance.__dict__.get('user_id')
+        # Status a save() transitions from (None if deferred)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+    
+    def stats_values(self):
+        """
+        Values of this payment counted by the payment rollups
+        
+        Returns:
+            Tuple of (status, amount, amount_fee, amount_net, created_at), or
+            None if any of them is deferred
+        """
+        if self.get_deferred_fields() & {'status', 'amount', 'amount_fee', 'amount_net', 'created_at'}:
+            return None
+        return (self.status, self.amount, self.amount_fee, self.amount_net, self.created_at)
+    
+    
+    def invalid_transition(self):
+        """
+        Why the status change this instance holds is not allowed, if it is not
+        
+        Returns:
+            Error message, or None if the status is unchanged since the
+            payment was loaded or STATUS_TRANSITIONS allows the move
+        """
+        previous = getattr(self, '_loaded_status', None)
+        if 'status' not in self.__dict__ or previous is None or self.status == previous:
+            return None
+        if self.status in self.TRANSITIONS.get(previous, ()):
+            return None
+        return f'A payment cannot move from {previous} to {self.status}'
+    
+    def clean(self):
+        super().clean()
+        error = self.invalid_transition()
+        if error:
+            raise ValidationError({'status': error})
+    
+    def save(self, *args, **kwargs):
+        """
+        Save the payment, failing if another writer changed it first
+        
+        Updates bump ``version`` and only match the row while it still has
+        the version this instance was loaded with. A status change must be
+        one STATUS_TRANSITIONS allows from the status the payment was loaded
+        with.
+        
+        Raises:
+            InvalidPaymentStatusError: If the status change is not allowed
+            PaymentConflictError: If the row was changed since it was loaded
+        """
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'status' in update_fields:
+            error = self.invalid_transition()
+            if error:
+                raise InvalidPaymentStatusError(error)
+        if self._state.adding or 'version' in self.get_deferred_fields():
+            return super().save(*args, **kwargs)
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version'}
+        self._expected_version = self.version
+        self.version += 1
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            self.version = self._expected_version
+            raise
+        finally:
+            del self._expected_version
+    
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs):
+        expected = getattr(self, '_expected_version', None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs)
+        updated = super()._do_update(
+            base_qs.filter(version=expected), using, pk_val, values, update_fields, forced_update, *args, **kwargs
+        )
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise PaymentConflictError(
+                f'Payment {self.m_payment_id} was changed by another writer since it was loaded'
+            )
+        return updated
+    
+    def transition_to(self, to_status, **fields):
+        """
+        Move this payment to ``to_status`` with a compare-and-swap UPDATE
+        
+        The UPDATE only matches the row while it still has the status and
+        version of this instance, and no lock is held between reading the
+        payment and writing it. If another writer got there first the
+        payment is reloaded. The move is only retried if the other writer
+        left the status this call started from (e.g. it edited another
+        field); if it changed the status, that status stands, so the return
+        page cannot complete a payment a FAILED ITN has just failed.
+        Rollups, cached statuses and signals are handled by
+        PayFastPaymentQuerySet.transition().
+        
+        Args:
+            to_status: New status
+            **fields: Extra columns to write
+        
+        Returns:
+            Boolean indicating if this call changed the status
+        """
+        from_status = self.status
+        while self.status == from_status and to_status in self.TRANSITIONS[from_status]:
+            now = timezone.now()
+            if type(self).objects.filter(pk=self.pk).transition(
+                to_status, from_status=from_status, version=self.version, updated_at=now, **fields
+            ):
+                self.status = to_status
+                self.version += 1
+                self.updated_at = now
+                if to_status == 'complete':
+                    self.completed_at = fields.get('completed_at', now)
+                for name, value in fields.items():
+                    setattr(self, name, value)
+                self._stats_snapshot = self.stats_values()
+                self._loaded_status = to_status
+                return True
+            # Lost the race: see what the other writer committed
+            self.refresh_from_db()
+            self._stats_snapshot = self.stats_values()
+            self._api_user_id = self.user_id
+            self._loaded_status = self.status
+        return False
     
-    @transaction.atomic
     def mark_complete(self):
-        """Mark payment as complete"""
-        self.status = 'complete'
-        self.completed_at = timezone.now()
-        self.save()
+        """
+        Mark payment as complete
+        
+        Returns:
+            Boolean indicating if this call changed the status
+        """
+        return self.transition_to('complete')
     
-    @transaction.atomic
     def mark_failed(self):
-        """Mark payment as failed"""
-        self.status = 'failed'
-        self.save()
+        """
+        Mark payment as failed
+        
+        Returns:
+            Boolean indicating if this call changed the status
+        """
+        return self.transition_to('failed')
 
     def get_payfast_url(self):
         return reverse("payfast:payfast_payment_view", kwargs={"pk": self.pk})
@@ -104,15 +400,32 @@ class PayFastPayment(models.Model):
 class PayFastNotification(models.Model):
     """Model to log all PayFast ITN notifications"""
     
+    PROCESSING_STATE_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+    
     payment = models.ForeignKey(PayFastPayment, on_delete=models.CASCADE, related_name='notifications', null=True, blank=True)
     
     # Raw notification data
     raw_data = models.JSONField(default=dict)
     
+    # Deduplication key, copied from raw_data. payload_hash is only set on
+    # accepted notifications, so rejected ones never block a retry.
+    pf_payment_id = models.CharField(max_length=100, blank=True, default='', help_text='PayFast payment ID')
+    payment_status = models.CharField(max_length=50, blank=True, default='', help_text='PayFast payment status')
+    payload_hash = models.CharField(max_length=64, null=True, blank=True, help_text='SHA-256 of raw_data')
+    
     # Validation
     is_valid = models.BooleanField(default=False)
     validation_errors = models.TextField(blank=True)
     
+    # Processing (see PAYFAST_ITN_QUEUE_MODE)
+    processing_state = models.CharField(max_length=20, choices=PROCESSING_STATE_CHOICES, default='processed', db_index=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
     # Metadata
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -121,6 +434,12 @@ class PayFastNotification(models.Model):
         ordering = ['-created_at']
         verbose_name = 'PayFast Notification'
         verbose_name_plural = 'PayFast Notifications'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['pf_payment_id', 'payment_status', 'payload_hash'],
+                name='payfast_unique_notification',
+            ),
+        ]
     
     def __str__(self):
         return f'Notification {self.id} - {"Valid" if self.is_valid else "Invalid"}'
@@ -0,0 +1,531 @@
+# ============================================================================
+# payfast/models/stats.py
+# ============================================================================
+
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+try:
+    import zoneinfo
+except ImportError:  # Python 3.8
+    from backports import zoneinfo
+
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+
+from payfast import conf
+from payfast.models.once_off_payments import PayFastPayment
+
+ZERO = Decimal('0.00')
+
+# Time-series column holding the number of payments in each status
+STATUS_COLUMNS = {
+    'pending': 'pending_count',
+    'complete': 'completed_count',
+    'failed': 'failed_count',
+    'cancelled': 'cancelled_count',
+}
+
+# Time-series counter columns
+BUCKET_COLUMNS = (
+    'payment_count', 'total_amount', 'pending_count', 'completed_count',
+    'completed_amount', 'failed_count', 'cancelled_count',
+)
+
+
+def _decimal(value):
+    """Amounts may be assigned as floats or strings before a save"""
+    if value is None:
+        return ZERO
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def pick_stripe():
+    """
+    Counter row a write goes to
+
+    Every rollup total is spread over PAYFAST_STATS_STRIPES rows that are
+    summed on read. Concurrent writers pick a row at random, so they rarely
+    wait on each other's row lock the way they would on a single hot row.
+    """
+    return random.randrange(max(1, conf.PAYFAST_STATS_STRIPES))
+
+
+def get_stats_timezone():
+    """
+    Time zone the time-series buckets are cut in
+
+    Returns:
+        PAYFAST_STATS_TIME_ZONE, or the project's TIME_ZONE when unset
+    """
+    if conf.PAYFAST_STATS_TIME_ZONE:
+        return zoneinfo.ZoneInfo(conf.PAYFAST_STATS_TIME_ZONE)
+    return timezone.get_default_timezone()
+
+
+def get_bucket_granularities():
+    """Granularities that are kept up to date"""
+    return ('day', 'hour') if conf.PAYFAST_STATS_HOURLY else ('day',)
+
+
+def bucket_key(created_at, granularity, tz=None):
+    """
+    Bucket a creation time falls in
+
+    Args:
+        created_at: Aware datetime
+        granularity: 'day' or 'hour'
+        tz: Time zone to bucket in (default: get_stats_timezone())
+
+    Returns:
+        Tuple of (local date, local hour); the hour is 0 for day buckets
+    """
+    local = timezone.localtime(created_at, tz or get_stats_timezone())
+    return local.date(), local.hour if granularity == 'hour' else 0
+
+
+def record_payments(added=(), removed=()):
+    """
+    Record payments being created, changed or deleted in both rollups
+
+    Args:
+        added: Iterable of PayFastPayment.stats_values() tuples now stored
+        removed: Iterable of stats_values() tuples no longer stored
+    """
+    added, removed = list(added), list(removed)
+    PayFastPaymentStats.objects.record(added, removed)
+    PayFastPaymentBucket.objects.record(added, removed)
+
+
+class PayFastPaymentStatsQuerySet(models.QuerySet):
+    """QuerySet for keeping the payment rollup up to date"""
+
+    def add(self, status, count=0, amount=ZERO, fees=ZERO, net=ZERO):
+        """
+        Add to the totals of one status with a single UPDATE of one stripe
+
+        Args:
+            status: Payment status whose totals are changed
+            count: Change in the number of payments
+            amount: Change in the amount
+            fees: Change in the PayFast fees
+            net: Change in the net amount
+        """
+        stripe = pick_stripe()
+        updated = self.filter(status=status, stripe=stripe).update(
+            payment_count=F('payment_count') + count,
+            total_amount=F('total_amount') + amount,
+            total_fees=F('total_fees') + fees,
+            total_net=F('total_net') + net,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            return
+        # Create every stripe of the status at once (some may exist already)
+        self.bulk_create(
+            [PayFastPaymentStats(status=status, stripe=i) for i in range(max(1, conf.PAYFAST_STATS_STRIPES))],
+            ignore_conflicts=True,
+        )
+        self.add(status, count, amount, fees, net)
+
+    def record(self, added=(), removed=()):
+        """
+        Record payments being created, changed or deleted
+
+        Args:
+            added: Iterable of PayFastPayment.stats_values() tuples now stored
+            removed: Iterable of stats_values() tuples no longer stored
+        """
+        deltas = {}
+        for values, sign in [(values, 1) for values in added] + [(values, -1) for values in removed]:
+            status, amount, fees, net, _ = values
+            delta = deltas.setdefault(status, [0, ZERO, ZERO, ZERO])
+            delta[0] += sign
+            delta[1] += sign * _decimal(amount)
+            delta[2] += sign * _decimal(fees)
+            delta[3] += sign * _decimal(net)
+        for status, (count, amount, fees, net) in deltas.items():
+            if count or amount or fees or net:
+                self.add(status, count, amount, fees, net)
+
+    def totals(self):
+        """
+        Totals per status, summed over the stripes
+
+        Returns:
+            Dictionary of status to (count, amount, fees, net)
+        """
+        rows = self.order_by().values('status').annotate(
+            _count=Sum('payment_count'),
+            _amount=Sum('total_amount'),
+            _fees=Sum('total_fees'),
+            _net=Sum('total_net'),
+        )
+        return {
+            row['status']: (row['_count'], _decimal(row['_amount']), _decimal(row['_fees']), _decimal(row['_net']))
+            for row in rows
+        }
+
+    def summary(self):
+        """
+        Totals for PaymentStatisticsSerializer, read from the rollup rows
+
+        Returns:
+            Dictionary of payment statistics
+        """
+        totals = self.totals()
+        counts = {status: totals[status][0] if status in totals else 0
+                  for status, _ in PayFastPayment.STATUS_CHOICES}
+        total_payments = sum(counts.values())
+        total_amount = sum((amount for _, amount, _, _ in totals.values()), ZERO)
+        complete = totals.get('complete', (0, ZERO, ZERO, ZERO))
+        return {
+            'total_payments': total_payments,
+            'completed_payments': counts['complete'],
+            'pending_payments': counts['pending'],
+            'failed_payments': counts['failed'],
+            'cancelled_payments': counts['cancelled'],
+            'total_amount': total_amount,
+            'total_completed_amount': complete[1],
+            'average_payment_amount': (
+                (total_amount / total_payments).quantize(ZERO) if total_payments else ZERO
+            ),
+            'total_fees': complete[2],
+            'net_revenue': complete[3],
+        }
+
+    def compute(self):
+        """
+        Recompute the rollup from the payments table
+
+        Uses one conditional-aggregation query over PayFastPayment.
+
+        Returns:
+            Dictionary of status to (count, amount, fees, net)
+        """
+        aggregates = {}
+        for status, _ in PayFastPayment.STATUS_CHOICES:
+            in_status = Q(status=status)
+            aggregates[f'{status}_count'] = Count('pk', filter=in_status)
+            aggregates[f'{status}_amount'] = Sum('amount', filter=in_status)
+            aggregates[f'{status}_fees'] = Sum('amount_fee', filter=in_status)
+            aggregates[f'{status}_net'] = Sum('amount_net', filter=in_status)
+        totals = PayFastPayment.objects.order_by().aggregate(**aggregates)
+        return {
+            status: (
+                totals[f'{status}_count'],
+                _decimal(totals[f'{status}_amount']),
+                _decimal(totals[f'{status}_fees']),
+                _decimal(totals[f'{status}_net']),
+            )
+            for status, _ in PayFastPayment.STATUS_CHOICES
+        }
+
+    def rebuild(self):
+        """
+        Replace the rollup rows with freshly computed totals
+
+        The totals are computed and written in one transaction, with every
+        counter row locked first: add() calls wait until the new totals
+        commit, and transitions that committed before the lock are in the
+        computed totals, so none is counted twice or lost. The totals go to
+        stripe 0 and the other stripes are zeroed.
+
+        Returns:
+            Dictionary of status to (count, amount, fees, net)
+        """
+        stripes = max(1, conf.PAYFAST_STATS_STRIPES)
+        with transaction.atomic(using=self.db):
+            # Lock rows, not gaps: make sure every row exists first
+            self.bulk_create(
+                [
+                    PayFastPaymentStats(status=status, stripe=i)
+                    for status, _ in PayFastPayment.STATUS_CHOICES
+                    for i in range(stripes)
+                ],
+                ignore_conflicts=True,
+            )
+            list(self.select_for_update().order_by('pk').values_list('pk', flat=True))
+            computed = self.compute()
+            self.filter(stripe__gte=stripes).delete()
+            self.update(payment_count=0, total_amount=ZERO, total_fees=ZERO, total_net=ZERO, updated_at=timezone.now())
+            for status, (count, amount, fees, net) in computed.items():
+                self.filter(status=status, stripe=0).update(
+                    payment_count=count, total_amount=amount, total_fees=fees, total_net=net,
+                )
+        return computed
+
+
+class PayFastPaymentStats(models.Model):
+    """
+    Running payment totals per payment status
+
+    Kept up to date by PayFastPaymentQuerySet.transition() (ITNs and bulk
+    updates), by saving or deleting a payment and by the bulk create endpoint,
+    so the statistics endpoint never scans the payments table. Each status
+    has PAYFAST_STATS_STRIPES rows (``stripe``) that are summed on read, so
+    concurrent writes do not queue on one row lock. The
+    ``payfast_rebuild_stats`` command recomputes the rows from the payments
+    table if they ever drift.
+    """
+
+    status = models.CharField(max_length=20, choices=PayFastPayment.STATUS_CHOICES)
+    stripe = models.PositiveSmallIntegerField(default=0, help_text='Counter row, see PAYFAST_STATS_STRIPES')
+    payment_count = models.BigIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=18, decimal_places=2, default=ZERO)
+    total_fees = models.DecimalField(max_digits=18, decimal_places=2, default=ZERO)
+    total_net = models.DecimalField(max_digits=18, decimal_places=2, default=ZERO)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PayFastPaymentStatsQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'PayFast Payment Statistics'
+        verbose_name_plural = 'PayFast Payment Statistics'
+        constraints = [
+            models.UniqueConstraint(fields=['status', 'stripe'], name='payfast_stats_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.status}: {self.payment_count} payments'
+
+
+class PayFastPaymentBucketQuerySet(models.QuerySet):
+    """QuerySet for the payment time series"""
+
+    def add(self, granularity, date, hour, **deltas):
+        """
+        Add to the counters of one bucket with a single UPDATE of one stripe
+
+        Args:
+            granularity: 'day' or 'hour'
+            date: Local date of the bucket
+            hour: Local hour of the bucket (0 for day buckets)
+            **deltas: Column name to change
+        """
+        bucket = self.filter(granularity=granularity, date=date, hour=hour, stripe=pick_stripe())
+        if bucket.update(**{column: F(column) + delta for column, delta in deltas.items()}):
+            return
+        # Create every stripe of the bucket at once (some may exist already)
+        self.bulk_create(
+            [
+                PayFastPaymentBucket(granularity=granularity, date=date, hour=hour, stripe=i)
+                for i in range(max(1, conf.PAYFAST_STATS_STRIPES))
+            ],
+            ignore_conflicts=True,
+        )
+        self.add(granularity, date, hour, **deltas)
+
+    def record(self, added=(), removed=()):
+        """
+        Record payments being created, changed or deleted
+
+        Args:
+            added: Iterable of PayFastPayment.stats_values() tuples now stored
+            removed: Iterable of stats_values() tuples no longer stored
+        """
+        tz = get_stats_timezone()
+        granularities = get_bucket_granularities()
+        deltas = {}
+        for values, sign in [(values, 1) for values in added] + [(values, -1) for values in removed]:
+            status, amount, _, _, created_at = values
+            amount = _decimal(amount)
+            for granularity in granularities:
+                key = (granularity,) + bucket_key(created_at, granularity, tz)
+                delta = deltas.setdefault(key, {
+                    'payment_count': 0, 'total_amount': ZERO, 'completed_amount': ZERO,
+                    'pending_count': 0, 'completed_count': 0, 'failed_count': 0, 'cancelled_count': 0,
+                })
+                delta['payment_count'] += sign
+                delta['total_amount'] += sign * amount
+                delta[STATUS_COLUMNS[status]] += sign
+                if status == 'complete':
+                    delta['completed_amount'] += sign * amount
+        for (granularity, date, hour), delta in deltas.items():
+            delta = {column: value for column, value in delta.items() if value}
+            if delta:
+                self.add(granularity, date, hour, **delta)
+
+    def series(self, granularity, start, end):
+        """
+        Buckets for a date range, with empty buckets filled in
+
+        Args:
+            granularity: 'day' or 'hour'
+            start: First local date
+            end: Last local date (inclusive)
+
+        Returns:
+            List of dictionaries for PaymentTimeSeriesSerializer, oldest first
+        """
+        tz = get_stats_timezone()
+        buckets = self.totals(granularity, start, end)
+        empty = dict.fromkeys(BUCKET_COLUMNS, 0)
+        rows = []
+        hours = range(24) if granularity == 'hour' else (0,)
+        date = start
+        while date <= end:
+            for hour in hours:
+                bucket = buckets.get((date, hour), empty)
+                rows.append({
+                    'date': date,
+                    'start': timezone.make_aware(datetime(date.year, date.month, date.day, hour), tz),
+                    'payment_count': bucket['payment_count'],
+                    'total_amount': _decimal(bucket['total_amount']),
+                    'completed_count': bucket['completed_count'],
+                    'completed_amount': _decimal(bucket['completed_amount']),
+                    'failed_count': bucket['failed_count'],
+                    'cancelled_count': bucket['cancelled_count'],
+                })
+            date += timedelta(days=1)
+        return rows
+
+    def totals(self, granularity, start=None, end=None):
+        """
+        Bucket counters summed over the stripes
+
+        Args:
+            granularity: 'day' or 'hour'
+            start: First local date (default: no limit)
+            end: Last local date, inclusive (default: no limit)
+
+        Returns:
+            Dictionary of (date, hour) to a dictionary of BUCKET_COLUMNS
+        """
+        buckets = self.filter(granularity=granularity)
+        if start is not None:
+            buckets = buckets.filter(date__gte=start)
+        if end is not None:
+            buckets = buckets.filter(date__lte=end)
+        rows = buckets.order_by().values('date', 'hour').annotate(
+            **{f'_{column}': Sum(column) for column in BUCKET_COLUMNS}
+        )
+        return {
+            (row['date'], row['hour']): {column: row[f'_{column}'] for column in BUCKET_COLUMNS}
+            for row in rows
+        }
+
+    def rebuild(self, granularity):
+        """
+        Replace the buckets of one granularity from the payments table
+
+        Uses one grouped, conditional-aggregation query, run in the
+        transaction that writes the totals and after every bucket row of the
+        granularity is locked, so concurrent add() calls wait instead of
+        being overwritten. A bucket the aggregate finds that had no rows when
+        they were locked is created (all stripes, like add()) and the rebuild
+        starts over, so it is locked too. The totals go to stripe 0, the
+        other stripes are zeroed and buckets without payments are deleted.
+
+        Args:
+            granularity: 'day' or 'hour'
+
+        Returns:
+            Number of buckets written
+        """
+        tz = get_stats_timezone()
+        stripes = max(1, conf.PAYFAST_STATS_STRIPES)
+        payments = PayFastPayment.objects.order_by().annotate(_date=TruncDate('created_at', tzinfo=tz))
+        group_by = ['_date']
+        if granularity == 'hour':
+            payments = payments.annotate(_hour=ExtractHour('created_at', tzinfo=tz))
+            group_by.append('_hour')
+        aggregates = {
+            'payment_count': Count('pk'),
+            'total_amount': Sum('amount'),
+            'completed_amount': Sum('amount', filter=Q(status='complete')),
+        }
+        for status, column in STATUS_COLUMNS.items():
+            aggregates[column] = Count('pk', filter=Q(status=status))
+
+        while True:
+            with transaction.atomic(using=self.db):
+                rows = list(
+                    self.filter(granularity=granularity).select_for_update().order_by('pk')
+                    .values_list('pk', 'date', 'hour', 'stripe')
+                )
+                computed = {
+                    (row.pop('_date'), row.pop('_hour', 0)): row
+                    for row in payments.values(*group_by).annotate(**aggregates)
+                }
+                missing = set(computed).difference((date, hour) for _, date, hour, _ in rows)
+                if missing:
+                    # Commit empty rows for these buckets and start over with
+                    # them locked: a concurrent add() may create them too
+                    self.bulk_create(
+                        [
+                            PayFastPaymentBucket(granularity=granularity, date=date, hour=hour, stripe=i)
+                            for date, hour in sorted(missing)
+                            for i in range(stripes)
+                        ],
+                        ignore_conflicts=True,
+                    )
+                    continue
+
+                buckets, stale = [], []
+                for pk, date, hour, stripe in rows:
+                    totals = computed.get((date, hour))
+                    if totals is None or stripe >= stripes:
+                        stale.append(pk)
+                        continue
+                    bucket = PayFastPaymentBucket(pk=pk, **dict.fromkeys(BUCKET_COLUMNS, 0))
+                    if stripe == 0:
+                        for column in BUCKET_COLUMNS:
+                            setattr(bucket, column, totals[column] or 0)
+                    buckets.append(bucket)
+                for start in range(0, len(stale), 1000):
+                    self.filter(pk__in=stale[start:start + 1000]).delete()
+                self.bulk_update(buckets, BUCKET_COLUMNS, batch_size=1000)
+                return len(computed)
+
+
+class PayFastPaymentBucket(models.Model):
+    """
+    Payment counters per local day (and optionally hour) of creation
+
+    Each payment is counted in the bucket of its ``created_at`` in
+    PAYFAST_STATS_TIME_ZONE, and moves between the status counters of that
+    bucket as it changes status, so a chart over a date range reads one
+    group of rows per day. Hour buckets are kept when PAYFAST_STATS_HOURLY is
+    on. Like PayFastPaymentStats, each bucket is striped over
+    PAYFAST_STATS_STRIPES rows that are summed on read. Kept up to date by
+    the same paths as PayFastPaymentStats and rebuilt by
+    ``payfast_rebuild_stats``.
+    """
+
+    GRANULARITY_CHOICES = [
+        ('day', 'Day'),
+        ('hour', 'Hour'),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES, default='day')
+    date = models.DateField(help_text='Local date in PAYFAST_STATS_TIME_ZONE')
+    hour = models.PositiveSmallIntegerField(default=0, help_text='Local hour (0 for day buckets)')
+    stripe = models.PositiveSmallIntegerField(default=0, help_text='Counter row, see PAYFAST_STATS_STRIPES')
+
+    payment_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=18, decimal_places=2, default=ZERO)
+    pending_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    completed_amount = models.DecimalField(max_digits=18, decimal_places=2, default=ZERO)
+    failed_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+
+    objects = PayFastPaymentBucketQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'PayFast Payment Time Bucket'
+        verbose_name_plural = 'PayFast Payment Time Buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'date', 'hour', 'stripe'], name='payfast_bucket_unique'),
+        ]
+
+    def __str__(self):
+        if self.granularity == 'hour':
+            return f'{self.date} {self.hour:02d}:00: {self.payment_count} payments'
+        return f'{self.date}: {self.payment_count} payments'
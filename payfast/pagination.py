@@ -1,5 +1,18 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from payfast import conf
+
 
 class PayfastPagination(PageNumberPagination):
     page_size = 20
@@ -14,3 +27,159 @@ class PayfastPagination(PageNumberPagination):
             'previous': self.get_previous_link(),
             'results': data,
         })
+
+
+def estimate_count(queryset):
+    """
+    Cheap row count for a queryset
+
+    On PostgreSQL an unfiltered table uses the planner's row estimate from
+    ``pg_class``. Anything else runs an exact ``COUNT(*)`` once and caches it
+    in the PAYFAST_API_CACHE_ALIAS cache for PAYFAST_API_COUNT_CACHE_TIMEOUT
+    seconds.
+
+    Args:
+        queryset: Queryset to count
+
+    Returns:
+        Approximate number of rows
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    key = 'payfast:count:' + hashlib.sha256(f'{sql}{params}'.encode()).hexdigest()
+    cache = caches[conf.PAYFAST_API_CACHE_ALIAS]
+    total = cache.get(key)
+    if total is None:
+        total = queryset.count()
+        cache.set(key, total, conf.PAYFAST_API_COUNT_CACHE_TIMEOUT)
+    return total
+
+
+class PayfastCursorPagination(BasePagination):
+    """
+    Keyset pagination on ``(created_at, id)``, newest first
+
+    Each page is one indexed range query (``created_at < c OR (created_at = c
+    AND id < i)``) no matter how deep it is, and no ``COUNT(*)`` is run. The
+    cursor is an opaque token holding the boundary row's ``created_at`` and
+    ``id``. With PAYFAST_API_ESTIMATED_TOTAL the response also carries an
+    ``estimated_total`` from estimate_count().
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.estimated_total = estimate_count(queryset) if conf.PAYFAST_API_ESTIMATED_TOTAL else None
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['r']
+        if cursor is None:
+            page_queryset = queryset.order_by(*self.ordering)
+        else:
+            created_at, pk = cursor['c'], cursor['i']
+            if reverse:
+                # Previous page: walk forwards in time, then flip the rows
+                page_queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                ).order_by('created_at', 'id')
+            else:
+                page_queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                ).order_by(*self.ordering)
+
+        rows = list(page_queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not reverse else True
+        self.has_previous = cursor is not None and (has_more if reverse else True)
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            cursor['c'] = parse_datetime(cursor['c'])
+            cursor['i'] = int(cursor['i'])
+            cursor['r'] = bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound('Invalid cursor')
+        if cursor['c'] is None:
+            raise NotFound('Invalid cursor')
+        return cursor
+
+    def encode_cursor(self, row, reverse=False):
+        if isinstance(row, dict):
+            # values() rows from the compiled list serializer
+            token = {'c': row['created_at'].isoformat(), 'i': row['id']}
+        else:
+            token = {'c': row.created_at.isoformat(), 'i': row.pk}
+        if reverse:
+            token['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(token, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {
+            'page_size': self.page_size,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.estimated_total is not None:
+            response['estimated_total'] = self.estimated_total
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'page_size': {'type': 'integer'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'estimated_total': {'type': 'integer'},
+                'results': schema,
+            },
+        }
@@ -13,13 +13,19 @@ from .normal_payments import (
     PayFastFormDataSerializer,
     PaymentStatisticsSerializer,
     PaymentTimeSeriesSerializer,
+    PaymentTimeSeriesQuerySerializer,
     PayFastWebhookDataSerializer,
 
     PayFastPaymentWithNotificationsSerializer,
     UserPaymentHistorySerializer,
     BulkPaymentStatusUpdateSerializer,
+    PaymentExportQuerySerializer,
+    PaymentFilterSerializer,
+    PayFastPaymentBulkItemSerializer,
+    PayFastPaymentBulkCreateSerializer,
     
 )
+from .compiled import CompiledSerializer, compile_serializer
 
 __all__ = [
     'PayFastFormDataSerializer', 
@@ -32,10 +38,17 @@ __all__ = [
     'PayFastNotificationListSerializer',
     'PaymentStatisticsSerializer',
     'PaymentTimeSeriesSerializer',
+    'PaymentTimeSeriesQuerySerializer',
     'PayFastWebhookDataSerializer',
     'PayFastPaymentWithNotificationsSerializer',
-    # 'UserPaymentHistorySerializer', 
+    'UserPaymentHistorySerializer',
     'BulkPaymentStatusUpdateSerializer',
+    'PaymentExportQuerySerializer',
+    'PaymentFilterSerializer',
+    'PayFastPaymentBulkItemSerializer',
+    'PayFastPaymentBulkCreateSerializer',
     'PayFastPaymentExportSerializer',
+    'CompiledSerializer',
+    'compile_serializer',
     
 ]
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""
+Compiled read-only serializers for dj-payfast
+
+A ModelSerializer builds a model instance per row and then, per field, walks
+``source`` with getattr, calls ``get_<field>_display`` and runs the field's
+``to_representation``. For large lists that dominates the response time.
+
+``compile_serializer(SerializerClass)`` inspects the serializer's fields once
+and produces a ``CompiledSerializer`` that reads ``values()`` rows instead:
+every field becomes a precomputed getter over one or more columns, choice
+labels come from a lookup table and decimals and datetimes are formatted the
+way the DRF fields would format them. The output is the same dictionary the
+serializer produces for the same row.
+
+Only plain model fields, ``a.b`` sources over foreign keys, primary key
+relations and ``get_<field>_display`` are compiled. A SerializerMethodField
+``foo`` is compiled from ``compiled_fields['foo']`` (the columns it reads) and
+a ``compiled_foo(row)`` static method on the serializer.
+"""
+
+import decimal
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+# Returned by getters for fields the DRF serializer would leave out
+SKIP = object()
+
+
+def _identity(value):
+    return value
+
+
+def _decimal_formatter(field):
+    """DecimalField.to_representation without the per-call attribute lookups"""
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.localize:
+        return field.to_representation
+    quantize = field.quantize
+
+    def format_decimal(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        value = quantize(value)
+        return '{:f}'.format(value) if coerce_to_string else value
+
+    return format_decimal
+
+
+def _datetime_formatter(field):
+    """DateTimeField.to_representation in the current time zone"""
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None:
+        return _identity
+    if getattr(field, 'timezone', None) is not None:
+        return field.to_representation
+    iso_8601 = output_format.lower() == 'iso-8601'
+
+    def format_datetime(value):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        if not iso_8601:
+            return value.strftime(output_format)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    return format_datetime
+
+
+def _formatter(field):
+    if isinstance(field, serializers.DecimalField):
+        return _decimal_formatter(field)
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime_formatter(field)
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        # values('user') already returns the primary key
+        return _identity
+    if type(field) in (serializers.CharField, serializers.EmailField, serializers.IntegerField,
+                       serializers.BooleanField, serializers.ChoiceField):
+        # Model columns already hold the representation
+        return _identity
+    return field.to_representation
+
+
+class CompiledSerializer:
+    """
+    Read-only serializer over ``values()`` rows
+
+    Args:
+        serializer_class: ModelSerializer to compile
+        keep_missing: Output None instead of leaving out fields read through
+            an empty relation (the serializer leaves out e.g. ``user_email``
+            when there is no user)
+    """
+
+    def __init__(self, serializer_class, keep_missing=False):
+        serializer = serializer_class()
+        self.serializer_class = serializer_class
+        self.model = serializer.Meta.model
+        self.keep_missing = keep_missing
+        self.field_names = []
+        self.columns = []
+        self.getters = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.field_names.append(name)
+            if isinstance(field, serializers.SerializerMethodField):
+                getter = self._compile_method_field(serializer_class, name)
+            else:
+                getter = self._compile_field(name, field)
+            self.getters.append((name, getter))
+
+    def _column(self, path):
+        if path not in self.columns:
+            self.columns.append(path)
+        return path
+
+    def _compile_method_field(self, serializer_class, name):
+        columns = getattr(serializer_class, 'compiled_fields', {}).get(name)
+        function = getattr(serializer_class, f'compiled_{name}', None)
+        if columns is None or function is None:
+            raise ImproperlyConfigured(
+                f'{serializer_class.__name__}.{name} needs compiled_fields[{name!r}] '
+                f'and a compiled_{name}(row) static method to be compiled'
+            )
+        for column in columns:
+            self._column(column)
+        return function
+
+    def _compile_field(self, name, field):
+        model = self.model
+        attrs = list(field.source_attrs)
+        path = []
+        relations = []
+        choices = None
+
+        for position, attr in enumerate(attrs):
+            last = position == len(attrs) - 1
+            if last and attr.startswith('get_') and attr.endswith('_display'):
+                model_field = model._meta.get_field(attr[4:-8])
+                choices = dict(model_field.flatchoices)
+                path.append(model_field.name)
+                break
+            try:
+                model_field = model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                raise ImproperlyConfigured(
+                    f'Cannot compile {self.serializer_class.__name__}.{name}: '
+                    f'{attr!r} is not a field of {model.__name__}'
+                )
+            path.append(model_field.name)
+            if model_field.is_relation and not last:
+                if not (model_field.many_to_one or model_field.one_to_one) or model_field.auto_created:
+                    raise ImproperlyConfigured(
+                        f'Cannot compile {self.serializer_class.__name__}.{name}: only forward '
+                        f'foreign keys can be followed'
+                    )
+                if model_field.null:
+                    relations.append(self._column('__'.join(path)))
+                model = model_field.related_model
+
+        column = self._column('__'.join(path))
+        format_value = _formatter(field)
+        if choices is not None and not all(isinstance(label, str) for label in choices.values()):
+            # Lazy labels are translated per request
+            format_value = str
+
+        # What DRF does when a relation on the way is empty
+        if field.default is not serializers.empty:
+            missing = field.get_default()
+        elif self.keep_missing or field.allow_null or field.required:
+            missing = None
+        else:
+            missing = SKIP
+
+        def getter(row):
+            for relation in relations:
+                if row[relation] is None:
+                    return missing
+            value = row[column]
+            if value is None:
+                return None
+            if choices is not None:
+                value = choices.get(value, value)
+            return format_value(value)
+
+        return getter
+
+    def values(self, queryset):
+        """Return ``queryset.values()`` with the columns this serializer reads"""
+        return queryset.values(*self.columns)
+
+    def to_representation(self, row):
+        """Serialize one ``values()`` row"""
+        data = {}
+        for name, getter in self.getters:
+            value = getter(row)
+            if value is not SKIP:
+                data[name] = value
+        return data
+
+    def serialize(self, rows):
+        """
+        Serialize many rows
+
+        Args:
+            rows: Iterable of rows from ``values()``
+
+        Returns:
+            List of dictionaries, as ``serializer_class(..., many=True).data``
+        """
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class, keep_missing=False):
+    """
+    Compile a ModelSerializer once per process
+
+    Args:
+        serializer_class: ModelSerializer to compile
+        keep_missing: See CompiledSerializer
+
+    Returns:
+        CompiledSerializer
+    """
+    return CompiledSerializer(serializer_class, keep_missing=keep_missing)
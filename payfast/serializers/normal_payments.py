@@ -8,9 +8,17 @@ Note: Requires djangorestframework to be installed:
     pip install djangorestframework
 """
 
+from datetime import timedelta
+
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.db import IntegrityError, transaction
+from payfast import conf
+from payfast.api_cache import bump_versions
 from payfast.models import PayFastPayment, PayFastNotification
+from payfast.models.stats import record_payments
+from payfast.status import cache_payment_statuses, status_data
 from payfast.utils import generate_signature
 import uuid
 
@@ -60,6 +68,18 @@ class PayFastPaymentListSerializer(serializers.ModelSerializer):
         if obj.user:
             return f"{obj.user.first_name} {obj.user.last_name}".strip()
         return f"{obj.name_first} {obj.name_last}".strip()
+    
+    # Columns read by compiled_user_name (see payfast.serializers.compiled)
+    compiled_fields = {
+        'user_name': ['user', 'user__first_name', 'user__last_name', 'name_first', 'name_last'],
+    }
+    
+    @staticmethod
+    def compiled_user_name(row):
+        """get_user_name for a values() row"""
+        if row['user'] is not None:
+            return f"{row['user__first_name']} {row['user__last_name']}".strip()
+        return f"{row['name_first']} {row['name_last']}".strip()
 
 
 class PayFastPaymentDetailSerializer(serializers.ModelSerializer):
@@ -209,14 +229,12 @@ class PayFastPaymentUpdateSerializer(serializers.ModelSerializer):
         ]
     
     def validate_status(self, value):
-        """Validate status transitions"""
+        """Validate status transitions against PayFastPayment.TRANSITIONS"""
         instance = self.instance
-        if instance:
-            # Don't allow changing from complete to other statuses
-            if instance.status == 'complete' and value != 'complete':
-                raise serializers.ValidationError(
-                    "Cannot change status from complete"
-                )
+        if instance and value != instance.status and value not in PayFastPayment.TRANSITIONS[instance.status]:
+            raise serializers.ValidationError(
+                f"Cannot change status from {instance.status} to {value}"
+            )
         return value
 
 
@@ -371,10 +389,47 @@ class PaymentTimeSeriesSerializer(serializers.Serializer):
     """
     
     date = serializers.DateField()
+    start = serializers.DateTimeField(required=False)
     payment_count = serializers.IntegerField()
     total_amount = serializers.DecimalField(max_digits=10, decimal_places=2)
     completed_count = serializers.IntegerField()
+    completed_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
     failed_count = serializers.IntegerField()
+    cancelled_count = serializers.IntegerField(required=False)
+
+
+class PaymentTimeSeriesQuerySerializer(serializers.Serializer):
+    """
+    Query parameters for the payment time series
+    
+    ``start`` and ``end`` are local dates in PAYFAST_STATS_TIME_ZONE (both
+    inclusive, default: the last 30 days). Day series can span up to ten
+    years, hour series up to 31 days.
+    """
+    
+    MAX_DAYS = {'day': 3660, 'hour': 31}
+    
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    interval = serializers.ChoiceField(choices=['day', 'hour'], default='day')
+    
+    def validate(self, data):
+        """Fill in the default range and limit its length"""
+        from payfast.models.stats import get_stats_timezone
+        
+        if data['interval'] == 'hour' and not conf.PAYFAST_STATS_HOURLY:
+            raise serializers.ValidationError({'interval': 'Hourly buckets are not enabled (PAYFAST_STATS_HOURLY)'})
+        end = data.get('end') or timezone.localtime(timezone.now(), get_stats_timezone()).date()
+        start = data.get('start') or end - timedelta(days=29)
+        if start > end:
+            raise serializers.ValidationError({'start': 'start must not be after end'})
+        max_days = self.MAX_DAYS[data['interval']]
+        if (end - start).days >= max_days:
+            raise serializers.ValidationError(
+                {'end': f"A {data['interval']} series can span at most {max_days} days"}
+            )
+        data['start'], data['end'] = start, end
+        return data
 
 
 # ============================================================================
@@ -474,7 +529,7 @@ class UserPaymentHistorySerializer(serializers.ModelSerializer):
             'created_at',
             'completed_at',
         ]
-        read_only_fields = '__all__'
+        read_only_fields = fields
 
 
 # ============================================================================
@@ -498,6 +553,14 @@ class BulkPaymentStatusUpdateSerializer(serializers.Serializer):
         required=True
     )
     
+    def validate_payment_ids(self, value):
+        """Limit the number of ids per request"""
+        if len(value) > conf.PAYFAST_API_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f"At most {conf.PAYFAST_API_BULK_MAX_ITEMS} payments can be updated per request"
+            )
+        return value
+    
     def validate_status(self, value):
         """Only allow certain statuses for bulk updates"""
         allowed_statuses = ['cancelled', 'failed']
@@ -508,6 +571,151 @@ class BulkPaymentStatusUpdateSerializer(serializers.Serializer):
         return value
 
 
+class BulkUserField(serializers.PrimaryKeyRelatedField):
+    """
+    User primary key field that reads from users loaded up front
+
+    PayFastPaymentBulkCreateSerializer loads every user referenced by a batch
+    with one query and passes them in the ``users`` context, so validating a
+    batch does not query the user table once per item.
+    """
+
+    def to_internal_value(self, data):
+        users = self.context.get('users')
+        if users is None:
+            return super().to_internal_value(data)
+        try:
+            user = users.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if user is None:
+            self.fail('does_not_exist', pk_value=data)
+        return user
+
+
+class PayFastPaymentBulkItemSerializer(PayFastPaymentCreateSerializer):
+    """
+    Serializer for one payment of a bulk create request
+
+    Same fields as PayFastPaymentCreateSerializer, plus an optional
+    ``m_payment_id`` so callers can use their own invoice numbers.
+    Uniqueness of ``m_payment_id`` is checked for the whole batch at once.
+    """
+
+    m_payment_id = serializers.CharField(required=False, max_length=100)
+    user = BulkUserField(queryset=User.objects.all(), required=False, allow_null=True)
+
+    class Meta(PayFastPaymentCreateSerializer.Meta):
+        fields = ['m_payment_id'] + [
+            field for field in PayFastPaymentCreateSerializer.Meta.fields
+            if field not in ('id', 'payfast_url')
+        ]
+
+
+class PayFastPaymentBulkCreateSerializer(serializers.Serializer):
+    """
+    Serializer for creating many PayFast payments in one request
+
+    Every item is validated on its own. Valid items are inserted with
+    ``bulk_create`` in one transaction; invalid items are reported by their
+    index in ``item_errors`` and skipped. The batch is limited to
+    PAYFAST_API_BULK_MAX_ITEMS payments.
+    """
+
+    payments = serializers.ListField(allow_empty=False)
+
+    def validate_payments(self, value):
+        """Limit the batch size"""
+        if len(value) > conf.PAYFAST_API_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f"At most {conf.PAYFAST_API_BULK_MAX_ITEMS} payments can be created per request"
+            )
+        return value
+
+    def create(self, validated_data):
+        """
+        Validate each item and insert the valid ones
+
+        Returns:
+            List of (index, PayFastPayment) tuples for the created payments
+        """
+        items = validated_data['payments']
+        child = PayFastPaymentBulkItemSerializer(
+            context={**self.context, 'users': self._load_users(items)}
+        )
+        supplied = [
+            item['m_payment_id'] for item in items
+            if isinstance(item, dict) and isinstance(item.get('m_payment_id'), str)
+        ]
+        taken = set(
+            PayFastPayment.objects.filter(m_payment_id__in=supplied).values_list('m_payment_id', flat=True)
+        ) if supplied else set()
+
+        self.item_errors = []
+        created = []
+        for index, item in enumerate(items):
+            # One child serializer for the whole batch, like ListSerializer
+            try:
+                data = child.run_validation(item)
+            except serializers.ValidationError as e:
+                self.item_errors.append({'index': index, 'errors': e.detail})
+                continue
+
+            m_payment_id = data.get('m_payment_id') or str(uuid.uuid4())
+            if m_payment_id in taken:
+                self.item_errors.append({
+                    'index': index,
+                    'errors': {'m_payment_id': ['A payment with this m_payment_id already exists.']},
+                })
+                continue
+            taken.add(m_payment_id)
+            data['m_payment_id'] = m_payment_id
+            created.append((index, PayFastPayment(**data)))
+
+        if created:
+            payments = [payment for _, payment in created]
+            try:
+                with transaction.atomic():
+                    PayFastPayment.objects.bulk_create(
+                        payments, batch_size=conf.PAYFAST_API_BULK_INSERT_BATCH_SIZE
+                    )
+                    # bulk_create sends no post_save, so update the rollups here
+                    record_payments(added=[payment.stats_values() for payment in payments])
+                    bump_versions([payment.user_id for payment in payments])
+                    cache_payment_statuses([
+                        status_data(
+                            payment.pk, payment.m_payment_id, payment.status, payment.updated_at,
+                            payment.version, payment.user_id,
+                        )
+                        for payment in payments if payment.pk is not None
+                    ])
+            except IntegrityError:
+                raise serializers.ValidationError(
+                    {'payments': 'A payment with one of these m_payment_id values was created concurrently'}
+                )
+            if any(payment.pk is None for payment in payments):
+                # Backends that cannot return ids from a bulk insert
+                ids = dict(
+                    PayFastPayment.objects.filter(
+                        m_payment_id__in=[payment.m_payment_id for payment in payments]
+                    ).values_list('m_payment_id', 'pk')
+                )
+                for payment in payments:
+                    payment.pk = ids[payment.m_payment_id]
+        return created
+
+    def _load_users(self, items):
+        """Load every user referenced by the batch with one query"""
+        pks = set()
+        for item in items:
+            if isinstance(item, dict) and item.get('user') is not None:
+                try:
+                    pks.add(int(item['user']))
+                except (TypeError, ValueError):
+                    pass
+        return User.objects.in_bulk(pks) if pks else {}
+
+
 # ============================================================================
 # Export Serializers
 # ============================================================================
@@ -555,6 +763,59 @@ class PayFastPaymentExportSerializer(serializers.ModelSerializer):
         ]
 
 
+class PaymentExportQuerySerializer(serializers.Serializer):
+    """
+    Filters for the streaming payment export
+    
+    ``start`` and ``end`` are inclusive local dates of ``created_at``;
+    ``status`` may be repeated.
+    """
+    
+    export_format = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    status = serializers.ListField(
+        child=serializers.ChoiceField(choices=PayFastPayment.STATUS_CHOICES),
+        required=False,
+    )
+    
+    def validate(self, data):
+        """Check the date range"""
+        if data.get('start') and data.get('end') and data['start'] > data['end']:
+            raise serializers.ValidationError({'start': 'start must not be after end'})
+        return data
+
+
+class PaymentFilterSerializer(serializers.Serializer):
+    """
+    Query-parameter filters for the payments API
+    
+    Every filter is served by an index (see payfast.filters.INDEXED_FILTERS).
+    Ranges are ``>=`` for ``*_after`` and ``<`` for ``*_before``; ``status``
+    may be repeated.
+    """
+    
+    status = serializers.ListField(
+        child=serializers.ChoiceField(choices=PayFastPayment.STATUS_CHOICES),
+        required=False,
+    )
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    completed_after = serializers.DateTimeField(required=False)
+    completed_before = serializers.DateTimeField(required=False)
+    user = serializers.IntegerField(required=False, min_value=1)
+    email_address = serializers.EmailField(required=False)
+    m_payment_id_prefix = serializers.CharField(required=False, max_length=100)
+    
+    def validate(self, data):
+        """Check the ranges"""
+        for name in ['created', 'completed']:
+            after, before = data.get(f'{name}_after'), data.get(f'{name}_before')
+            if after and before and after >= before:
+                raise serializers.ValidationError({f'{name}_after': f'{name}_after must be before {name}_before'})
+        return data
+
+
 # ============================================================================
 # Validation Helpers
 # ============================================================================
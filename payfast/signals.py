@@ -1,18 +1,94 @@
 # signals.py
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
 from payfast.models import PayFastPayment
+from payfast.api_cache import bump_versions
+from payfast.models.stats import record_payments
+from payfast.status import cache_payment_statuses, forget_payment_status, status_data
+from payfast.transitions import schedule_transition_signals
 
-@receiver(post_save, sender=PayFastPayment)
-def handle_payment_complete(sender, instance, **kwargs):
+# Sent once per payment that changes status (ITNs, bulk updates, saves), after
+# the change commits and from a background thread (see payfast.transitions).
+# Arguments: payment (snapshot as committed, with its user), m_payment_id,
+# from_status, to_status
+payment_status_changed = Signal()
+
+# Sent once per payment that moves into complete, failed or cancelled, in the
+# same way and with the same arguments as payment_status_changed; from_status
+# is None for payments created in that status
+payment_completed = Signal()
+payment_failed = Signal()
+payment_cancelled = Signal()
+
+@receiver(payment_completed, sender=PayFastPayment)
+def handle_payment_complete(sender, payment, **kwargs):
     """Handle completed payments"""
-    if instance.status == 'complete' and instance.payment_status == 'COMPLETE':
+    if payment.payment_status == 'COMPLETE':
         # Grant access to user
-        if instance.user:
-            grant_premium_access(instance.user)
+        if payment.user:
+            grant_premium_access(payment.user)
         
         # Send confirmation email
-        send_confirmation_email(instance)
+        send_confirmation_email(payment)
+
+@receiver(post_save, sender=PayFastPayment)
+def schedule_payment_transition_signals(sender, instance, created, raw=False, using=None, **kwargs):
+    """Send the transition signal when a save changed the payment's status"""
+    if raw or 'status' not in instance.__dict__:
+        return
+    previous = None if created else getattr(instance, '_loaded_status', None)
+    if created or (previous is not None and instance.status != previous):
+        schedule_transition_signals([instance], previous, instance.status, using=using)
+    instance._loaded_status = instance.status
+
+@receiver(post_save, sender=PayFastPayment)
+def update_payment_stats(sender, instance, created, raw=False, **kwargs):
+    """Keep the payment rollups in step with saved payments"""
+    if raw:
+        return
+    values = instance.stats_values()
+    previous = getattr(instance, '_stats_snapshot', None)
+    if created:
+        record_payments(added=[values])
+    elif values is not None and previous is not None and values != previous:
+        record_payments(added=[values], removed=[previous])
+    instance._stats_snapshot = values
+
+@receiver(post_delete, sender=PayFastPayment)
+def remove_payment_stats(sender, instance, **kwargs):
+    """Take deleted payments out of the payment rollups"""
+    values = getattr(instance, '_stats_snapshot', None) or instance.stats_values()
+    if values is not None:
+        record_payments(removed=[values])
+
+@receiver(post_save, sender=PayFastPayment)
+@receiver(post_delete, sender=PayFastPayment)
+def bump_payment_api_versions(sender, instance, raw=False, **kwargs):
+    """Invalidate cached API responses covering the payment (and its previous owner)"""
+    if not raw:
+        bump_versions([instance.user_id, getattr(instance, '_api_user_id', None)])
+        instance._api_user_id = instance.user_id
+
+@receiver(post_save, sender=PayFastPayment)
+def update_payment_status_cache(sender, instance, raw=False, using=None, **kwargs):
+    """Cache the saved status for the return-page poll"""
+    if raw:
+        return
+    if instance.get_deferred_fields() & {'m_payment_id', 'status', 'updated_at', 'version', 'user_id'}:
+        forget_payment_status(instance.pk, using=using)
+        return
+    cache_payment_statuses(
+        [status_data(
+            instance.pk, instance.m_payment_id, instance.status, instance.updated_at,
+            instance.version, instance.user_id,
+        )],
+        using=using,
+    )
+
+@receiver(post_delete, sender=PayFastPayment)
+def remove_payment_status_cache(sender, instance, using=None, **kwargs):
+    """Forget the status of a deleted payment"""
+    forget_payment_status(instance.pk, using=using)
 
 def grant_premium_access(user):
     """Grant premium access to user"""
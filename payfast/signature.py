@@ -0,0 +1,220 @@
+# ============================================================================
+# payfast/signature.py
+# ============================================================================
+
+"""
+Signature engine for dj-payfast
+
+PayFast signs a request by URL-encoding every field as ``key=value``, joining
+the pairs with ``&``, appending the passphrase and taking the MD5 hex digest.
+
+SignatureEngine produces exactly the same output as the original
+``generate_signature`` loop but does the expensive work once:
+
+* ASCII values are encoded with a single ``str.translate`` call against a
+  precompiled table instead of going through ``quote_plus``
+* the encoded ``key=value`` segment of fields that rarely change
+  (merchant_id, merchant_key, notify_url) is cached and reused
+* the passphrase suffix is built once per engine
+"""
+
+import hashlib
+import string
+from functools import lru_cache
+from urllib.parse import quote_plus
+
+
+# Field order from the PayFast integration docs. Signatures are calculated over
+# the fields in the order they are posted, so callers that build their data in
+# a different order can ask the engine to sort it first.
+PAYFAST_FIELD_ORDER = (
+    # Merchant details
+    'merchant_id',
+    'merchant_key',
+    'return_url',
+    'cancel_url',
+    'notify_url',
+    # Customer details
+    'name_first',
+    'name_last',
+    'email_address',
+    'cell_number',
+    # Transaction details
+    'm_payment_id',
+    'amount',
+    'item_name',
+    'item_description',
+    'custom_int1',
+    'custom_int2',
+    'custom_int3',
+    'custom_int4',
+    'custom_int5',
+    'custom_str1',
+    'custom_str2',
+    'custom_str3',
+    'custom_str4',
+    'custom_str5',
+    # Transaction options
+    'email_confirmation',
+    'confirmation_address',
+    'payment_method',
+    # Recurring billing
+    'subscription_type',
+    'billing_date',
+    'recurring_amount',
+    'frequency',
+    'cycles',
+)
+
+# Fields whose encoded segment is worth caching between requests
+CONSTANT_FIELDS = (
+    'merchant_id',
+    'merchant_key',
+    'notify_url',
+)
+
+
+def _build_encoding_table():
+    """
+    Map every ASCII character to its quote_plus() encoding
+
+    Characters quote_plus() never escapes map to themselves, spaces map to
+    ``+`` and everything else to ``%XX``. ``+`` also maps to ``+`` because the
+    original implementation turned it into a space before encoding.
+    """
+    unreserved = set(string.ascii_letters + string.digits + '_.-~')
+    table = {}
+    for code in range(128):
+        char = chr(code)
+        if char in unreserved:
+            table[code] = char
+        elif char in ' +':
+            table[code] = '+'
+        else:
+            table[code] = f'%{code:02X}'
+    return table
+
+
+_ENCODING_TABLE = _build_encoding_table()
+
+# Upper bound on cached constant segments per engine
+_MAX_CACHED_SEGMENTS = 1024
+
+
+class SignatureEngine:
+    """
+    Precompiled PayFast signature generator
+
+    Output is byte-for-byte identical to ``payfast.utils.generate_signature``
+    for the same data and passphrase.
+
+    Example:
+        engine = SignatureEngine(passphrase='MyPassphrase')
+        signature = engine.generate(data)
+        signatures = engine.generate_many([data1, data2])
+    """
+
+    def __init__(self, passphrase='', constant_fields=CONSTANT_FIELDS, field_order=None):
+        """
+        Initialize the engine.
+
+        Args:
+            passphrase: PayFast passphrase appended to the payload ('' for none)
+            constant_fields: Field names whose encoded segments are cached
+            field_order: Optional field order to sort data by before signing.
+                Fields not listed keep their relative order after the listed
+                ones. By default data is signed in insertion order.
+        """
+        self.passphrase = passphrase
+        self._suffix = f'&passphrase={passphrase}' if passphrase != '' else ''
+        self._constant_fields = frozenset(constant_fields)
+        self._segments = {}
+        self._field_rank = None
+        if field_order is not None:
+            self._field_rank = {key: rank for rank, key in enumerate(field_order)}
+
+    def encode_field(self, key, value):
+        """
+        Encode a single ``key=value`` segment
+
+        Args:
+            key: Field name
+            value: Field value (converted with str())
+
+        Returns:
+            Encoded segment
+        """
+        text = str(value)
+        if key in self._constant_fields:
+            cache_key = (key, text)
+            segment = self._segments.get(cache_key)
+            if segment is None:
+                if len(self._segments) >= _MAX_CACHED_SEGMENTS:
+                    self._segments.clear()
+                segment = self._segments[cache_key] = f'{key}={_encode(text)}'
+            return segment
+        return f'{key}={_encode(text)}'
+
+    def build_payload(self, data):
+        """
+        Build the string that gets hashed
+
+        Args:
+            data: Dictionary of fields to sign
+
+        Returns:
+            Parameter string including the passphrase (if any)
+        """
+        items = data.items()
+        if self._field_rank is not None:
+            last = len(self._field_rank)
+            items = sorted(items, key=lambda item: self._field_rank.get(item[0], last))
+        encode_field = self.encode_field
+        return '&'.join([encode_field(key, value) for key, value in items]) + self._suffix
+
+    def generate(self, data):
+        """
+        Generate the MD5 signature for one set of fields
+
+        Args:
+            data: Dictionary of fields to sign
+
+        Returns:
+            MD5 signature as hex string
+        """
+        return hashlib.md5(self.build_payload(data).encode()).hexdigest()
+
+    def generate_many(self, data_iterable):
+        """
+        Generate signatures for many sets of fields
+
+        Args:
+            data_iterable: Iterable of dictionaries to sign
+
+        Returns:
+            List of MD5 signatures, in the same order as the input
+        """
+        build_payload = self.build_payload
+        md5 = hashlib.md5
+        return [md5(build_payload(data).encode()).hexdigest() for data in data_iterable]
+
+
+def _encode(text):
+    """Encode a value exactly like quote_plus(value.replace('+', ' '))"""
+    if text.isascii():
+        return text.translate(_ENCODING_TABLE)
+    return quote_plus(text.replace('+', ' '))
+
+
+@lru_cache(maxsize=16)
+def get_signature_engine(passphrase=''):
+    """
+    Get the shared engine for a passphrase
+
+    Args:
+        passphrase: PayFast passphrase ('' for none)
+
+    Returns:
+        SignatureEngine instance
+    """
+    return SignatureEngine(passphrase=passphrase)
@@ -0,0 +1,163 @@
+# ============================================================================
+# payfast/status.py
+# ============================================================================
+
+"""
+Cached payment status lookups
+
+The return page polls for a payment's status until the ITN lands. Statuses
+are kept in the cache under the payment's primary key, so a poll that hits
+the cache does not touch the database.
+
+Entries are written when a payment is created and whenever it changes
+(saves, transition(), bulk creates), always after the write has committed.
+Each entry carries the payment's ``version``, and a writer only replaces an
+entry with a lower version, under a short per-payment lock, so two commits
+whose callbacks run out of order cannot leave the older status cached.
+Readers that miss fill the cache from the database with ``add``, which never
+replaces an entry, so a reader that loaded the old status just before an ITN
+committed cannot overwrite the ITN's entry either.
+
+Statuses are only served to the payment's owner or to the session that
+checked it out (see may_view_status()).
+"""
+
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+from payfast import conf
+from payfast.models import PayFastPayment
+
+
+def _cache():
+    return caches[conf.PAYFAST_API_CACHE_ALIAS]
+
+
+def status_cache_key(pk):
+    """Cache key of a payment's status"""
+    return f'payfast:status:{pk}'
+
+
+# Attempts, and seconds between them, at taking the lock of a status entry
+LOCK_ATTEMPTS = 20
+LOCK_WAIT = 0.005
+
+
+def status_data(pk, m_payment_id, status, updated_at, version=0, user_id=None):
+    """The cached (and served) status of a payment"""
+    return {
+        'id': pk,
+        'm_payment_id': m_payment_id,
+        'status': status,
+        'updated_at': updated_at.isoformat() if updated_at else None,
+        'version': version,
+        'user_id': user_id,
+    }
+
+
+def _read_status(pk):
+    row = (
+        PayFastPayment.objects.filter(pk=pk)
+        .values_list('pk', 'm_payment_id', 'status', 'updated_at', 'version', 'user_id')
+        .first()
+    )
+    return status_data(*row) if row else None
+
+
+def may_view_status(data, user=None, session_payment_id=None):
+    """
+    Whether a request may see a payment's status
+
+    Args:
+        data: status_data() dictionary of the payment
+        user: The request's user
+        session_payment_id: ``pending_payment_id`` from the request's session
+
+    Returns:
+        True for the payment's owner and for the session the payment was
+        checked out in
+    """
+    if session_payment_id and session_payment_id == data['m_payment_id']:
+        return True
+    return bool(
+        user is not None and user.is_authenticated
+        and data.get('user_id') is not None and data['user_id'] == user.pk
+    )
+
+
+def get_payment_status(pk):
+    """
+    Status of a payment, from the cache when possible
+
+    Args:
+        pk: PayFastPayment primary key
+
+    Returns:
+        Dictionary with ``id``, ``m_payment_id``, ``status`` and
+        ``updated_at``, or None if there is no such payment
+    """
+    cache = _cache()
+    key = status_cache_key(pk)
+    data = cache.get(key)
+    if data is None:
+        data = _read_status(pk)
+        if data is not None:
+            cache.add(key, data, conf.PAYFAST_STATUS_CACHE_TIMEOUT)
+    return data
+
+
+def cache_payment_statuses(statuses, using=None):
+    """
+    Store and publish payment statuses once the current transaction commits
+
+    Args:
+        statuses: List of status_data() dictionaries
+        using: Database alias of the write
+    """
+    if not statuses:
+        return
+
+    def store_and_publish():
+        cache = _cache()
+        for data in statuses:
+            store_payment_status(cache, data)
+        # Wake SSE / long-poll clients waiting for these payments
+        from payfast.events import publish_payment_statuses
+        publish_payment_statuses(statuses)
+
+    transaction.on_commit(store_and_publish, using=using)
+
+
+def store_payment_status(cache, data):
+    """
+    Cache a committed status unless a newer version is cached already
+
+    The read-compare-write runs under a lock taken with ``add``, which is
+    atomic on every cache backend. If the lock stays taken, the entry is
+    dropped so the next reader loads the status from the database.
+
+    Args:
+        cache: Cache to write to
+        data: status_data() dictionary
+    """
+    key = status_cache_key(data['id'])
+    lock_key = f'{key}:lock'
+    for _ in range(LOCK_ATTEMPTS):
+        if cache.add(lock_key, True, 1):
+            try:
+                current = cache.get(key)
+                if current is None or current.get('version', -1) < data['version']:
+                    cache.set(key, data, conf.PAYFAST_STATUS_CACHE_TIMEOUT)
+            finally:
+                cache.delete(lock_key)
+            return
+        time.sleep(LOCK_WAIT)
+    cache.delete(key)
+
+
+def forget_payment_status(pk, using=None):
+    """Drop a deleted payment's status once the current transaction commits"""
+    key = status_cache_key(pk)
+    transaction.on_commit(lambda: _cache().delete(key), using=using)
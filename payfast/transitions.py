@@ -0,0 +1,175 @@
+# ============================================================================
+# payfast/transitions.py
+# ============================================================================
+
+"""
+Status transition signals for PayFastPayment
+
+``payment_status_changed`` is sent once for every payment that actually
+changes status, and ``payment_completed``, ``payment_failed`` or
+``payment_cancelled`` once for every payment that moves into that status,
+whether it was moved by ``transition()`` (ITNs, bulk updates,
+``transition_to()`` on the return and cancel pages) or by ``save()`` (the
+admin). Saving a payment without changing its status sends nothing.
+
+All of them are sent from here, after the transaction that made the change
+commits, from a small pool of background threads (PAYFAST_SIGNAL_WORKERS), so
+slow receivers such as emails or entitlement updates do not add to the
+response time of the ITN that triggered them. Receivers get a snapshot of the
+payment as that transition committed it (its ``status`` and ``version`` are
+the transition's), not a later reload: by the time a receiver runs, another
+transition may have moved the payment on, and it gets its own signal.
+"""
+
+import copy
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+
+from payfast import conf
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedExecutor:
+    """
+    Thread pool with a bounded backlog
+
+    At most ``max_workers`` jobs run at once and at most ``queue_size`` more
+    wait. When the backlog is full the job runs in the submitting thread
+    instead, so a burst slows its callers down rather than growing memory
+    without limit or dropping side effects.
+    """
+
+    def __init__(self, max_workers, queue_size):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='payfast-signals')
+        self._slots = threading.BoundedSemaphore(max_workers + queue_size)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            logger.warning('PayFast signal backlog is full; running %s inline', fn.__name__)
+            _call(fn, *args)
+            return
+        try:
+            self._executor.submit(self._run, fn, *args)
+        except RuntimeError:
+            # The pool has been shut down (interpreter exit)
+            self._slots.release()
+            _call(fn, *args)
+
+    def _run(self, fn, *args):
+        # Worker threads keep their own connections; treat each job like a request
+        close_old_connections()
+        try:
+            _call(fn, *args)
+        finally:
+            close_old_connections()
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def _call(fn, *args):
+    try:
+        fn(*args)
+    except Exception:
+        logger.exception('PayFast background job %s failed', fn.__name__)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the shared executor, created from settings on first use
+
+    Returns:
+        BoundedExecutor instance
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = BoundedExecutor(conf.PAYFAST_SIGNAL_WORKERS, conf.PAYFAST_SIGNAL_QUEUE_SIZE)
+    return _executor
+
+
+def run_in_background(fn, *args):
+    """Run ``fn(*args)`` on the shared executor (inline if PAYFAST_SIGNAL_WORKERS is 0)"""
+    if conf.PAYFAST_SIGNAL_WORKERS:
+        get_executor().submit(fn, *args)
+    else:
+        _call(fn, *args)
+
+
+def transition_signal(status):
+    """The signal sent when a payment enters ``status``, or None"""
+    from payfast.signals import payment_cancelled, payment_completed, payment_failed
+
+    return {
+        'complete': payment_completed,
+        'failed': payment_failed,
+        'cancelled': payment_cancelled,
+    }.get(status)
+
+
+def schedule_transition_signals(payments, from_status, to_status, using=None):
+    """
+    Send the transition signals for payments once the current transaction commits
+
+    Args:
+        payments: The payments that made the transition, as committed; they
+            are copied, so later changes to them are not seen by receivers
+        from_status: Their previous status (None for new payments)
+        to_status: Their new status
+        using: Database alias of the write
+    """
+    if not payments or (from_status is None and transition_signal(to_status) is None):
+        return
+    snapshots = [copy.copy(payment) for payment in payments]
+    transaction.on_commit(
+        lambda: run_in_background(send_transition_signals, snapshots, from_status, to_status),
+        using=using,
+    )
+
+
+def send_transition_signals(payments, from_status, to_status):
+    """
+    Send the transition signals for committed payments
+
+    ``payment_status_changed`` goes first (not for new payments), then the
+    signal of ``to_status``. Receiver errors are logged and do not stop the
+    other receivers.
+
+    Args:
+        payments: Snapshots of the payments as the transition committed them
+        from_status: Their previous status (None for new payments)
+        to_status: Their new status
+    """
+    from payfast.models import PayFastPayment
+    from payfast.signals import payment_status_changed
+
+    signals = [transition_signal(to_status)]
+    if from_status is not None:
+        signals.insert(0, payment_status_changed)
+    signals = [signal for signal in signals if signal is not None and signal.has_listeners(PayFastPayment)]
+    for payment in payments:
+        for signal in signals:
+            responses = signal.send_robust(
+                sender=PayFastPayment,
+                payment=payment,
+                m_payment_id=payment.m_payment_id,
+                from_status=from_status,
+                to_status=to_status,
+            )
+            for receiver, response in responses:
+                if isinstance(response, Exception):
+                    logger.error(
+                        'Receiver %r of the %s signal for payment %s failed',
+                        receiver, to_status, payment.m_payment_id, exc_info=response,
+                    )
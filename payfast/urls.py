@@ -1,6 +1,7 @@
 from django.urls import path, include
 from django.views.generic import TemplateView
 from . import views
+from payfast import conf
 from payfast.views import PayFastPaymentModelViewSet
 from rest_framework.routers import DefaultRouter
 
@@ -10,6 +11,16 @@ app_name = 'payfast'
 router = DefaultRouter()
 router.register("payments", PayFastPaymentModelViewSet, basename="payment")
 
+# Sync or async checkout and ITN views (PAYFAST_ASYNC_VIEWS)
+if conf.PAYFAST_ASYNC_VIEWS:
+    notify_view = views.AsyncPayFastNotifyView.as_view()
+    checkout_view = views.acheckout_view
+    payment_view = views.apayfast_payment_view
+else:
+    notify_view = views.PayFastNotifyView.as_view()
+    checkout_view = views.checkout_view
+    payment_view = views.payfast_payment_view
+
 # ============================================================================
 # Main URL Patterns
 # ============================================================================
@@ -23,7 +34,7 @@ urlpatterns = [
     # Example: https://yourdomain.com/payfast/notify/
     path(
         'notify/',
-        views.PayFastNotifyView.as_view(),
+        notify_view,
         name='notify'
     ),
     
@@ -32,7 +43,7 @@ urlpatterns = [
     # ========================================================================
     path(
         'webhook/',
-        views.PayFastNotifyView.as_view(),
+        notify_view,
         name='webhook'
     ),
     
@@ -41,14 +52,16 @@ urlpatterns = [
     # ========================================================================
     path(
         'itn/',
-        views.PayFastNotifyView.as_view(),
+        notify_view,
         name='itn'
     ),
 
-    path("checkout/", views.checkout_view, name="checkout"),
-    path("checkout/<int:pk>", views.payfast_payment_view, name="payfast_payment_view"),
+    path("checkout/", checkout_view, name="checkout"),
+    path("checkout/<int:pk>", payment_view, name="payfast_payment_view"),
     path("payment/success/<int:pk>", views.payment_success_view, name="payment_success"),
     path("payment/cancel/<int:pk>", views.payment_cancel_view, name="payment_cancel"),
+    path("payment/status/<int:pk>", views.payment_status_view, name="payment_status"),
+    path("payment/events/<int:pk>", views.payment_events_view, name="payment_events"),
     # path("notify/<int:pk>", views.payment_notify_url, name="notify_url"),
     # path("payment_cancel/<int:pk>", payment_cancel_view, name="payment_cancel"),
 ]
@@ -3,12 +3,11 @@
 # payfast/utils.py
 # ============================================================================
 
-import hashlib
 import random
 import string
-import urllib.parse
-from urllib.parse import urlencode
-from collections import OrderedDict
+import threading
+
+from payfast.signature import get_signature_engine
 
 
 
@@ -30,15 +29,31 @@ def generate_pf_id(prefix="PF", length=11):
 
 
 def generate_signature(dataArray, passPhrase = ''):
-    payload = ""
-    for key in dataArray:
-        # Get all the data from Payfast and prepare parameter string
-        payload += key + "=" + urllib.parse.quote_plus(str(dataArray[key]).replace("+", " ")) + "&"
-    # After looping through, cut the last & or append your passphrase
-    payload = payload[:-1]
-    if passPhrase != '':
-        payload += f"&passphrase={passPhrase}"
-    return hashlib.md5(payload.encode()).hexdigest()
+    """
+    Generate PayFast signature
+    
+    Args:
+        dataArray: Dictionary of fields to sign, in the order they are posted
+        passPhrase: PayFast passphrase ('' for none)
+    
+    Returns:
+        MD5 signature as hex string
+    """
+    return get_signature_engine(passPhrase).generate(dataArray)
+
+
+def generate_signatures(data_iterable, passphrase=''):
+    """
+    Generate PayFast signatures for many sets of fields at once
+    
+    Args:
+        data_iterable: Iterable of dictionaries to sign
+        passphrase: PayFast passphrase ('' for none)
+    
+    Returns:
+        List of MD5 signatures, in the same order as the input
+    """
+    return get_signature_engine(passphrase).generate_many(data_iterable)
 
 
 def verify_signature(data_dict, passphrase=None):
@@ -68,17 +83,46 @@ def validate_ip(ip_address):
     Returns:
         Boolean indicating if IP is valid
     """
-    # PayFast valid IP addresses
-    valid_hosts = [
-        'www.payfast.co.za',
-        'sandbox.payfast.co.za',
-        'w1w.payfast.co.za',
-        'w2w.payfast.co.za',
-    ]
+    from . import conf
+    
+    if not conf.PAYFAST_VALIDATE_IP:
+        return True
+    return get_ip_allowlist().is_allowed(ip_address)
+
+
+_ip_allowlist = None
+_ip_allowlist_lock = threading.Lock()
+
+
+def get_ip_allowlist():
+    """
+    Get the shared PayFast IP allowlist, built from settings on first use
+    
+    Returns:
+        PayFastIPAllowlist instance
+    """
+    global _ip_allowlist
+    
+    if _ip_allowlist is None:
+        with _ip_allowlist_lock:
+            if _ip_allowlist is None:
+                _ip_allowlist = _build_ip_allowlist()
+    return _ip_allowlist
+
+
+def _build_ip_allowlist():
+    """Create the allowlist from the PAYFAST_VALID_* and PAYFAST_IP_* settings"""
+    from django.utils.module_loading import import_string
+    from . import conf
+    from .allowlist import PAYFAST_HOSTS, PAYFAST_IP_RANGES, PayFastIPAllowlist
     
-    # In production, you should resolve these hosts to IPs and check
-    # For now, we'll return True (implement proper validation in production)
-    return True
+    return PayFastIPAllowlist(
+        hosts=conf.PAYFAST_VALID_HOSTS or PAYFAST_HOSTS,
+        ip_ranges=conf.PAYFAST_VALID_IP_RANGES or PAYFAST_IP_RANGES,
+        resolver=import_string(conf.PAYFAST_IP_RESOLVER),
+        ttl=conf.PAYFAST_IP_ALLOWLIST_TTL,
+    )
+
 
 def clear_expired_pending_payments(user, hours=24):
     """
@@ -97,8 +141,34 @@ def clear_expired_pending_payments(user, hours=24):
     
     expired_count = PayFastPayment.objects.filter(
         user=user,
-        status='pending',
         created_at__lt=cutoff_time
-    ).update(status='cancelled')
+    ).transition('cancelled')
     
-    return expired_count
\ No newline at end of file
+    return expired_count
+
+
+def iter_id_chunks(queryset, chunk_size):
+    """
+    Stream primary keys of a queryset in ascending chunks
+
+    Uses keyset pagination on the primary key, so each chunk is one indexed
+    range query no matter how far into the table it is, and rows updated or
+    deleted while iterating are never skipped or seen twice.
+
+    Args:
+        queryset: Queryset to stream
+        chunk_size: Maximum number of ids per chunk
+
+    Yields:
+        Lists of primary keys
+    """
+    last_id = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_id is not None:
+            chunk = chunk.filter(pk__gt=last_id)
+        ids = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
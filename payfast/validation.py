@@ -0,0 +1,239 @@
+# ============================================================================
+# payfast/validation.py
+# ============================================================================
+
+"""
+Server-side ITN validation for dj-payfast
+
+PayFast asks merchants to post every ITN back to PAYFAST_VALIDATE_URL and
+only trust it if the answer is ``VALID``. PayFastValidationClient does this
+over one shared keep-alive session with a bounded connection pool, strict
+timeouts and a couple of jittered retries. A circuit breaker stops calling
+PayFast for a while after repeated failures, so a slow PayFast cannot tie up
+every worker; callers get PayFastValidationUnavailable straight away and can
+defer the notification instead.
+"""
+
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from payfast import conf
+from payfast.exceptions import PayFastValidationUnavailable
+from payfast.signature import get_signature_engine
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Minimal thread-safe circuit breaker
+
+    The breaker opens after ``failure_threshold`` consecutive failures and
+    rejects calls for ``reset_timeout`` seconds. After that a single trial call
+    is let through (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        """
+        Initialize the breaker.
+
+        Args:
+            failure_threshold: Consecutive failures before the breaker opens
+            reset_timeout: Seconds to stay open before allowing a trial call
+            clock: Monotonic clock, replaceable in tests
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self):
+        """
+        Check whether a call may go ahead
+
+        Returns:
+            Boolean indicating if the call is allowed
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_progress or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial_in_progress = False
+
+
+class PayFastValidationClient:
+    """
+    Client for PayFast's ITN validation endpoint
+
+    Example:
+        client = PayFastValidationClient()
+        if not client.validate(request.POST.dict()):
+            raise PayFastValidationError('Server validation failed')
+    """
+
+    # Responses worth retrying; anything else is a definite answer
+    RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, validate_url=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, pool_size=None, backoff=0.2, breaker=None):
+        """
+        Initialize the client.
+
+        Args:
+            validate_url: Validation endpoint (defaults to PAYFAST_VALIDATE_URL)
+            connect_timeout: Seconds to wait for a connection
+            read_timeout: Seconds to wait for the response
+            max_retries: Extra attempts after a timeout, connection error or 5xx
+            pool_size: Maximum number of pooled keep-alive connections
+            backoff: Base delay in seconds for the jittered exponential backoff
+            breaker: CircuitBreaker instance (one is created from settings if omitted)
+        """
+        self.validate_url = validate_url or conf.PAYFAST_VALIDATE_URL
+        self.timeout = (
+            conf.PAYFAST_VALIDATION_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            conf.PAYFAST_VALIDATION_READ_TIMEOUT if read_timeout is None else read_timeout,
+        )
+        self.max_retries = conf.PAYFAST_VALIDATION_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=conf.PAYFAST_VALIDATION_BREAKER_THRESHOLD,
+            reset_timeout=conf.PAYFAST_VALIDATION_BREAKER_RESET,
+        )
+
+        pool_size = conf.PAYFAST_VALIDATION_POOL_SIZE if pool_size is None else pool_size
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    def validate(self, post_data):
+        """
+        Ask PayFast whether an ITN is genuine
+
+        Args:
+            post_data: Dictionary of ITN data as received from PayFast
+
+        Returns:
+            True if PayFast answered VALID, False for any other definite answer
+
+        Raises:
+            PayFastValidationUnavailable: If the breaker is open or PayFast
+                could not be reached after all retries
+        """
+        if not self.breaker.allow_request():
+            raise PayFastValidationUnavailable('PayFast validation circuit is open')
+
+        # Whatever goes wrong from here on, the breaker must hear about it:
+        # a half-open trial left running would refuse every later call
+        try:
+            # PayFast expects the parameter string without the signature
+            payload = get_signature_engine('').build_payload(
+                {key: value for key, value in post_data.items() if key != 'signature'}
+            )
+
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self._sleep(attempt)
+                try:
+                    response = self.session.post(self.validate_url, data=payload, timeout=self.timeout)
+                except requests.RequestException as e:
+                    logger.warning('PayFast validation attempt %d failed: %s', attempt + 1, e)
+                    continue
+                if response.status_code in self.RETRY_STATUS_CODES:
+                    logger.warning(
+                        'PayFast validation attempt %d returned %d', attempt + 1, response.status_code
+                    )
+                    continue
+
+                valid = response.status_code == 200 and response.text.strip() == 'VALID'
+                break
+            else:
+                valid = None
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+
+        if valid is None:
+            self.breaker.record_failure()
+            raise PayFastValidationUnavailable(
+                f'PayFast validation failed after {self.max_retries + 1} attempt(s)'
+            )
+        self.breaker.record_success()
+        return valid
+
+    def _sleep(self, attempt):
+        """Exponential backoff with full jitter"""
+        time.sleep(random.uniform(0, self.backoff * (2 ** (attempt - 1))))
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_validation_client():
+    """
+    Get the shared validation client, created from settings on first use
+
+    Returns:
+        PayFastValidationClient instance
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PayFastValidationClient()
+    return _client
+
+
+def validate_with_payfast(post_data):
+    """
+    Validate an ITN with PayFast using the shared client
+
+    Args:
+        post_data: Dictionary of ITN data as received from PayFast
+
+    Returns:
+        Boolean indicating if PayFast confirmed the notification
+    """
+    return get_validation_client().validate(post_data)
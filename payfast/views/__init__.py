@@ -1,9 +1,14 @@
 from .normal_payment_views import (
     checkout_view,
     payfast_payment_view,
+    acheckout_view,
+    apayfast_payment_view,
     payment_success_view,
+    payment_status_view,
+    payment_events_view,
     payment_cancel_view,
     PayFastNotifyView,
+    AsyncPayFastNotifyView,
     PayFastPaymentModelViewSet,
 
 )
@@ -12,9 +17,14 @@ from .normal_payment_views import (
 __all__ = [
     "checkout_view",
     "payfast_payment_view",
+    "acheckout_view",
+    "apayfast_payment_view",
     "payment_success_view",
+    "payment_status_view",
+    "payment_events_view",
     "payment_cancel_view",
     "PayFastNotifyView",
+    "AsyncPayFastNotifyView",
     "PayFastPaymentModelViewSet",
     # "recurring_payment_view",
 ]
\ No newline at end of file
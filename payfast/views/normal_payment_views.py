@@ -1,34 +1,81 @@
-from django.http import HttpResponse, HttpResponseBadRequest
+import json
+import logging
+
+import django
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 from django.views.generic import View
 from django.utils.decorators import method_decorator
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 
 
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
 
 # Create your views here.
-from payfast.conf import PAYFAST_URL
-from payfast.pagination import PayfastPagination
-from payfast.models import PayFastPayment, PayFastNotification
-from payfast.serializers import PayFastPaymentCreateSerializer, PayFastPaymentListSerializer, PayFastPaymentUpdateSerializer, PayFastPaymentDetailSerializer
-from payfast.utils import generate_signature, validate_ip, generate_pf_id
+from payfast import conf
+from payfast.api_cache import ALL, get_cached_response, get_version, make_etag, response_cache_key, set_cached_response
+from payfast.bulk import bulk_update_status
+from payfast.checkout import aget_checkout_form, get_checkout_form, prime_checkout_forms
+from payfast.filters import PaymentFilterBackend
+from payfast.export import FORMATS, export_queryset, iter_export
+from payfast.exceptions import DuplicateNotificationError, IPValidationError, PayFastError, PayFastValidationUnavailable, PaymentConflictError
+from payfast.itn import aenqueue_notification, aprocess_notification, enqueue_notification, is_duplicate, process_notification
+from payfast.status import get_payment_status, may_view_status
+from payfast.events import HEARTBEAT, watch_payment_status
+from payfast.pagination import PayfastCursorPagination, PayfastPagination
+from payfast.models import PayFastPayment, PayFastNotification, PayFastPaymentBucket, PayFastPaymentStats
+from payfast.models.stats import get_stats_timezone
+from payfast.serializers import compile_serializer, PayFastPaymentCreateSerializer, PayFastPaymentListSerializer, PayFastPaymentUpdateSerializer, PayFastPaymentDetailSerializer, PayFastPaymentBulkCreateSerializer, BulkPaymentStatusUpdateSerializer, PaymentStatisticsSerializer, PaymentTimeSeriesQuerySerializer, PaymentTimeSeriesSerializer, PaymentExportQuerySerializer
+from payfast.utils import generate_pf_id
+
+logger = logging.getLogger(__name__)
 
 
 def get_client_ip(request):
-    """Get client IP address from request"""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+    """
+    Get client IP address from request
+
+    ``X-Forwarded-For`` is only read behind PAYFAST_TRUSTED_PROXY_COUNT
+    proxies, and then only the entry added by the outermost of them: the
+    entries before it are whatever the client sent.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR')
+    proxies = conf.PAYFAST_TRUSTED_PROXY_COUNT
+    if not proxies:
+        return remote_addr
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if len(forwarded) < proxies:
+        return remote_addr
+    return forwarded[-proxies]
+
+
+def _warn_untrusted_proxy(request, error):
+    """Log a hint when an ITN was rejected by IP behind a proxy Django does not trust"""
+    if (
+        isinstance(error, IPValidationError)
+        and not conf.PAYFAST_TRUSTED_PROXY_COUNT
+        and request.META.get('HTTP_X_FORWARDED_FOR')
+    ):
+        logger.warning(
+            'Rejected an ITN from %s that came with X-Forwarded-For; if Django runs behind a '
+            'reverse proxy, set PAYFAST_TRUSTED_PROXY_COUNT to the number of proxies',
+            request.META.get('REMOTE_ADDR'),
+        )
 
 
 @login_required
@@ -93,63 +140,12 @@ def checkout_view(request):
         request.session['pending_payment_id'] = payment.m_payment_id
         print(f"✓ Created new payment: {payment.m_payment_id}")
     
-    # Build callback URLs
-    return_url = request.build_absolute_uri(
-        reverse('payfast:payment_success', kwargs={'pk': payment.pk})
-    )
-    cancel_url = request.build_absolute_uri(
-        reverse('payfast:payment_cancel', kwargs={'pk': payment.pk})
-    )
-    notify_url = request.build_absolute_uri(reverse('payfast:notify'))
-    
-    # Build PayFast form data
-    initial_data = {
-        # Merchant details
-        "merchant_id": settings.PAYFAST_MERCHANT_ID,
-        "merchant_key": settings.PAYFAST_MERCHANT_KEY,
-        
-        # Callback URLs
-        'return_url': return_url,
-        'cancel_url': cancel_url,
-        'notify_url': notify_url,
-        
-        # Buyer details
-        'name_first': payment.name_first or "John",
-        'name_last': payment.name_last or "Doe",
-        'email_address': payment.email_address,
-        
-        # Transaction details
-        'payment_id': payment.id,
-        'm_payment_id': payment.m_payment_id,
-        'amount': str(payment.amount),
-        'item_name': payment.item_name,
-        'item_description': payment.item_description,
-    }
-    
-    # Add custom fields if present
-    if payment.custom_str1:
-        initial_data['custom_str1'] = payment.custom_str1
-    if payment.custom_int1:
-        initial_data['custom_int1'] = str(payment.custom_int1)
-    
-    # Generate signature
-    signature = generate_signature(initial_data, settings.PAYFAST_PASSPHRASE)
-    initial_data['signature'] = signature
-    
-    # Generate HTML form
-    html_form = f'<form action="{PAYFAST_URL}" method="post">'
-    for key, value in initial_data.items():
-        html_form += f'<input name="{key}" type="hidden" value="{value}" />'
-    
-    html_form += f'''
-        <button type="submit" class="btn btn-pay" id="pay-btn">
-            <i class="bi bi-lock-fill"></i>
-            <span>Pay R{payment.amount} with PayFast</span>
-        </button>
-    </form>'''
+    # Signed form fields and HTML form, cached until the payment changes
+    initial_data, html_form = get_checkout_form(request, payment)
     
     return render(request, 'payfast/checkout.html', {
         'htmlForm': html_form,
+        'form_data': initial_data,
         'payment': payment,
     })
 
@@ -171,62 +167,136 @@ def payfast_payment_view(request, pk):
     if payment.status in ["failed", "cancelled"]:
         return redirect('payfast:payment_cancel', pk=payment.pk)
     
-    # Build callback URLs
-    return_url = request.build_absolute_uri(
-        reverse('payfast:payment_success', kwargs={'pk': payment.pk})
-    )
-    cancel_url = request.build_absolute_uri(
-        reverse('payfast:payment_cancel', kwargs={'pk': payment.pk})
-    )
-    notify_url = request.build_absolute_uri(reverse('payfast:notify'))
-    
-    # Build PayFast form data
-    initial_data = {
-        # Merchant details
-        "merchant_id": settings.PAYFAST_MERCHANT_ID,
-        "merchant_key": settings.PAYFAST_MERCHANT_KEY,
-        
-        # Callback URLs
-        'return_url': return_url,
-        'cancel_url': cancel_url,
-        'notify_url': notify_url,
-        
-        # Buyer details
-        'name_first': payment.name_first or "John",
-        'name_last': payment.name_last or "Doe",
-        'email_address': payment.email_address,
-        
-        # Transaction details
-        'm_payment_id': payment.m_payment_id,
-        'amount': str(payment.amount),
-        'item_name': payment.item_name,
-        'item_description': payment.item_description,
-    }
-    
-    # Add custom fields if present
-    if payment.custom_str1:
-        initial_data['custom_str1'] = payment.custom_str1
-    if payment.custom_int1:
-        initial_data['custom_int1'] = str(payment.custom_int1)
-    
-    # Generate signature
-    signature = generate_signature(initial_data, settings.PAYFAST_PASSPHRASE)
-    initial_data['signature'] = signature
-    
-    # Generate HTML form
-    html_form = f'<form action="{PAYFAST_URL}" method="post">'
-    for key, value in initial_data.items():
-        html_form += f'<input name="{key}" type="hidden" value="{value}" />'
-    
-    html_form += f'''
-        <button type="submit" class="btn btn-pay" id="pay-btn">
-            <i class="bi bi-lock-fill"></i>
-            <span>Pay R{payment.amount} with PayFast</span>
-        </button>
-    </form>'''
+    # Signed form fields and HTML form, cached until the payment changes
+    initial_data, html_form = get_checkout_form(request, payment)
     
     return render(request, 'payfast/checkout.html', {
         'htmlForm': html_form,
+        'form_data': initial_data,
+        'payment': payment,
+    })
+
+
+# ============================================================================
+# Async views (PAYFAST_ASYNC_VIEWS)
+# ============================================================================
+
+async def _auser(request):
+    """The request's user, loaded without blocking the event loop"""
+    if hasattr(request, 'auser'):
+        return await request.auser()
+
+    def load_user():
+        # Evaluate the lazy user in a thread
+        request.user.is_authenticated
+        return request.user
+    return await sync_to_async(load_user)()
+
+
+async def _session_get(session, key):
+    if hasattr(session, 'aget'):
+        return await session.aget(key)
+    return await sync_to_async(session.get)(key)
+
+
+async def _session_set(session, key, value):
+    if hasattr(session, 'aset'):
+        await session.aset(key, value)
+    else:
+        await sync_to_async(session.__setitem__)(key, value)
+
+
+async def _session_pop(session, key):
+    if hasattr(session, 'apop'):
+        await session.apop(key, None)
+    else:
+        await sync_to_async(session.pop)(key, None)
+
+
+async def acheckout_view(request):
+    """
+    Async version of checkout_view
+
+    The user, the session and the payment are loaded with Django's async
+    APIs, so under ASGI the view only leaves the event loop for the queries
+    themselves.
+    """
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    # Get payment parameters from query string
+    amount = request.GET.get("amount", 9.99)
+    item_name = request.GET.get("item_name", 'Premium Subscription')
+    item_description = request.GET.get("item_description", '1 month premium access')
+    email_address = request.GET.get("email_address", user.email)
+    name_first = request.GET.get("name_first", user.first_name or "John")
+    name_last = request.GET.get("name_last", user.last_name or "Doe")
+
+    # Custom fields (optional)
+    custom_str1 = request.GET.get("custom_str1", "")
+    custom_int1 = request.GET.get("custom_int1", None)
+
+    # Reuse the pending payment stored in the session
+    session_payment_id = await _session_get(request.session, 'pending_payment_id')
+    payment = None
+
+    if session_payment_id:
+        try:
+            payment = await PayFastPayment.objects.aget(
+                m_payment_id=session_payment_id,
+                user=user,
+                status='pending'
+            )
+        except PayFastPayment.DoesNotExist:
+            await _session_pop(request.session, 'pending_payment_id')
+
+    # Create new payment only if we don't have a pending one
+    if payment is None:
+        payment = await PayFastPayment.objects.acreate(
+            user=user,
+            m_payment_id=generate_pf_id(),
+            amount=float(amount),
+            item_name=item_name,
+            item_description=item_description,
+            email_address=email_address,
+            name_first=name_first,
+            name_last=name_last,
+            custom_str1=custom_str1,
+            custom_int1=int(custom_int1) if custom_int1 else None,
+        )
+        await _session_set(request.session, 'pending_payment_id', payment.m_payment_id)
+
+    initial_data, html_form = await aget_checkout_form(request, payment)
+
+    return render(request, 'payfast/checkout.html', {
+        'htmlForm': html_form,
+        'form_data': initial_data,
+        'payment': payment,
+    })
+
+
+async def apayfast_payment_view(request, pk):
+    """Async version of payfast_payment_view"""
+    user = await _auser(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    try:
+        payment = await PayFastPayment.objects.aget(pk=pk)
+    except PayFastPayment.DoesNotExist:
+        raise Http404('No PayFastPayment matches the given query.')
+
+    if payment.status == "complete":
+        return redirect('payfast:payment_success', pk=payment.pk)
+    if payment.status in ["failed", "cancelled"]:
+        return redirect('payfast:payment_cancel', pk=payment.pk)
+
+    initial_data, html_form = await aget_checkout_form(request, payment)
+
+    return render(request, 'payfast/checkout.html', {
+        'htmlForm': html_form,
+        'form_data': initial_data,
         'payment': payment,
     })
 
@@ -235,10 +305,10 @@ def payment_success_view(request, pk):
     """Handle successful payment return"""
     payment = get_object_or_404(PayFastPayment, pk=pk)
     
-    # Mark payment as complete
+    # Mark payment as complete; an ITN racing this request is resolved by
+    # the compare-and-swap in transition_to()
     if payment.status == 'pending':
         payment.mark_complete()
-        payment.save()
     
     # Clear the session payment ID
     if 'pending_payment_id' in request.session:
@@ -249,14 +319,101 @@ def payment_success_view(request, pk):
     })
 
 
+@require_GET
+def payment_status_view(request, pk):
+    """
+    Current status of a payment, for polling from the return page
+
+    Served from the status cache, so polls do not touch the database once the
+    status is cached. Only the payment's owner and the session it was checked
+    out in see it; anyone else gets a 404.
+    """
+    data = get_payment_status(pk)
+    if data is None or not may_view_status(data, request.user, request.session.get('pending_payment_id')):
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    response = JsonResponse(data)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+async def payment_events_view(request, pk):
+    """
+    Wait for a payment to leave pending
+
+    With ``Accept: text/event-stream`` the response is a Server-Sent Events
+    stream: a ``status`` event with the current status, keep-alive comments
+    and a ``status`` event for each change. The stream closes once the
+    payment is no longer pending. Otherwise it is a long poll, which answers
+    with the status as soon as the payment leaves pending, or with the
+    pending status after ``?timeout=`` seconds (at most
+    PAYFAST_EVENTS_TIMEOUT).
+
+    The view is async: while it waits, it holds neither a worker thread nor a
+    database connection. StreamingHttpResponse only takes async iterators from
+    Django 4.2; on older versions an SSE request is answered like a long poll,
+    with the events it saw in one ``text/event-stream`` body, and EventSource
+    reconnects for the next change. Like payment_status_view, it answers 404 to anyone
+    but the payment's owner and the session it was checked out in.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        timeout = max(0.0, min(float(request.GET['timeout']), conf.PAYFAST_EVENTS_TIMEOUT))
+    except (KeyError, ValueError):
+        timeout = conf.PAYFAST_EVENTS_TIMEOUT
+
+    events = watch_payment_status(pk, timeout=timeout)
+    current = await events.__anext__()
+    if current is None or not may_view_status(
+        current, await _auser(request), await _session_get(request.session, 'pending_payment_id')
+    ):
+        await events.aclose()
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+    if sse and django.VERSION >= (4, 2):
+        response = StreamingHttpResponse(_sse_stream(current, events), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    seen = [current]
+    async for event in events:
+        if event is not HEARTBEAT:
+            seen.append(event)
+    if sse:
+        response = HttpResponse(''.join(_sse_event(event) for event in seen), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+    response = JsonResponse(seen[-1])
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _sse_event(data):
+    return f'event: status\ndata: {json.dumps(data)}\n\n'
+
+
+async def _sse_stream(current, events):
+    try:
+        yield _sse_event(current)
+        async for event in events:
+            if event is HEARTBEAT:
+                yield ': keep-alive\n\n'
+            else:
+                yield _sse_event(event)
+    finally:
+        await events.aclose()
+
+
 def payment_cancel_view(request, pk):
     """Handle cancelled payment"""
     payment = get_object_or_404(PayFastPayment, pk=pk)
     
     # Mark payment as cancelled
     if payment.status == 'pending':
-        payment.status = 'cancelled'
-        payment.save()
+        payment.transition_to('cancelled')
     
     # Clear the session payment ID
     if 'pending_payment_id' in request.session:
@@ -282,19 +439,24 @@ class PayFastNotifyView(View):
         # Get IP address
         ip_address = get_client_ip(request)
         
+        # PayFast retries until it gets a 200; acknowledge known duplicates
+        if is_duplicate(post_data):
+            return HttpResponse('OK', status=200)
+        
+        # Queue mode: store the raw payload and let the worker apply it
+        if conf.PAYFAST_ITN_QUEUE_MODE:
+            try:
+                enqueue_notification(post_data, ip_address)
+            except DuplicateNotificationError:
+                pass
+            return HttpResponse('OK', status=200)
+        
         # Initialize notification record
         notification = PayFastNotification(
             raw_data=post_data,
             ip_address=ip_address
         )
         
-        # Validate IP address
-        if not validate_ip(ip_address):
-            notification.is_valid = False
-            notification.validation_errors = 'Invalid IP address'
-            notification.save()
-            return HttpResponseBadRequest('Invalid IP')
-        
         # Verify signature
         # if not verify_signature(post_data, conf.PAYFAST_PASSPHRASE):
         #     notification.is_valid = False
@@ -302,49 +464,76 @@ class PayFastNotifyView(View):
         #     notification.save()
         #     return HttpResponseBadRequest('Invalid signature')
         
-        # Validate with PayFast server
-        # if not self.validate_with_payfast(post_data):
-        #     notification.is_valid = False
-        #     notification.validation_errors = 'Server validation failed'
-        #     notification.save()
-        #     return HttpResponseBadRequest('Validation failed')
-        
-        # Get payment record
-        m_payment_id = post_data.get('m_payment_id')
+        # Validate the notification (IP, payment, PayFast server when
+        # PAYFAST_VALIDATE_WITH_SERVER is on) and update the payment record
         try:
-            payment = PayFastPayment.objects.get(m_payment_id=m_payment_id)
-            notification.payment = payment
-        except PayFastPayment.DoesNotExist:
-            notification.is_valid = False
-            notification.validation_errors = 'Payment not found'
-            notification.save()
-            return HttpResponseBadRequest('Payment not found')
-        
-        # Mark notification as valid
-        notification.is_valid = True
-        notification.save()
-        
-        # Update payment record
-        payment.pf_payment_id = post_data.get('pf_payment_id')
-        payment.payment_status = post_data.get('payment_status')
-        payment.amount_gross = post_data.get('amount_gross')
-        payment.amount_fee = post_data.get('amount_fee')
-        payment.amount_net = post_data.get('amount_net')
-        
-        # Update status based on payment_status
-        if post_data.get('payment_status') == 'COMPLETE':
-            payment.mark_complete()
-        else:
-            payment.mark_failed()
+            process_notification(notification)
+        except DuplicateNotificationError:
+            return HttpResponse('OK', status=200)
+        except PayFastValidationUnavailable as e:
+            if notification.processing_state == 'queued':
+                # Deferred to the background worker
+                return HttpResponse('OK', status=200)
+            return HttpResponse(str(e), status=503)
+        except PayFastError as e:
+            _warn_untrusted_proxy(request, e)
+            return HttpResponseBadRequest(str(e))
         
         return HttpResponse('OK', status=200)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPayFastNotifyView(View):
+    """
+    Async version of PayFastNotifyView
+
+    Only POST is allowed (View answers other methods with a 405). Validation
+    with PayFast runs in a worker thread of its own, so under ASGI slow
+    PayFast round trips do not queue up behind each other.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        post_data = request.POST.dict()
+        ip_address = get_client_ip(request)
+
+        # PayFast retries until it gets a 200; acknowledge known duplicates
+        if is_duplicate(post_data):
+            return HttpResponse('OK', status=200)
+
+        # Queue mode: store the raw payload and let the worker apply it
+        if conf.PAYFAST_ITN_QUEUE_MODE:
+            try:
+                await aenqueue_notification(post_data, ip_address)
+            except DuplicateNotificationError:
+                pass
+            return HttpResponse('OK', status=200)
+
+        notification = PayFastNotification(
+            raw_data=post_data,
+            ip_address=ip_address
+        )
+
+        try:
+            await aprocess_notification(notification)
+        except DuplicateNotificationError:
+            return HttpResponse('OK', status=200)
+        except PayFastValidationUnavailable as e:
+            if notification.processing_state == 'queued':
+                # Deferred to the background worker
+                return HttpResponse('OK', status=200)
+            return HttpResponse(str(e), status=503)
+        except PayFastError as e:
+            _warn_untrusted_proxy(request, e)
+            return HttpResponseBadRequest(str(e))
+
+        return HttpResponse('OK', status=200)
+
+
 class PayFastPaymentModelViewSet(ModelViewSet):
     model = PayFastPayment
     queryset = PayFastPayment.objects.all()
     serializer_class = PayFastPaymentCreateSerializer
-    pagination_class  = PayfastPagination
+    filter_backends = [PaymentFilterBackend]
 
     serializer_classes = {
         "create": PayFastPaymentCreateSerializer,
@@ -352,7 +541,223 @@ class PayFastPaymentModelViewSet(ModelViewSet):
         "retrieve": PayFastPaymentDetailSerializer,
         "update": PayFastPaymentUpdateSerializer,
         "partial_update": PayFastPaymentUpdateSerializer,
+        "bulk": PayFastPaymentBulkCreateSerializer,
+        "bulk_status": BulkPaymentStatusUpdateSerializer,
+        "stats": PaymentStatisticsSerializer,
+        "timeseries": PaymentTimeSeriesSerializer,
+    }
+
+    # Relations each action's serializer reads, joined instead of queried per row
+    select_related_fields = {
+        "list": ["user"],
     }
 
+    # Columns each action's serializer reads; everything else is deferred.
+    # Update actions load the full row because save() writes every field.
+    only_fields = {
+        "list": [
+            "id", "m_payment_id", "pf_payment_id", "user", "amount", "item_name",
+            "status", "created_at", "completed_at", "name_first", "name_last",
+            "user__email", "user__first_name", "user__last_name",
+        ],
+        "retrieve": [
+            "id", "amount", "item_name", "item_description", "name_first",
+            "name_last", "email_address", "m_payment_id", "updated_at",
+        ],
+    }
+
+    @property
+    def pagination_class(self):
+        if conf.PAYFAST_API_PAGINATION == 'page':
+            return PayfastPagination
+        return PayfastCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        select_related = self.select_related_fields.get(self.action)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        only = self.only_fields.get(self.action)
+        if only:
+            queryset = queryset.only(*only)
+        return queryset
+
     def get_serializer_class(self):
-        return self.serializer_classes.get(self.action, PayFastPaymentCreateSerializer)
\ No newline at end of file
+        return self.serializer_classes.get(self.action, PayFastPaymentCreateSerializer)
+
+    def get_version_scope(self):
+        """Change counter covering the list: the user whose payments it reads, or all"""
+        user = self.request.query_params.get("user", "")
+        return int(user) if user.isdigit() else ALL
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Payment detail with a strong ETag and Last-Modified from ``updated_at``
+
+        ``If-None-Match`` / ``If-Modified-Since`` that still match get a 304
+        without the payment being serialized.
+        """
+        instance = self.get_object()
+        etag = make_etag(instance.pk, instance.updated_at.isoformat(), request.accepted_renderer.format)
+        last_modified = int(instance.updated_at.timestamp())
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is None:
+            not_modified = Response(self.get_serializer(instance).data)
+        not_modified["ETag"] = etag
+        not_modified["Last-Modified"] = http_date(last_modified)
+        patch_vary_headers(not_modified, ["Accept"])
+        return not_modified
+
+    def update(self, request, *args, **kwargs):
+        """
+        Update a payment; 409 if another writer changed it during the request
+
+        save() only writes the row while it has the version it was loaded
+        with, so a concurrent ITN or update is never overwritten.
+        """
+        try:
+            with transaction.atomic():
+                return super().update(request, *args, **kwargs)
+        except PaymentConflictError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+
+    def list(self, request, *args, **kwargs):
+        """
+        Payment list with an ETag from the change counter of its scope
+
+        A matching ``If-None-Match`` gets a 304 without a database query, and
+        serialized pages are cached per version, user and query string.
+        """
+        version = get_version(self.get_version_scope())
+        etag = make_etag(version, request.user.pk, request.accepted_renderer.format, request.get_full_path())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache_key = response_cache_key(request, version)
+            data = get_cached_response(cache_key)
+            if data is None:
+                data = self.list_data()
+                set_cached_response(cache_key, data)
+            response = Response(data)
+        response["ETag"] = etag
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    def list_data(self):
+        """Serialized list page, as returned by ModelViewSet.list"""
+        if not conf.PAYFAST_API_COMPILED_SERIALIZERS:
+            return super().list(self.request).data
+
+        # Same output as the list serializer, built from values() rows
+        serializer = compile_serializer(self.get_serializer_class())
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page)).data
+        return serializer.serialize(queryset)
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        """
+        Create many payments in one request
+
+        Body: ``{"payments": [{...}, ...]}`` with the fields of the create
+        endpoint (plus an optional ``m_payment_id``). Valid items are inserted
+        with one ``bulk_create``; each created row comes back with its index,
+        ``payfast_url`` and signed checkout ``form_data``. Invalid items are
+        listed under ``errors`` by index. Returns 201 if anything was created,
+        400 otherwise.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created = serializer.save()
+
+        payments = [payment for _, payment in created]
+        form_data = prime_checkout_forms(request, payments)
+        results = [
+            {
+                "index": index,
+                "id": payment.pk,
+                "m_payment_id": payment.m_payment_id,
+                "payfast_url": request.build_absolute_uri(payment.get_payfast_url()),
+                "form_data": data,
+            }
+            for (index, payment), data in zip(created, form_data)
+        ]
+        return Response(
+            {"created": len(results), "results": results, "errors": serializer.item_errors},
+            status=status.HTTP_201_CREATED if results else status.HTTP_400_BAD_REQUEST,
+        )
+
+    @action(detail=False, methods=["post"], url_path="bulk-status")
+    def bulk_status(self, request):
+        """
+        Cancel or fail many pending payments by m_payment_id
+
+        Body: ``{"payment_ids": [...], "status": "cancelled"}``. Ids are
+        applied in chunked, short transactions; payments that are no longer
+        pending are skipped. Returns the ``updated``, ``skipped`` and
+        ``not_found`` counts and the ``not_found_ids``.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = bulk_update_status(
+            serializer.validated_data["payment_ids"],
+            serializer.validated_data["status"],
+        )
+        return Response(result)
+
+    @action(detail=False, methods=["get"])
+    def stats(self, request):
+        """
+        Payment totals, read from the PayFastPaymentStats rollup
+
+        The rollup is updated as payments are created and change status, so
+        this reads at most one row per status instead of aggregating the
+        payments table.
+        """
+        serializer = self.get_serializer(PayFastPaymentStats.objects.summary())
+        return Response(serializer.data)
+
+    @action(detail=False, methods=["get"])
+    def timeseries(self, request):
+        """
+        Payment counts per local day (or hour), read from PayFastPaymentBucket
+
+        Query parameters: ``start``, ``end`` (dates, inclusive) and
+        ``interval`` (``day`` or ``hour``). Costs one indexed range query over
+        the buckets, so the price depends on the number of days, not payments.
+        """
+        params = PaymentTimeSeriesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        rows = PayFastPaymentBucket.objects.series(
+            params.validated_data["interval"],
+            params.validated_data["start"],
+            params.validated_data["end"],
+        )
+        # Render bucket starts with the offset they were cut in
+        with timezone.override(get_stats_timezone()):
+            data = self.get_serializer(rows, many=True).data
+        return Response(data)
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """
+        Stream payments as CSV or NDJSON
+
+        Query parameters: ``export_format`` (``csv`` or ``ndjson``), ``start``
+        and ``end`` (inclusive dates of ``created_at``) and ``status``
+        (repeatable). Columns are those of PayFastPaymentExportSerializer.
+        Rows are read in chunks and written as they are read, so memory use
+        does not grow with the size of the export.
+        """
+        params = PaymentExportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        export_format = params.validated_data["export_format"]
+        queryset = export_queryset(
+            start=params.validated_data.get("start"),
+            end=params.validated_data.get("end"),
+            statuses=params.validated_data.get("status"),
+        )
+        response = StreamingHttpResponse(iter_export(export_format, queryset), content_type=FORMATS[export_format])
+        response["Content-Disposition"] = f'attachment; filename="payments.{export_format}"'
+        return response
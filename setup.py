@@ -36,6 +36,7 @@ setup(
         'Django>=3.2',
         'requests>=2.25.0',
         'djangorestframework',
+        'backports.zoneinfo; python_version < "3.9"',
     ],
     extras_require={
         'dev': [
@@ -54,6 +55,9 @@ setup(
             'sphinx-rtd-theme>=1.0.0',
             'sphinx-copybutton>=0.5.0',
         ],
+        'zstd': [
+            'zstandard>=0.20.0',
+        ],
     },
     classifiers=[
         "Development Status :: 5 - Production/Stable",
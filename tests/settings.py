@@ -60,6 +60,10 @@ PAYFAST_MERCHANT_ID = config('PAYFAST_MERCHANT_ID', default="pass")
 PAYFAST_MERCHANT_KEY = config('PAYFAST_MERCHANT_KEY', default="pass")
 PAYFAST_PASSPHRASE = config('PAYFAST_PASSPHRASE', default="pass")
 PAYFAST_TEST_MODE = config('PAYFAST_TEST_MODE', default=True, cast=bool)
+# The test client posts ITNs from 127.0.0.1; allowlist tests enable this explicitly
+PAYFAST_VALIDATE_IP = config('PAYFAST_VALIDATE_IP', default=False, cast=bool)
+# Send payment_completed/failed/cancelled inline when on-commit callbacks run
+PAYFAST_SIGNAL_WORKERS = 0
 
 # Internationalization
 LANGUAGE_CODE = 'en-us'
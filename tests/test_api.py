@@ -0,0 +1,703 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+import csv
+import itertools
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+
+from payfast import conf
+from payfast.api_cache import ALL, bump_versions, get_version, version_key
+from payfast.checkout import build_checkout_data
+from payfast.export import EXPORT_FIELDS
+from payfast.filters import INDEXED_FILTERS, filter_payments
+from payfast.models import PayFastPayment
+from payfast.serializers import (
+    PayFastPaymentExportSerializer, PayFastPaymentListSerializer, UserPaymentHistorySerializer,
+    compile_serializer,
+)
+from payfast.signals import payment_status_changed
+from payfast.views.normal_payment_views import PayFastPaymentModelViewSet
+
+
+def create_payments(count, user=None, prefix=''):
+    # bulk_create sends no post_save, so mark cached API responses stale here
+    bump_versions([user.pk if user else None])
+    return PayFastPayment.objects.bulk_create([
+        PayFastPayment(
+            user=user,
+            m_payment_id=f'PF_API_{prefix}{i}',
+            amount=Decimal('10.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+            name_first='John',
+            name_last='Doe',
+        )
+        for i in range(count)
+    ])
+
+
+class PaymentListQueryTestCase(TestCase):
+    """Test cases for the number of queries the payments API runs"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(f'buyer{i}', f'buyer{i}@example.com', first_name='Jane', last_name=f'Buyer{i}')
+            for i in range(3)
+        ]
+        self.url = reverse('payfast:payment-list')
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response, context.captured_queries
+
+    def test_list_query_count_is_constant(self):
+        """Test a page costs the same queries for 2 rows or a full page"""
+        create_payments(2, user=self.users[0], prefix='a')
+        _, small = self.list_queries()
+
+        for i, user in enumerate(self.users):
+            create_payments(10, user=user, prefix=f'b{i}')
+        response, full = self.list_queries()
+
+        self.assertEqual(len(response.json()['results']), 20)
+        # One keyset SELECT joined to the user table, no COUNT(*)
+        self.assertEqual(len(small), 1)
+        self.assertEqual(len(full), len(small))
+
+    @mock.patch.object(conf, 'PAYFAST_API_PAGINATION', 'page')
+    def test_page_number_query_count_is_constant(self):
+        """Test the legacy envelope costs COUNT(*) plus one SELECT per page"""
+        create_payments(2, user=self.users[0], prefix='a')
+        _, small = self.list_queries()
+
+        create_payments(30, user=self.users[1], prefix='b')
+        response, full = self.list_queries()
+
+        self.assertEqual(response.json()['total_items'], 32)
+        self.assertEqual(len(small), 2)
+        self.assertEqual(len(full), 2)
+
+    def test_list_reads_only_serialized_columns(self):
+        """Test the list SELECT does not fetch unused columns"""
+        create_payments(1, user=self.users[0])
+        response, queries = self.list_queries()
+
+        select = queries[-1]['sql']
+        self.assertIn('JOIN', select)
+        self.assertNotIn('custom_str1', select)
+        self.assertNotIn('"password"', select)
+
+        row = response.json()['results'][0]
+        self.assertEqual(row['user_email'], 'buyer0@example.com')
+        self.assertEqual(row['user_name'], 'Jane Buyer0')
+
+    def test_list_without_user_uses_payment_names(self):
+        """Test payments without a user still serialize without extra queries"""
+        create_payments(3)
+        response, queries = self.list_queries()
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.json()['results'][0]['user_name'], 'John Doe')
+
+    def test_retrieve_is_one_query(self):
+        """Test the detail endpoint reads one narrow row"""
+        payment = create_payments(1)[0]
+        url = reverse('payfast:payment-detail', kwargs={'pk': payment.pk})
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.json()['m_payment_id'], payment.m_payment_id)
+
+
+class PaymentCursorPaginationTestCase(TestCase):
+    """Test cases for keyset pagination of the payments API"""
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('payfast:payment-list')
+        self.payments = create_payments(7)
+        # Three payments share a timestamp so the id tie-breaker matters
+        now = timezone.now()
+        for i, payment in enumerate(self.payments):
+            created_at = now - timedelta(minutes=min(i, 3))
+            PayFastPayment.objects.filter(pk=payment.pk).update(created_at=created_at)
+        self.expected = list(
+            PayFastPayment.objects.order_by('-created_at', '-id').values_list('m_payment_id', flat=True)
+        )
+
+    def get(self, url, **params):
+        response = self.client.get(url, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, page):
+        return [row['m_payment_id'] for row in page['results']]
+
+    def test_walks_forwards_and_backwards(self):
+        """Test next/previous links cover every row once, in model order"""
+        first = self.get(self.url, page_size=3)
+        self.assertIsNone(first['previous'])
+        self.assertNotIn('total_items', first)
+
+        second = self.get(first['next'])
+        third = self.get(second['next'])
+        self.assertIsNone(third['next'])
+        self.assertEqual(self.ids(first) + self.ids(second) + self.ids(third), self.expected)
+
+        back = self.get(third['previous'])
+        self.assertEqual(self.ids(back), self.ids(second))
+        self.assertEqual(self.ids(self.get(back['previous'])), self.ids(first))
+
+    def test_page_size_is_capped(self):
+        """Test page_size is honoured up to max_page_size"""
+        self.assertEqual(len(self.get(self.url, page_size=2)['results']), 2)
+        self.assertEqual(self.get(self.url, page_size=1000)['page_size'], 100)
+
+    def test_invalid_cursor(self):
+        """Test a tampered cursor is a 404, not a server error"""
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch.object(conf, 'PAYFAST_API_ESTIMATED_TOTAL', True)
+    def test_estimated_total_is_cached(self):
+        """Test the optional total is counted once and then served from cache"""
+        self.assertEqual(self.get(self.url)['estimated_total'], 7)
+
+        create_payments(1, prefix='late')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.url)['estimated_total'], 7)
+
+    @mock.patch.object(conf, 'PAYFAST_API_ESTIMATED_TOTAL', True)
+    @mock.patch.object(conf, 'PAYFAST_API_CACHE_ALIAS', 'api')
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+        'api': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'api'},
+    })
+    def test_estimated_total_uses_the_api_cache(self):
+        """Test the cached count lives in PAYFAST_API_CACHE_ALIAS"""
+        self.assertEqual(self.get(self.url)['estimated_total'], 7)
+
+        cache.clear()
+        create_payments(1, prefix='late')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.url)['estimated_total'], 7)
+
+
+class PaymentBulkCreateTestCase(TestCase):
+    """Test cases for POST payments/bulk/"""
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('payfast:payment-bulk')
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com')
+
+    def item(self, **kwargs):
+        data = {
+            'user': self.user.pk,
+            'amount': '99.99',
+            'item_name': 'Invoice',
+            'email_address': 'Buyer@Example.com',
+        }
+        data.update(kwargs)
+        return data
+
+    def post(self, items):
+        return self.client.post(
+            self.url, {'payments': items}, content_type='application/json', HTTP_ACCEPT='application/json'
+        )
+
+    def test_creates_valid_items_and_reports_errors(self):
+        """Test valid rows are inserted and invalid ones reported by index"""
+        PayFastPayment.objects.create(
+            m_payment_id='INV-TAKEN', amount=Decimal('1.00'), item_name='Old', email_address='old@example.com'
+        )
+        response = self.post([
+            self.item(),
+            self.item(amount='0'),
+            self.item(m_payment_id='INV-1'),
+            self.item(m_payment_id='INV-1'),
+            self.item(m_payment_id='INV-TAKEN'),
+            self.item(user=999999),
+            'not-an-object',
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual(body['created'], 2)
+        self.assertEqual([row['index'] for row in body['results']], [0, 2])
+        self.assertEqual([error['index'] for error in body['errors']], [1, 3, 4, 5, 6])
+        self.assertIn('amount', body['errors'][0]['errors'])
+        self.assertIn('user', body['errors'][3]['errors'])
+
+        payment = PayFastPayment.objects.get(m_payment_id='INV-1')
+        self.assertEqual(payment.user, self.user)
+        self.assertEqual(payment.email_address, 'buyer@example.com')
+        row = body['results'][1]
+        self.assertEqual(row['id'], payment.pk)
+        self.assertEqual(row['payfast_url'], 'http://testserver' + payment.get_payfast_url())
+
+    def test_form_data_matches_checkout_signature(self):
+        """Test batch-signed fields equal the checkout view's and are cached"""
+        row = self.post([self.item(custom_str1='ref', custom_int1=7)]).json()['results'][0]
+        payment = PayFastPayment.objects.get(pk=row['id'])
+
+        expected = build_checkout_data(RequestFactory().get('/'), payment)
+        self.assertEqual(row['form_data'], expected)
+
+        self.client.force_login(self.user)
+        with mock.patch('payfast.checkout.build_checkout_data') as build:
+            response = self.client.get(reverse('payfast:payfast_payment_view', args=[payment.pk]))
+        self.assertEqual(response.status_code, 200)
+        build.assert_not_called()
+
+    def test_query_count_does_not_grow_with_batch(self):
+        """Test a batch of 2 and a batch of 20 cost the same queries"""
+        def queries(count, prefix):
+            items = [self.item(m_payment_id=f'{prefix}{i}') for i in range(count)]
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.post(items).status_code, 201)
+            return len(context.captured_queries)
+
+        # The first batch of the day also creates its time-series bucket
+        queries(1, 'warm')
+        # 20 rows still fit in one INSERT under SQLite's parameter limit
+        self.assertEqual(queries(2, 'small'), queries(20, 'large'))
+        self.assertEqual(PayFastPayment.objects.count(), 23)
+
+    def test_batch_size_limit(self):
+        """Test oversized batches are rejected before anything is inserted"""
+        with mock.patch.object(conf, 'PAYFAST_API_BULK_MAX_ITEMS', 2):
+            response = self.post([self.item() for _ in range(3)])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('payments', response.json())
+        self.assertFalse(PayFastPayment.objects.exists())
+
+    def test_all_invalid_is_bad_request(self):
+        """Test a batch with no valid item returns 400 with the item errors"""
+        response = self.post([self.item(email_address='')])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['index'], 0)
+
+
+class PaymentBulkStatusTestCase(TestCase):
+    """Test cases for POST payments/bulk-status/"""
+
+    def setUp(self):
+        self.url = reverse('payfast:payment-bulk-status')
+        self.payments = create_payments(5, prefix='s')
+        PayFastPayment.objects.filter(m_payment_id='PF_API_s3').update(status='complete')
+        PayFastPayment.objects.filter(m_payment_id='PF_API_s4').update(status='cancelled')
+
+        self.events = []
+        handler = lambda sender, **kwargs: self.events.append((kwargs['m_payment_id'], kwargs['to_status']))
+        payment_status_changed.connect(handler, weak=False, dispatch_uid='bulk-status-test')
+        self.addCleanup(payment_status_changed.disconnect, dispatch_uid='bulk-status-test')
+
+    def post(self, payment_ids, status='cancelled'):
+        return self.client.post(
+            self.url, {'payment_ids': payment_ids, 'status': status},
+            content_type='application/json', HTTP_ACCEPT='application/json',
+        )
+
+    def test_counts_and_events(self):
+        """Test only pending payments change and only they send events"""
+        ids = [f'PF_API_s{i}' for i in range(5)] + ['PF_API_s0', 'MISSING']
+        with mock.patch.object(conf, 'PAYFAST_API_BULK_UPDATE_CHUNK_SIZE', 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post(ids)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {'updated': 3, 'skipped': 2, 'not_found': 1, 'not_found_ids': ['MISSING']},
+        )
+        self.assertEqual(
+            dict(PayFastPayment.objects.values_list('m_payment_id', 'status')),
+            {
+                'PF_API_s0': 'cancelled', 'PF_API_s1': 'cancelled', 'PF_API_s2': 'cancelled',
+                'PF_API_s3': 'complete', 'PF_API_s4': 'cancelled',
+            },
+        )
+        self.assertEqual(
+            self.events,
+            [('PF_API_s0', 'cancelled'), ('PF_API_s1', 'cancelled'), ('PF_API_s2', 'cancelled')],
+        )
+
+        # A second run changes nothing and sends nothing
+        self.events.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post(ids).json()['updated'], 0)
+        self.assertEqual(self.events, [])
+
+    def test_one_transaction_per_chunk(self):
+        """Test each chunk is a SELECT ... + UPDATE in its own transaction"""
+        ids = [f'PF_API_s{i}' for i in range(3)]
+        with mock.patch.object(conf, 'PAYFAST_API_BULK_UPDATE_CHUNK_SIZE', 1):
+            with CaptureQueriesContext(connection) as context:
+                self.post(ids, status='failed')
+
+        # SAVEPOINT, SELECT, transition()'s locked SELECT, UPDATE, changed
+        # rows, two rollup UPDATEs, one time-series UPDATE, RELEASE per chunk
+        # inside the test transaction;
+        # the first chunk also creates the day's bucket rows (bulk_create
+        # above skipped them) and retries its UPDATE
+        self.assertEqual(len(context.captured_queries), 29)
+        self.assertEqual(PayFastPayment.objects.filter(status='failed').count(), 3)
+
+    def test_rejects_other_statuses(self):
+        """Test the serializer still only allows cancelled and failed"""
+        response = self.post(['PF_API_s0'], status='complete')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(PayFastPayment.objects.get(m_payment_id='PF_API_s0').status, 'pending')
+
+
+class PaymentExportTestCase(TestCase):
+    """Test cases for the streaming CSV/NDJSON export"""
+
+    def setUp(self):
+        self.url = reverse('payfast:payment-export')
+        user = get_user_model().objects.create_user('buyer', 'buyer@example.com')
+        create_payments(3, user=user, prefix='e')
+        PayFastPayment.objects.filter(m_payment_id='PF_API_e1').update(
+            status='complete', amount_gross=Decimal('10.00'), amount_fee=Decimal('-0.23'),
+            amount_net=Decimal('9.77'), completed_at=timezone.now(), custom_int1=7,
+        )
+        PayFastPayment.objects.filter(m_payment_id='PF_API_e2').update(
+            user=None, created_at=timezone.now() - timedelta(days=10),
+        )
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_matches_export_serializer(self):
+        """Test the values_list fast path produces the serializer's output"""
+        rows = [json.loads(line) for line in self.export(export_format='ndjson').splitlines()]
+
+        expected = PayFastPaymentExportSerializer(PayFastPayment.objects.order_by('pk'), many=True).data
+        # The serializer drops user_* for payments without a user; exports
+        # keep every column
+        expected = [{field: row.get(field) for field in EXPORT_FIELDS} for row in expected]
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+        self.assertEqual(rows[1]['status_display'], 'Complete')
+        self.assertIsNone(rows[2]['user_email'])
+
+    def test_csv_header_and_rows(self):
+        """Test CSV starts with the serializer's field names"""
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('payments.csv', response['Content-Disposition'])
+
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], EXPORT_FIELDS)
+        self.assertEqual([row[1] for row in rows[1:]], ['PF_API_e0', 'PF_API_e1', 'PF_API_e2'])
+        self.assertEqual(rows[2][EXPORT_FIELDS.index('amount_fee')], '-0.23')
+        self.assertEqual(rows[1][EXPORT_FIELDS.index('amount_fee')], '')
+
+    def test_filters(self):
+        """Test date and status filters"""
+        today = timezone.localdate().isoformat()
+        output = self.export(export_format='ndjson', start=today, status=['pending'])
+
+        self.assertEqual([json.loads(line)['m_payment_id'] for line in output.splitlines()], ['PF_API_e0'])
+        response = self.client.get(self.url, {'start': today, 'end': '2000-01-01'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_writes_file(self):
+        """Test payfast_export_payments streams to a file in chunks"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'payments.ndjson')
+            call_command(
+                'payfast_export_payments', format='ndjson', output=path, status=['complete'],
+                chunk_size=1, stderr=StringIO(),
+            )
+            with open(path) as output:
+                rows = [json.loads(line) for line in output]
+
+        self.assertEqual([row['m_payment_id'] for row in rows], ['PF_API_e1'])
+        self.assertEqual(rows[0]['custom_int1'], 7)
+
+        out = StringIO()
+        call_command('payfast_export_payments', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+
+class CompiledSerializerTestCase(TestCase):
+    """Test cases for the compiled read-only serializers"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('buyer', 'buyer@example.com', first_name='Jane')
+        create_payments(2, user=user, prefix='c')
+        create_payments(2, prefix='n')
+        PayFastPayment.objects.filter(m_payment_id='PF_API_c1').update(
+            status='complete', amount_fee=Decimal('-0.23'), completed_at=timezone.now(),
+            item_description='Annual plan', custom_int2=3,
+        )
+
+    def test_output_matches_drf(self):
+        """Test compiled output equals the DRF serializer for every row"""
+        queryset = PayFastPayment.objects.order_by('pk')
+        for serializer_class in [
+            PayFastPaymentListSerializer, UserPaymentHistorySerializer, PayFastPaymentExportSerializer,
+        ]:
+            with self.subTest(serializer=serializer_class.__name__):
+                compiled = compile_serializer(serializer_class)
+                self.assertEqual(
+                    compiled.serialize(compiled.values(queryset)),
+                    serializer_class(queryset, many=True).data,
+                )
+
+    def test_list_endpoint_matches_drf_path(self):
+        """Test the list action returns the same page in both modes"""
+        url = reverse('payfast:payment-list')
+        compiled = self.client.get(url, HTTP_ACCEPT='application/json').json()
+        with mock.patch.object(conf, 'PAYFAST_API_COMPILED_SERIALIZERS', False):
+            drf = self.client.get(url, HTTP_ACCEPT='application/json').json()
+
+        self.assertEqual(compiled, drf)
+        self.assertEqual(compiled['results'][-1]['user_name'], 'Jane')
+
+    def test_method_fields_need_a_compiled_getter(self):
+        """Test an unknown SerializerMethodField is rejected at compile time"""
+        class Serializer(serializers.ModelSerializer):
+            label = serializers.SerializerMethodField()
+
+            class Meta:
+                model = PayFastPayment
+                fields = ['id', 'label']
+
+        with self.assertRaises(ImproperlyConfigured):
+            compile_serializer(Serializer)
+
+
+class PaymentConditionalGetTestCase(TestCase):
+    """Test cases for ETags, Last-Modified and the versioned response cache"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com')
+        self.payment = create_payments(1, user=self.user, prefix='v')[0]
+        self.list_url = reverse('payfast:payment-list')
+        self.detail_url = reverse('payfast:payment-detail', kwargs={'pk': self.payment.pk})
+
+    def get(self, url, **headers):
+        return self.client.get(url, HTTP_ACCEPT='application/json', **headers)
+
+    def test_retrieve_etag_and_last_modified(self):
+        """Test an unchanged payment is a 304 and a saved one is not"""
+        response = self.get(self.detail_url)
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+
+        PayFastPayment.objects.get(pk=self.payment.pk).save()
+        response = self.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_304_and_cache_without_queries(self):
+        """Test repeated list reads are served without touching the database"""
+        response = self.get(self.list_url)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(self.list_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            cached = self.get(self.list_url)
+        self.assertEqual(cached.json(), response.json())
+        self.assertEqual(cached['ETag'], etag)
+        self.assertNotEqual(self.get(self.list_url + '?page_size=1')['ETag'], etag)
+
+    def test_writes_invalidate_list(self):
+        """Test ITNs, bulk status updates, API writes and deletes bump the version"""
+        etag = self.get(self.list_url)['ETag']
+        writes = [
+            lambda: PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_API_v0', 'payment_status': 'COMPLETE'}),
+            lambda: self.client.patch(
+                self.detail_url, {'item_name': 'Renamed'}, content_type='application/json',
+                HTTP_ACCEPT='application/json',
+            ),
+            lambda: PayFastPayment.objects.filter(pk=self.payment.pk).delete(),
+        ]
+        for write in writes:
+            write()
+            response = self.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+        self.assertEqual(response.json()['results'], [])
+
+    def test_user_counters(self):
+        """Test a write bumps its user's counter and the all-payments counter only"""
+        other = get_user_model().objects.create_user('other', 'other@example.com')
+        before = {scope: get_version(scope) for scope in [ALL, self.user.pk, other.pk]}
+
+        PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_API_v0', 'payment_status': 'FAILED'})
+
+        self.assertGreater(get_version(ALL), before[ALL])
+        self.assertGreater(get_version(self.user.pk), before[self.user.pk])
+        self.assertEqual(get_version(other.pk), before[other.pk])
+
+    def test_counter_survives_eviction(self):
+        """Test an evicted counter never returns to an earlier value"""
+        version = get_version(self.user.pk)
+        cache.delete(version_key(self.user.pk))
+
+        self.assertGreater(get_version(self.user.pk), version)
+
+
+class PaymentFilterTestCase(TestCase):
+    """Test cases for the index-backed payments API filters"""
+
+    def setUp(self):
+        self.url = reverse('payfast:payment-list')
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com')
+        create_payments(3, user=self.user, prefix='f')
+        create_payments(2, prefix='g')
+        PayFastPayment.objects.filter(m_payment_id='PF_API_f1').update(
+            status='complete', completed_at=datetime(2024, 3, 2, tzinfo=dt_timezone.utc),
+        )
+        PayFastPayment.objects.filter(m_payment_id='PF_API_g0').update(
+            email_address='other@example.com', created_at=datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+
+    def ids(self, **params):
+        response = self.client.get(self.url, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(row['m_payment_id'] for row in response.json()['results'])
+
+    def test_filters(self):
+        """Test each filter on its own and combined"""
+        self.assertEqual(self.ids(status=['complete']), ['PF_API_f1'])
+        self.assertEqual(len(self.ids(status=['pending', 'complete'])), 5)
+        self.assertEqual(self.ids(user=self.user.pk, status='pending'), ['PF_API_f0', 'PF_API_f2'])
+        self.assertEqual(self.ids(email_address='other@example.com'), ['PF_API_g0'])
+        self.assertEqual(self.ids(created_before='2024-02-01T00:00:00Z'), ['PF_API_g0'])
+        self.assertEqual(len(self.ids(created_after='2024-02-01T00:00:00Z')), 4)
+        self.assertEqual(
+            self.ids(completed_after='2024-03-01T00:00:00Z', completed_before='2024-03-03T00:00:00Z'),
+            ['PF_API_f1'],
+        )
+        self.assertEqual(self.ids(completed_before='2024-03-01T00:00:00Z'), [])
+
+    def test_m_payment_id_prefix(self):
+        """Test the prefix filter matches case-sensitively and escapes wildcards"""
+        self.assertEqual(self.ids(m_payment_id_prefix='PF_API_g'), ['PF_API_g0', 'PF_API_g1'])
+        self.assertEqual(self.ids(m_payment_id_prefix='pf_api_g'), [])
+        self.assertEqual(self.ids(m_payment_id_prefix='PF%'), [])
+
+    def test_invalid_filters(self):
+        """Test bad values are a 400"""
+        for params in [
+            {'status': 'settled'},
+            {'user': 'abc'},
+            {'created_after': '2024-03-02T00:00:00Z', 'created_before': '2024-03-01T00:00:00Z'},
+        ]:
+            response = self.client.get(self.url, params, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_user_filter_uses_user_counter(self):
+        """Test a write for another user leaves a user-filtered ETag alone"""
+        url = f'{self.url}?user={self.user.pk}'
+        etag = self.client.get(url, HTTP_ACCEPT='application/json')['ETag']
+
+        PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_API_g1', 'payment_status': 'COMPLETE'})
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_API_f0', 'payment_status': 'COMPLETE'})
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_supported_combination_scans_the_table(self):
+        """Test EXPLAIN shows an index search for every filter combination and page"""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Checks SQLite query plans')
+        moment = datetime(2024, 1, 15, tzinfo=dt_timezone.utc)
+        values = {
+            'status': ['complete'],
+            'created_after': datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            'created_before': datetime(2024, 2, 1, tzinfo=dt_timezone.utc),
+            'completed_after': datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+            'completed_before': datetime(2024, 2, 1, tzinfo=dt_timezone.utc),
+            'user': self.user.pk,
+            'email_address': 'buyer@example.com',
+            'm_payment_id_prefix': 'PF_2024',
+        }
+        self.assertEqual(set(values), set(INDEXED_FILTERS))
+
+        table = PayFastPayment._meta.db_table
+        for size in range(1, len(values) + 1):
+            for combination in itertools.combinations(values, size):
+                queryset = filter_payments(
+                    PayFastPayment.objects.select_related('user'),
+                    {name: values[name] for name in combination},
+                )
+                # The first page and a keyset page after a cursor
+                for page in [queryset, queryset.filter(Q(created_at__lt=moment) | Q(created_at=moment, id__lt=10))]:
+                    plan = page.order_by('-created_at', '-id')[:21].explain()
+                    with self.subTest(filters=combination):
+                        self.assertNotIn(f'SCAN {table}', plan)
+                        self.assertIn(f'SEARCH {table}', plan)
+
+
+class PaymentUpdateTestCase(TestCase):
+    """Test cases for status changes through PATCH payments/<pk>/"""
+
+    def setUp(self):
+        self.payment = create_payments(1, prefix='u')[0]
+        self.url = reverse('payfast:payment-detail', kwargs={'pk': self.payment.pk})
+
+    def patch(self, data):
+        return self.client.patch(self.url, data, content_type='application/json', HTTP_ACCEPT='application/json')
+
+    def test_status_follows_the_table(self):
+        """Test only status changes PayFastPayment.TRANSITIONS allows are accepted"""
+        self.assertEqual(self.patch({'status': 'failed'}).status_code, 200)
+
+        for status in ['pending', 'cancelled']:
+            with self.subTest(status=status):
+                response = self.patch({'status': status})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('status', response.json())
+        self.assertEqual(self.patch({'status': 'complete'}).status_code, 200)
+
+    def test_concurrent_change_is_a_409(self):
+        """Test an update that loses to a writer committing during the request is refused"""
+        stale = PayFastPayment.objects.get(pk=self.payment.pk)
+        PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_API_u0', 'payment_status': 'FAILED'})
+
+        with mock.patch.object(PayFastPaymentModelViewSet, 'get_object', return_value=stale):
+            response = self.patch({'status': 'cancelled', 'item_name': 'Stale edit'})
+
+        self.assertEqual(response.status_code, 409)
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.item_name), ('failed', 'Test Product'))
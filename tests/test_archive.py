@@ -0,0 +1,192 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from payfast import conf
+from payfast.archive import NotificationArchive
+from payfast.models import PayFastPayment, PayFastNotification
+
+
+def make_records(first_id, count):
+    return [
+        {'id': pk, 'raw_data': {'m_payment_id': f'PF{pk}'}, 'created_at': '2024-01-01T00:00:00+00:00'}
+        for pk in range(first_id, first_id + count)
+    ]
+
+
+class NotificationArchiveTestCase(SimpleTestCase):
+    """Test cases for archive segments and their offset index"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.archive = NotificationArchive(self.directory, block_size=4)
+
+    def test_single_record_lookup(self):
+        """Test records are fetched by id through the sidecar index"""
+        segment = self.archive.write_segment(make_records(1, 10))
+
+        self.assertEqual(self.archive.get(7)['raw_data'], {'m_payment_id': 'PF7'})
+        self.assertIsNone(self.archive.get(11))
+
+        # 10 records in blocks of 4: three independently compressed blocks
+        _, offsets, _ = segment.load_index()
+        self.assertEqual(len(set(offsets)), 3)
+
+    def test_segment_is_plain_gzip_jsonl(self):
+        """Test a segment can be read with standard tools"""
+        segment = self.archive.write_segment(make_records(1, 10))
+
+        with gzip.open(segment.path, 'rt') as handle:
+            ids = [json.loads(line)['id'] for line in handle]
+        self.assertEqual(ids, list(range(1, 11)))
+        self.assertTrue(os.path.basename(segment.path).startswith('notifications-000000000001-000000000010'))
+
+    def test_iter_records_across_segments(self):
+        """Test records stream in id order and id ranges skip whole segments"""
+        self.archive.write_segment(make_records(1, 5))
+        self.archive.write_segment(make_records(6, 5))
+
+        self.assertEqual([r['id'] for r in self.archive.iter_records()], list(range(1, 11)))
+        self.assertEqual([r['id'] for r in self.archive.iter_records(start_id=4, end_id=7)], [4, 5, 6, 7])
+
+    def test_unfinished_segment_is_ignored(self):
+        """Test a segment without its index (interrupted write) is not read"""
+        segment = self.archive.write_segment(make_records(1, 5))
+        os.remove(segment.index_path)
+
+        self.assertEqual(NotificationArchive(self.directory).segments(), [])
+
+
+class ArchiveNotificationsCommandTestCase(TestCase):
+    """Test cases for the payfast_archive_notifications command"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = mock.patch.object(conf, 'PAYFAST_ARCHIVE_DIR', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.payment = PayFastPayment.objects.create(
+            m_payment_id='PF_ARCHIVE',
+            amount=Decimal('10.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+
+    def notify(self, age_days, **kwargs):
+        kwargs.setdefault('processing_state', 'processed')
+        notification = PayFastNotification.objects.create(
+            payment=self.payment,
+            raw_data={'m_payment_id': 'PF_ARCHIVE', 'pf_payment_id': '1', 'payment_status': 'COMPLETE'},
+            ip_address='127.0.0.1',
+            **kwargs
+        )
+        PayFastNotification.objects.filter(pk=notification.pk).update(
+            created_at=timezone.now() - timedelta(days=age_days)
+        )
+        return notification
+
+    def archive(self, **options):
+        out = StringIO()
+        options.setdefault('days', 30)
+        call_command('payfast_archive_notifications', chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_moves_old_notifications_to_segments(self):
+        """Test old rows are archived and deleted, recent and queued rows stay"""
+        old = [self.notify(60) for _ in range(5)]
+        recent = self.notify(1)
+        queued = self.notify(60, processing_state='queued')
+
+        output = self.archive(segment_size=3)
+
+        self.assertIn('5 notification(s) archived', output)
+        self.assertEqual(
+            set(PayFastNotification.objects.values_list('pk', flat=True)), {recent.pk, queued.pk}
+        )
+        archive = NotificationArchive(self.directory)
+        self.assertEqual(len(archive.segments()), 2)
+        record = archive.get(old[2].pk)
+        self.assertEqual(record['payment_id'], self.payment.pk)
+        self.assertEqual(record['raw_data']['pf_payment_id'], '1')
+
+    def test_rerun_archives_nothing_new(self):
+        """Test running the command twice does not duplicate segments"""
+        self.notify(60)
+        self.archive()
+
+        self.assertIn('0 notification(s) archived', self.archive())
+        self.assertEqual(len(NotificationArchive(self.directory).segments()), 1)
+
+    def test_finishes_interrupted_run(self):
+        """Test rows of a segment written before a crash are deleted next time"""
+        notification = self.notify(60)
+        NotificationArchive(self.directory).write_segment(
+            list(PayFastNotification.objects.filter(pk=notification.pk).values('id', 'raw_data'))
+        )
+
+        output = self.archive(days=365)
+
+        self.assertIn('Deleted 1 row(s) already archived', output)
+        self.assertFalse(PayFastNotification.objects.exists())
+        self.assertEqual(NotificationArchive(self.directory).open_segments(), [])
+
+    def test_interrupted_segment_is_found_by_marker(self):
+        """Test the open segment is used, not the one with the highest ids"""
+        old = [self.notify(60) for _ in range(3)]
+        archive = NotificationArchive(self.directory)
+        # Written and closed by an earlier run: its ids are higher
+        archive.close_segment(archive.write_segment(
+            list(PayFastNotification.objects.filter(pk=old[2].pk).values('id', 'raw_data'))
+        ))
+        PayFastNotification.objects.filter(pk=old[2].pk).delete()
+        archive.write_segment(
+            list(PayFastNotification.objects.filter(pk=old[0].pk).values('id', 'raw_data'))
+        )
+
+        output = self.archive(days=365)
+
+        self.assertIn('Deleted 1 row(s) already archived', output)
+        self.assertEqual(list(PayFastNotification.objects.values_list('pk', flat=True)), [old[1].pk])
+        self.assertEqual(archive.open_segments(), [])
+
+    def test_admin_shows_archived_notification(self):
+        """Test the admin change page falls back to the archive"""
+        notification = self.notify(60)
+        self.archive()
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin_user)
+
+        url = reverse('admin:payfast_payfastnotification_change', args=[notification.pk])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'archived and read-only')
+        self.assertContains(response, 'PF_ARCHIVE')
+        self.assertNotContains(response, 'name="_save"')
+
+    def test_replay_reads_the_archive(self):
+        """Test payfast_replay_notifications --archived re-applies archived ITNs"""
+        self.notify(60, processing_state='failed')
+        self.archive()
+
+        out = StringIO()
+        call_command('payfast_replay_notifications', archived=True, processes=1, stdout=out)
+
+        self.assertIn('1 applied', out.getvalue())
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
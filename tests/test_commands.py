@@ -0,0 +1,97 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from payfast.models import PayFastPayment, PayFastNotification
+
+
+def stored_itn(m_payment_id, pf_payment_id, payment_status='COMPLETE', **kwargs):
+    """Create a logged notification as if an earlier attempt had failed"""
+    kwargs.setdefault('processing_state', 'failed')
+    return PayFastNotification.objects.create(
+        raw_data={
+            'm_payment_id': m_payment_id,
+            'pf_payment_id': pf_payment_id,
+            'payment_status': payment_status,
+            'amount_gross': '10.00',
+            'amount_fee': '-0.50',
+            'amount_net': '9.50',
+        },
+        ip_address='127.0.0.1',
+        **kwargs
+    )
+
+
+class ReplayNotificationsCommandTestCase(TestCase):
+    """Test cases for the payfast_replay_notifications command"""
+
+    def setUp(self):
+        self.payments = [
+            PayFastPayment.objects.create(
+                m_payment_id=f'PF_REPLAY_{i}',
+                amount=Decimal('10.00'),
+                item_name='Test Product',
+                email_address='test@example.com',
+            )
+            for i in range(3)
+        ]
+
+    def replay(self, **options):
+        out = StringIO()
+        call_command(
+            'payfast_replay_notifications', processes=1, chunk_size=2, stdout=out, **options
+        )
+        return out.getvalue()
+
+    def test_replays_failed_notifications_in_chunks(self):
+        """Test failed notifications are re-verified and applied"""
+        for i, payment in enumerate(self.payments):
+            stored_itn(payment.m_payment_id, str(i))
+        stored_itn('PF_MISSING', '99')
+
+        output = self.replay()
+
+        self.assertIn('Replayed 2/4 (50%)', output)
+        self.assertIn('4 replayed', output)
+        self.assertIn('3 applied, 0 unchanged, 0 duplicate, 1 rejected', output)
+        self.assertEqual(PayFastPayment.objects.filter(status='complete').count(), 3)
+        self.assertEqual(PayFastNotification.objects.filter(processing_state='processed').count(), 3)
+
+    def test_replay_is_idempotent(self):
+        """Test replaying the same notifications twice changes nothing more"""
+        stored_itn(self.payments[0].m_payment_id, '1')
+        stored_itn(self.payments[0].m_payment_id, '1')
+        self.replay()
+
+        output = self.replay(state=['processed', 'failed'])
+
+        self.assertIn('0 applied, 1 unchanged, 1 duplicate', output)
+        self.assertEqual(PayFastNotification.objects.filter(processing_state='processed').count(), 1)
+
+    def test_id_range_and_date_window(self):
+        """Test --start-id/--end-id and --since/--until select the rows to replay"""
+        first = stored_itn(self.payments[0].m_payment_id, '1')
+        second = stored_itn(self.payments[1].m_payment_id, '2')
+        third = stored_itn(self.payments[2].m_payment_id, '3')
+        PayFastNotification.objects.filter(pk=third.pk).update(created_at='2020-01-01T00:00:00Z')
+
+        self.replay(start_id=second.pk, end_id=third.pk, since='2021-01-01')
+
+        statuses = dict(PayFastPayment.objects.values_list('m_payment_id', 'status'))
+        self.assertEqual(statuses, {
+            'PF_REPLAY_0': 'pending',
+            'PF_REPLAY_1': 'complete',
+            'PF_REPLAY_2': 'pending',
+        })
+        self.assertIn('0 notification(s) to replay', self.replay(end_id=first.pk - 1))
+
+    def test_dry_run_only_counts(self):
+        """Test --dry-run reports the count without replaying"""
+        stored_itn(self.payments[0].m_payment_id, '1')
+
+        output = self.replay(dry_run=True)
+
+        self.assertIn('1 notification(s) to replay', output)
+        self.assertEqual(PayFastNotification.objects.get().processing_state, 'failed')
@@ -0,0 +1,140 @@
+import asyncio
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+
+from payfast import conf, events, status
+from payfast.models import PayFastPayment
+from payfast.status import status_cache_key, status_data
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+class PaymentEventsTestCase(TestCase):
+    """Test cases for the SSE / long-poll payment events endpoint"""
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment = PayFastPayment.objects.create(
+                m_payment_id='PF_EVENTS',
+                amount=Decimal('100.00'),
+                item_name='Test Product',
+                email_address='test@example.com',
+            )
+        self.url = reverse('payfast:payment_events', kwargs={'pk': self.payment.pk})
+        self.completed = status_data(self.payment.pk, 'PF_EVENTS', 'complete', self.payment.updated_at, 1)
+        session = self.async_client.session
+        session['pending_payment_id'] = self.payment.m_payment_id
+        session.save()
+
+        patcher = mock.patch.object(conf, 'PAYFAST_EVENTS_POLL_INTERVAL', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def publish_later(self, data, delay=0.05):
+        asyncio.get_running_loop().call_later(delay, events.get_broker().publish, data)
+
+    async def test_long_poll_wakes_on_publish(self):
+        """Test a waiting request returns as soon as the change is published"""
+        self.publish_later(self.completed)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        # The status is cached, so waiting never reads the database
+        with mock.patch.object(status, '_read_status') as read_status:
+            response = await self.async_client.get(self.url)
+
+        self.assertEqual(response.json()['status'], 'complete')
+        self.assertLess(loop.time() - started, 1)
+        read_status.assert_not_called()
+
+    async def test_long_poll_falls_back_to_polling(self):
+        """Test a change made by another process is seen on the next poll"""
+        # Another process committed an ITN: the shared cache changed, nothing was published
+        asyncio.get_running_loop().call_later(
+            0.05, cache.set, status_cache_key(self.payment.pk), self.completed
+        )
+        with mock.patch.object(conf, 'PAYFAST_EVENTS_POLL_INTERVAL', 0.1):
+            response = await self.async_client.get(self.url)
+
+        self.assertEqual(response.json()['status'], 'complete')
+
+    async def test_long_poll_timeout_returns_pending(self):
+        """Test a request gives up after ?timeout= seconds"""
+        response = await self.async_client.get(self.url, {'timeout': '0.1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual(events.get_broker()._subscriptions, {})
+
+    async def test_finished_payment_returns_at_once(self):
+        """Test a payment that already left pending is answered immediately"""
+        cache.set(status_cache_key(self.payment.pk), self.completed)
+
+        response = await self.async_client.get(self.url, {'timeout': '10'})
+
+        self.assertEqual(response.json()['status'], 'complete')
+
+    async def test_server_sent_events(self):
+        """Test the stream sends the current status, then the change, then ends"""
+        self.publish_later(self.completed)
+        response = await self.async_client.get(self.url, headers={'Accept': 'text/event-stream'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        body = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        statuses = [
+            json.loads(line[len('data: '):])['status']
+            for line in body.splitlines() if line.startswith('data: ')
+        ]
+        self.assertEqual(statuses, ['pending', 'complete'])
+
+    async def test_server_sent_events_before_django_4_2(self):
+        """Test old Django answers an SSE request with the events in one response"""
+        self.publish_later(self.completed)
+        with mock.patch('django.VERSION', (4, 1, 0, 'final', 0)):
+            response = await self.async_client.get(self.url, headers={'Accept': 'text/event-stream'})
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        statuses = [
+            json.loads(line[len('data: '):])['status']
+            for line in response.content.decode().splitlines() if line.startswith('data: ')
+        ]
+        self.assertEqual(statuses, ['pending', 'complete'])
+
+    async def test_unknown_payment(self):
+        """Test a missing payment is a 404"""
+        response = await self.async_client.get(reverse('payfast:payment_events', kwargs={'pk': 0}))
+
+        self.assertEqual(response.status_code, 404)
+
+    async def test_other_sessions_get_404(self):
+        """Test a visitor who did not check the payment out cannot wait on it"""
+        response = await AsyncClient().get(self.url, {'timeout': '0.1'})
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(events.get_broker()._subscriptions, {})
+
+    def test_commit_publishes_the_new_status(self):
+        """Test the ITN transition publishes once its transaction commits"""
+        with mock.patch.object(events, 'publish_payment_statuses') as publish:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_EVENTS', 'payment_status': 'COMPLETE'})
+            publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+
+        published = publish.call_args[0][0]
+        self.assertEqual([(data['id'], data['status']) for data in published], [(self.payment.pk, 'complete')])
+
+    def test_reads_release_the_database_connection(self):
+        """Test a status read outside a transaction closes its connection"""
+        connection = mock.Mock(in_atomic_block=False)
+        with mock.patch.object(events.connections, 'all', return_value=[connection]):
+            self.assertEqual(events._read_status(self.payment.pk)['status'], 'pending')
+
+        connection.close.assert_called_once_with()
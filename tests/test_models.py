@@ -1,5 +1,14 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from payfast.exceptions import InvalidPaymentStatusError, PaymentConflictError
 from payfast.forms import PayFastPaymentForm
+from payfast.models import PayFastPayment, PayFastPaymentStats
+from payfast.status import get_payment_status
+from payfast.signals import payment_cancelled, payment_completed, payment_failed
 from payfast import conf
 from decimal import Decimal
 
@@ -272,4 +281,282 @@ class PayFastFormEdgeCasesTestCase(TestCase):
             self.assertEqual(
                 form.fields[f'custom_int{i}'].initial,
                 i
-            )
\ No newline at end of file
+            )
+
+
+class PayFastPaymentTransitionTestCase(TestCase):
+    """Test cases for conditional payment status transitions"""
+
+    def setUp(self):
+        self.payment = PayFastPayment.objects.create(
+            m_payment_id='PF_TRANSITION',
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+        self.itn = {
+            'm_payment_id': 'PF_TRANSITION',
+            'pf_payment_id': '1089250',
+            'payment_status': 'COMPLETE',
+            'amount_gross': '100.00',
+            'amount_fee': '-2.30',
+            'amount_net': '97.70',
+        }
+
+    def test_m_payment_id_is_unique(self):
+        """Test ITN lookups by m_payment_id can only ever match one payment"""
+        with self.assertRaises(IntegrityError):
+            PayFastPayment.objects.create(
+                m_payment_id='PF_TRANSITION',
+                amount=Decimal('5.00'),
+                item_name='Duplicate',
+                email_address='test@example.com',
+            )
+
+    def test_apply_itn_is_one_update(self):
+        """Test applying an ITN is a single UPDATE that reports the win"""
+        # The locked SELECT, the payment UPDATE, the re-read of the changed
+        # payment, one rollup UPDATE per status involved and one time-series
+        # UPDATE
+        with self.assertNumQueries(6):
+            from_status = PayFastPayment.objects.apply_itn(self.itn)
+
+        self.assertEqual(from_status, 'pending')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
+        self.assertEqual(self.payment.pf_payment_id, '1089250')
+        self.assertEqual(self.payment.amount_fee, Decimal('-2.30'))
+        self.assertIsNotNone(self.payment.completed_at)
+
+    def test_apply_itn_only_wins_once(self):
+        """Test a completed payment is not changed again"""
+        PayFastPayment.objects.apply_itn(self.itn)
+
+        self.assertIsNone(PayFastPayment.objects.apply_itn(dict(self.itn, payment_status='FAILED')))
+        self.assertIsNone(PayFastPayment.objects.apply_itn(self.itn))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
+
+    def test_apply_itn_moves_up_the_chain(self):
+        """Test a COMPLETE ITN after a FAILED one completes the payment"""
+        PayFastPayment.objects.apply_itn(dict(self.itn, payment_status='FAILED'))
+
+        self.assertEqual(PayFastPayment.objects.apply_itn(self.itn), 'failed')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
+        self.assertEqual(self.payment.version, 2)
+        self.assertIsNotNone(self.payment.completed_at)
+
+    def test_transition_writes_only_given_columns(self):
+        """Test columns not passed to transition() are left alone"""
+        PayFastPayment.objects.filter(pk=self.payment.pk).update(item_name='Changed elsewhere')
+
+        self.payment.item_name = 'Stale copy'
+        updated = PayFastPayment.objects.filter(pk=self.payment.pk).transition('cancelled')
+
+        self.assertEqual(updated, 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'cancelled')
+        self.assertEqual(self.payment.item_name, 'Changed elsewhere')
+
+    def test_transition_on_a_status_filtered_queryset(self):
+        """Test rows filtered on their old status are still counted, cached and versioned"""
+        with self.captureOnCommitCallbacks(execute=True):
+            updated = PayFastPayment.objects.filter(pk=self.payment.pk, status='pending').transition('complete')
+
+        self.assertEqual(updated, 1)
+        status = get_payment_status(self.payment.pk)
+        self.assertEqual((status['status'], status['version']), ('complete', 1))
+        self.assertEqual(PayFastPaymentStats.objects.totals(), PayFastPaymentStats.objects.compute())
+
+    def test_return_page_loses_to_a_failed_itn(self):
+        """Test the return page does not complete a payment a FAILED ITN failed first"""
+        # The return page loaded the payment while it was pending
+        stale = PayFastPayment.objects.get(pk=self.payment.pk)
+        PayFastPayment.objects.apply_itn(dict(self.itn, payment_status='FAILED'))
+
+        self.assertFalse(stale.mark_complete())
+        self.assertEqual((stale.status, stale.version), ('failed', 1))
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.version), ('failed', 1))
+
+    def test_transition_to_retries_when_the_status_is_unchanged(self):
+        """Test losing to a writer that left the status alone retries the move"""
+        stale = PayFastPayment.objects.get(pk=self.payment.pk)
+        self.payment.item_name = 'Edited in the admin'
+        self.payment.save()
+
+        self.assertTrue(stale.mark_complete())
+        self.assertEqual((stale.status, stale.version, stale.item_name), ('complete', 2, 'Edited in the admin'))
+
+    def test_save_follows_the_table(self):
+        """Test save() refuses status changes STATUS_TRANSITIONS does not declare"""
+        PayFastPayment.objects.apply_itn(self.itn)
+        payment = PayFastPayment.objects.get(pk=self.payment.pk)
+
+        payment.status = 'pending'
+        with self.assertRaises(InvalidPaymentStatusError):
+            payment.save()
+        with self.assertRaises(ValidationError):
+            payment.full_clean()
+
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.version), ('complete', 1))
+
+    def test_transition_to_never_moves_down(self):
+        """Test a lost race to a lower status leaves the winner's status"""
+        stale = PayFastPayment.objects.get(pk=self.payment.pk)
+        PayFastPayment.objects.apply_itn(self.itn)
+
+        self.assertFalse(stale.transition_to('cancelled'))
+        self.assertEqual(stale.status, 'complete')
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.version), ('complete', 1))
+
+    def test_transition_follows_the_table(self):
+        """Test transition() refuses moves STATUS_TRANSITIONS does not declare"""
+        queryset = PayFastPayment.objects.filter(pk=self.payment.pk)
+        for from_status, to_status in [('complete', 'failed'), ('failed', 'pending'), ('pending', 'pending')]:
+            with self.subTest(from_status=from_status, to_status=to_status):
+                with self.assertRaises(InvalidPaymentStatusError):
+                    queryset.transition(to_status, from_status=from_status)
+
+    def test_stale_save_is_rejected(self):
+        """Test save() does not overwrite a row changed since it was loaded"""
+        stale = PayFastPayment.objects.get(pk=self.payment.pk)
+        self.payment.item_name = 'Saved first'
+        self.payment.save()
+
+        stale.item_name = 'Saved second'
+        with self.assertRaises(PaymentConflictError), transaction.atomic():
+            stale.save()
+        self.assertEqual(stale.version, 0)
+
+        stale.refresh_from_db()
+        stale.item_name = 'Saved second'
+        stale.save(update_fields=['item_name'])
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.item_name, self.payment.version), ('Saved second', 2))
+
+
+class PaymentStatusRaceTestCase(TransactionTestCase):
+    """Test cases for concurrent writers racing on one payment"""
+
+    # Each writer is (callable on a stale instance, status it asks for)
+    WRITERS = {
+        'itn_complete': (lambda p: PayFastPayment.objects.apply_itn(
+            {'m_payment_id': p.m_payment_id, 'payment_status': 'COMPLETE'}), 'complete'),
+        'itn_failed': (lambda p: PayFastPayment.objects.apply_itn(
+            {'m_payment_id': p.m_payment_id, 'payment_status': 'FAILED'}), 'failed'),
+        'return_page': (lambda p: p.mark_complete(), 'complete'),
+        'cancel_page': (lambda p: p.transition_to('cancelled'), 'cancelled'),
+        'mark_failed': (lambda p: p.mark_failed(), 'failed'),
+    }
+    ITN_WRITERS = {'itn_complete', 'itn_failed'}
+
+    def setUp(self):
+        self.events = []
+        for signal in (payment_completed, payment_failed, payment_cancelled):
+            signal.connect(self.record, sender=PayFastPayment)
+            self.addCleanup(signal.disconnect, self.record, sender=PayFastPayment)
+
+    def record(self, signal, sender, payment, from_status, **kwargs):
+        to_status = {payment_completed: 'complete', payment_failed: 'failed', payment_cancelled: 'cancelled'}[signal]
+        self.events.append((payment.m_payment_id, from_status, to_status))
+
+    def write(self, writer, payment, rng):
+        """
+        Run a writer, retrying it when SQLite refuses a statement
+
+        SQLite's shared-cache test database fails a statement that needs a
+        table another connection is writing instead of waiting for it. The
+        writer's transaction is then rolled back, so it is retried like a
+        serialization failure on a server database. The compare-and-swap
+        UPDATEs, reloads and retries of the writers still interleave freely.
+        """
+        for _ in range(500):
+            try:
+                return self.WRITERS[writer][0](payment)
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                time.sleep(rng.random() / 1000)
+        raise AssertionError(f'{writer} never got the database')
+
+    def race(self, m_payment_id, writers, rng):
+        """Run the writers at once on their own connections, each with a stale copy of the payment"""
+        PayFastPayment.objects.create(
+            m_payment_id=m_payment_id,
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+        copies = [PayFastPayment.objects.get(m_payment_id=m_payment_id) for _ in writers]
+        start = threading.Barrier(len(writers))
+        errors = []
+
+        def run(writer, payment, seed):
+            try:
+                start.wait(5)
+                self.write(writer, payment, random.Random(seed))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=run, args=(writer, payment, rng.random()))
+            for writer, payment in zip(writers, copies)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(errors, [])
+        return PayFastPayment.objects.get(m_payment_id=m_payment_id)
+
+    def test_racing_writers_converge(self):
+        """Test ITNs always win and the pages only ever move a pending payment"""
+        rank = list(PayFastPayment.TRANSITIONS).index
+        rng = random.Random(25)
+        for round_ in range(40):
+            writers = rng.sample(list(self.WRITERS), rng.randint(2, len(self.WRITERS)))
+            itn_statuses = {self.WRITERS[writer][1] for writer in writers if writer in self.ITN_WRITERS}
+            with self.subTest(writers=writers):
+                m_payment_id = f'PF_RACE_{round_}'
+                payment = self.race(m_payment_id, writers, rng)
+
+                # Every change was one step up the chain, with one signal each
+                steps = [(from_status, to_status) for pk, from_status, to_status in self.events
+                         if pk == m_payment_id]
+                self.assertEqual(payment.version, len(steps))
+                self.assertEqual(steps[0][0], 'pending')
+                self.assertEqual(steps[-1][1], payment.status)
+                for (_, to_status), (from_status, _) in zip(steps, steps[1:]):
+                    self.assertEqual(from_status, to_status)
+                for from_status, to_status in steps:
+                    self.assertIn(to_status, PayFastPayment.TRANSITIONS[from_status])
+                # The first writer may be a page; after that only ITNs move
+                # the payment, and it ends at least as high as every ITN asked
+                self.assertLessEqual({to_status for _, to_status in steps[1:]}, itn_statuses)
+                self.assertEqual(
+                    payment.status, max([steps[0][1], *itn_statuses], key=rank)
+                )
+                self.assertEqual(payment.completed_at is not None, payment.status == 'complete')
+
+    def test_failed_itn_and_return_page(self):
+        """Test a FAILED ITN and the return page racing leave failed only if the ITN went first"""
+        rng = random.Random(16)
+        outcomes = set()
+        for round_ in range(20):
+            m_payment_id = f'PF_RETURN_{round_}'
+            payment = self.race(m_payment_id, ['itn_failed', 'return_page'], rng)
+            steps = [(from_status, to_status) for pk, from_status, to_status in self.events
+                     if pk == m_payment_id]
+
+            # Whoever moved the pending payment first decides; a completed
+            # payment is never failed and a failed one is never completed
+            self.assertEqual(len(steps), 1)
+            self.assertEqual(payment.status, steps[0][1])
+            outcomes.add(payment.status)
+        self.assertLessEqual(outcomes, {'failed', 'complete'})
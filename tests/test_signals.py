@@ -0,0 +1,196 @@
+import threading
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+
+from payfast import conf, transitions
+from payfast.bulk import bulk_update_status
+from payfast.models import PayFastPayment
+from payfast.signals import payment_cancelled, payment_completed, payment_failed, payment_status_changed
+
+
+class TransitionSignalsTestCase(TestCase):
+    """Test cases for payment_completed / payment_failed / payment_cancelled"""
+
+    def setUp(self):
+        self.events = []
+        for signal in (payment_completed, payment_failed, payment_cancelled):
+            signal.connect(self.record, sender=PayFastPayment)
+            self.addCleanup(signal.disconnect, self.record, sender=PayFastPayment)
+
+        self.payment = self.create_payment('PF_SIGNAL')
+
+    def record(self, signal, sender, payment, from_status, **kwargs):
+        to_status = {payment_completed: 'complete', payment_failed: 'failed', payment_cancelled: 'cancelled'}[signal]
+        self.events.append((payment.m_payment_id, from_status, to_status))
+
+    def create_payment(self, m_payment_id, **fields):
+        return PayFastPayment.objects.create(
+            m_payment_id=m_payment_id,
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+            **fields
+        )
+
+    def test_sent_after_commit(self):
+        """Test nothing is sent until the transaction commits"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.payment.mark_complete()
+            self.assertEqual(self.events, [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.events, [('PF_SIGNAL', 'pending', 'complete')])
+
+    def test_saves_without_a_status_change_send_nothing(self):
+        """Test repeated saves and edits of other fields do not resend"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment.mark_complete()
+            self.payment.save()
+            payment = PayFastPayment.objects.get(pk=self.payment.pk)
+            payment.item_name = 'Edited in the admin'
+            payment.save()
+
+        self.assertEqual(self.events, [('PF_SIGNAL', 'pending', 'complete')])
+
+    def test_save_transitions(self):
+        """Test status changes made with save() send their signal"""
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = PayFastPayment.objects.get(pk=self.payment.pk)
+            payment.status = 'cancelled'
+            payment.save()
+            self.create_payment('PF_CREATED', status='failed')
+
+        self.assertEqual(self.events, [
+            ('PF_SIGNAL', 'pending', 'cancelled'),
+            ('PF_CREATED', None, 'failed'),
+        ])
+
+    def test_competing_itns_send_once(self):
+        """Test only the ITN that won the transition sends its signal"""
+        with self.captureOnCommitCallbacks(execute=True):
+            PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_SIGNAL', 'payment_status': 'COMPLETE'})
+            PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_SIGNAL', 'payment_status': 'FAILED'})
+
+        self.assertEqual(self.events, [('PF_SIGNAL', 'pending', 'complete')])
+
+    def test_bulk_update_sends_for_changed_payments(self):
+        """Test bulk status changes send one signal per payment that changed"""
+        self.create_payment('PF_DONE', status='complete')
+        self.create_payment('PF_OTHER')
+        self.events.clear()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_status(['PF_SIGNAL', 'PF_DONE', 'PF_OTHER'], 'cancelled', chunk_size=2)
+
+        self.assertEqual(sorted(self.events), [
+            ('PF_OTHER', 'pending', 'cancelled'),
+            ('PF_SIGNAL', 'pending', 'cancelled'),
+        ])
+
+    def test_status_changed_is_sent_after_commit_with_the_committed_snapshot(self):
+        """Test payment_status_changed comes from the same place, after commit, with the committed version"""
+        changes = []
+        def record_change(sender, payment, m_payment_id, from_status, to_status, **kwargs):
+            changes.append((m_payment_id, from_status, to_status, payment.status, payment.version))
+        payment_status_changed.connect(record_change, sender=PayFastPayment)
+        self.addCleanup(payment_status_changed.disconnect, record_change, sender=PayFastPayment)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_SIGNAL', 'payment_status': 'FAILED'})
+            PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_SIGNAL', 'payment_status': 'COMPLETE'})
+            self.assertEqual(changes, [])
+
+        for callback in callbacks:
+            callback()
+        # The first receiver sees 'failed' although the payment is complete by now
+        self.assertEqual(changes, [
+            ('PF_SIGNAL', 'pending', 'failed', 'failed', 1),
+            ('PF_SIGNAL', 'failed', 'complete', 'complete', 2),
+        ])
+        self.assertEqual(self.events, [('PF_SIGNAL', 'pending', 'failed'), ('PF_SIGNAL', 'failed', 'complete')])
+
+    def test_failing_receiver_does_not_stop_the_others(self):
+        """Test a receiver error is logged and the remaining receivers still run"""
+        def fail(**kwargs):
+            raise RuntimeError('mail server down')
+        payment_completed.connect(fail, sender=PayFastPayment)
+        self.addCleanup(payment_completed.disconnect, fail, sender=PayFastPayment)
+
+        with self.assertLogs('payfast.transitions', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.payment.mark_complete()
+
+        self.assertEqual(self.events, [('PF_SIGNAL', 'pending', 'complete')])
+
+
+class BoundedExecutorTestCase(TestCase):
+    """Test cases for the background executor of the transition signals"""
+
+    def test_full_backlog_runs_inline(self):
+        """Test jobs beyond the workers and the queue run in the caller"""
+        executor = transitions.BoundedExecutor(max_workers=1, queue_size=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        threads = []
+
+        def job():
+            threads.append(threading.current_thread())
+            release.wait(5)
+
+        executor.submit(job)
+        executor.submit(job)
+        with self.assertLogs('payfast.transitions', 'WARNING'):
+            executor.submit(lambda: threads.append(threading.current_thread()))
+        release.set()
+        executor.shutdown()
+
+        names = sorted(thread.name for thread in threads)
+        self.assertEqual(names, sorted([threading.current_thread().name, 'payfast-signals_0', 'payfast-signals_0']))
+
+    def test_job_errors_are_logged(self):
+        """Test a failing job is logged instead of raised"""
+        executor = transitions.BoundedExecutor(max_workers=1, queue_size=0)
+
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertLogs('payfast.transitions', 'ERROR'):
+            executor.submit(fail)
+            executor.shutdown()
+
+
+@mock.patch.object(conf, 'PAYFAST_SIGNAL_WORKERS', 2)
+class BackgroundTransitionSignalsTestCase(TransactionTestCase):
+    """Test cases for receivers running off the request thread"""
+
+    def setUp(self):
+        patcher = mock.patch.object(transitions, '_executor', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_receivers_run_in_a_worker_thread(self):
+        """Test the completion handler runs in the background after commit"""
+        PayFastPayment.objects.create(
+            m_payment_id='PF_BACKGROUND',
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+        done = threading.Event()
+        calls = []
+
+        def send_email(payment):
+            calls.append((payment.m_payment_id, threading.current_thread().name))
+            done.set()
+
+        with mock.patch('payfast.signals.send_confirmation_email', side_effect=send_email):
+            PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_BACKGROUND', 'payment_status': 'COMPLETE'})
+            self.assertTrue(done.wait(5))
+            transitions.get_executor().shutdown()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][0], 'PF_BACKGROUND')
+        self.assertTrue(calls[0][1].startswith('payfast-signals'))
@@ -1,9 +1,14 @@
 # test_signature.py
 import hashlib
+import urllib.parse
 from urllib.parse import urlencode
 from collections import OrderedDict
+from decimal import Decimal
 from decouple import config
 
+from payfast.signature import PAYFAST_FIELD_ORDER, SignatureEngine
+from payfast.utils import generate_signature, generate_signatures
+
 def test_signature():
     """Test PayFast signature generation"""
     # Your PayFast credentials
@@ -53,4 +58,78 @@ def test_signature():
     # Don't return anything - test functions should return None
 
 if __name__ == '__main__':
-    test_signature()
\ No newline at end of file
+    test_signature()
+
+# ============================================================================
+# Signature engine
+# ============================================================================
+
+def legacy_generate_signature(dataArray, passPhrase=''):
+    """The original string-concatenation implementation, kept as a reference"""
+    payload = ""
+    for key in dataArray:
+        payload += key + "=" + urllib.parse.quote_plus(str(dataArray[key]).replace("+", " ")) + "&"
+    payload = payload[:-1]
+    if passPhrase != '':
+        payload += f"&passphrase={passPhrase}"
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+SIGNATURE_SAMPLES = [
+    {},
+    {
+        'merchant_id': '10000100',
+        'merchant_key': '46f0cd694581a',
+        'return_url': 'https://example.com/payfast/payment/success/1',
+        'notify_url': 'https://example.com/payfast/notify/',
+        'name_first': 'John',
+        'email_address': 'test+alias@example.com',
+        'm_payment_id': 'PF18K07G4P9',
+        'amount': Decimal('100.00'),
+        'item_name': 'Test & Product "Special"',
+        'item_description': 'Product 日本語 with spaces / slashes',
+        'custom_int1': 5,
+        'custom_str1': 'a+b=c',
+    },
+    {'amount': 9.99, 'item_name': '~safe_chars-only.', 'custom_int1': None, 'flag': True},
+    {'item_name': ''.join(chr(code) for code in range(256))},
+]
+
+
+def test_engine_matches_legacy_signature():
+    """Test the engine is byte-for-byte compatible with the old implementation"""
+    for passphrase in ['', 'pass', 'jt7NOE43FZPn', None]:
+        for data in SIGNATURE_SAMPLES:
+            expected = legacy_generate_signature(data, passphrase)
+            assert generate_signature(data, passphrase) == expected
+            assert SignatureEngine(passphrase=passphrase).generate(data) == expected
+
+
+def test_engine_constant_field_cache_is_keyed_by_value():
+    """Test cached constant segments never leak between different values"""
+    engine = SignatureEngine(passphrase='pass')
+    first = {'merchant_id': '10000100', 'amount': '1.00'}
+    second = {'merchant_id': '10000101', 'amount': '1.00'}
+
+    assert engine.generate(first) == legacy_generate_signature(first, 'pass')
+    assert engine.generate(second) == legacy_generate_signature(second, 'pass')
+    assert engine.generate(first) == legacy_generate_signature(first, 'pass')
+
+
+def test_generate_signatures_bulk():
+    """Test bulk signing returns one signature per input, in order"""
+    signatures = generate_signatures(SIGNATURE_SAMPLES, 'pass')
+    assert signatures == [legacy_generate_signature(data, 'pass') for data in SIGNATURE_SAMPLES]
+    assert generate_signatures(iter(SIGNATURE_SAMPLES)) == [
+        legacy_generate_signature(data) for data in SIGNATURE_SAMPLES
+    ]
+
+
+def test_engine_field_order():
+    """Test the engine can sort fields into PayFast's documented order"""
+    engine = SignatureEngine(field_order=PAYFAST_FIELD_ORDER)
+    shuffled = {'amount': '10.00', 'extra': 'x', 'merchant_id': '1', 'item_name': 'Item'}
+    ordered = {'merchant_id': '1', 'amount': '10.00', 'item_name': 'Item', 'extra': 'x'}
+
+    assert engine.build_payload(shuffled) == 'merchant_id=1&amount=10.00&item_name=Item&extra=x'
+    assert engine.generate(shuffled) == legacy_generate_signature(ordered)
@@ -0,0 +1,323 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from payfast import conf
+from payfast.bulk import bulk_update_status
+from payfast.models import PayFastPayment, PayFastPaymentBucket, PayFastPaymentStats
+from payfast.models.stats import PayFastPaymentBucketQuerySet, PayFastPaymentStatsQuerySet
+from payfast.utils import clear_expired_pending_payments
+
+
+class PaymentStatsRollupTestCase(TestCase):
+    """Test cases for the incrementally maintained payment rollup"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com')
+        self.payments = [
+            PayFastPayment.objects.create(
+                user=self.user,
+                m_payment_id=f'PF_STATS_{i}',
+                amount=Decimal('10.00') * (i + 1),
+                item_name='Test Product',
+                email_address='test@example.com',
+            )
+            for i in range(5)
+        ]
+
+    def assertRollupMatchesTable(self):
+        self.assertEqual(PayFastPaymentStats.objects.totals(), PayFastPaymentStats.objects.compute())
+
+    def itn(self, payment, status='COMPLETE'):
+        return {
+            'm_payment_id': payment.m_payment_id,
+            'pf_payment_id': f'PF{payment.pk}',
+            'payment_status': status,
+            'amount_gross': str(payment.amount),
+            'amount_fee': '-2.30',
+            'amount_net': str(payment.amount - Decimal('2.30')),
+        }
+
+    def test_every_write_path_keeps_the_rollup_exact(self):
+        """Test create, ITN, bulk, save, expiry and delete all update the rollup"""
+        self.assertRollupMatchesTable()
+
+        PayFastPayment.objects.apply_itn(self.itn(self.payments[0]))
+        PayFastPayment.objects.apply_itn(self.itn(self.payments[1], 'FAILED'))
+        self.assertRollupMatchesTable()
+
+        # Completing a failed payment moves its fees out of the failed row
+        PayFastPayment.objects.apply_itn(self.itn(self.payments[1]))
+        self.assertRollupMatchesTable()
+
+        bulk_update_status(['PF_STATS_2'], 'cancelled')
+        self.assertRollupMatchesTable()
+
+        payment = PayFastPayment.objects.get(m_payment_id='PF_STATS_3')
+        payment.mark_complete()
+        payment.amount = Decimal('99.99')
+        payment.save()
+        self.assertRollupMatchesTable()
+
+        PayFastPayment.objects.filter(pk=self.payments[4].pk).update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        self.assertEqual(clear_expired_pending_payments(self.user), 1)
+        self.assertRollupMatchesTable()
+
+        PayFastPayment.objects.filter(m_payment_id__in=['PF_STATS_0', 'PF_STATS_4']).delete()
+        self.assertRollupMatchesTable()
+
+    def test_writes_are_spread_over_stripes(self):
+        """Test each write updates one stripe row and reads add the stripes up"""
+        for stripe, payment in enumerate(self.payments[:2]):
+            with mock.patch('payfast.models.stats.random.randrange', return_value=stripe + 1):
+                PayFastPayment.objects.apply_itn(self.itn(payment))
+
+        complete = PayFastPaymentStats.objects.filter(status='complete')
+        self.assertEqual(complete.count(), conf.PAYFAST_STATS_STRIPES)
+        self.assertEqual(
+            dict(complete.filter(payment_count__gt=0).values_list('stripe', 'total_amount')),
+            {1: Decimal('10.00'), 2: Decimal('20.00')},
+        )
+        self.assertEqual(PayFastPaymentStats.objects.totals()['complete'][:2], (2, Decimal('30.00')))
+        self.assertRollupMatchesTable()
+
+    def test_bulk_create_endpoint_updates_the_rollup(self):
+        """Test payments inserted with bulk_create are counted"""
+        response = self.client.post(
+            reverse('payfast:payment-bulk'),
+            {'payments': [
+                {'amount': '5.50', 'item_name': 'Invoice', 'email_address': 'a@example.com'}
+                for _ in range(3)
+            ]},
+            content_type='application/json',
+            HTTP_ACCEPT='application/json',
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(PayFastPaymentStats.objects.totals()['pending'][0], 8)
+        self.assertRollupMatchesTable()
+
+    def test_stats_endpoint_reads_only_the_rollup(self):
+        """Test GET payments/stats/ is one small query however many payments exist"""
+        PayFastPayment.objects.apply_itn(self.itn(self.payments[0]))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('payfast:payment-stats'), HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'total_payments': 5,
+            'completed_payments': 1,
+            'pending_payments': 4,
+            'failed_payments': 0,
+            'cancelled_payments': 0,
+            'total_amount': '150.00',
+            'total_completed_amount': '10.00',
+            'average_payment_amount': '30.00',
+            'total_fees': '-2.30',
+            'net_revenue': '7.70',
+        })
+
+
+class RebuildStatsCommandTestCase(TestCase):
+    """Test cases for the payfast_rebuild_stats command"""
+
+    def setUp(self):
+        PayFastPayment.objects.create(
+            m_payment_id='PF_REBUILD',
+            amount=Decimal('25.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+        # Simulate drift, e.g. from a raw UPDATE outside dj-payfast
+        PayFastPayment.objects.filter(m_payment_id='PF_REBUILD').update(status='complete')
+
+    def rebuild(self, **options):
+        out = StringIO()
+        call_command('payfast_rebuild_stats', stdout=out, **options)
+        return out.getvalue()
+
+    def test_compute_is_one_query(self):
+        """Test the rollup is recomputed with one conditional aggregate"""
+        with self.assertNumQueries(1):
+            computed = PayFastPaymentStats.objects.compute()
+
+        self.assertEqual(computed['complete'], (1, Decimal('25.00'), Decimal('0.00'), Decimal('0.00')))
+
+    def test_dry_run_reports_drift(self):
+        """Test --dry-run lists the drifted rows and changes nothing"""
+        output = self.rebuild(dry_run=True)
+
+        self.assertIn('2 status row(s) differ', output)
+        self.assertEqual(PayFastPaymentStats.objects.totals()['pending'][0], 1)
+
+    def test_rebuild_repairs_drift(self):
+        """Test the command rewrites the rollup from the payments table"""
+        output = self.rebuild()
+
+        self.assertIn('2 status row(s) corrected', output)
+        totals = PayFastPaymentStats.objects.totals()
+        self.assertEqual(totals['pending'][0], 0)
+        self.assertEqual(totals['complete'][0], 1)
+        self.assertIn('0 status row(s) corrected', self.rebuild())
+
+
+    def test_rebuild_computes_under_the_row_locks(self):
+        """Test the totals are computed after every counter row is locked, in the transaction that writes them"""
+        stripes = conf.PAYFAST_STATS_STRIPES
+        PayFastPaymentStats.objects.filter(status='pending').delete()
+        # Left over from a higher PAYFAST_STATS_STRIPES
+        PayFastPaymentStats.objects.create(status='complete', stripe=stripes, payment_count=5)
+        depth = len(connection.savepoint_ids)
+        calls = []
+        original_compute = PayFastPaymentStatsQuerySet.compute
+
+        def lock(queryset, *args, **kwargs):
+            calls.append(('lock', queryset.count()))
+            return QuerySet.select_for_update(queryset, *args, **kwargs)
+
+        def compute(queryset):
+            calls.append(('compute', len(connection.savepoint_ids) > depth))
+            return original_compute(queryset)
+
+        with mock.patch.object(PayFastPaymentStatsQuerySet, 'select_for_update', autospec=True, side_effect=lock):
+            with mock.patch.object(PayFastPaymentStatsQuerySet, 'compute', autospec=True, side_effect=compute):
+                computed = PayFastPaymentStats.objects.rebuild()
+
+        self.assertEqual(calls, [('lock', 4 * stripes + 1), ('compute', True)])
+        self.assertEqual(PayFastPaymentStats.objects.count(), 4 * stripes)
+        self.assertEqual(PayFastPaymentStats.objects.totals(), computed)
+
+
+class PaymentTimeSeriesTestCase(TestCase):
+    """Test cases for the day/hour payment buckets (UTC+2 local time)"""
+
+    def create(self, m_payment_id, created_at, amount='10.00'):
+        with mock.patch('django.utils.timezone.now', return_value=created_at):
+            return PayFastPayment.objects.create(
+                m_payment_id=m_payment_id,
+                amount=Decimal(amount),
+                item_name='Test Product',
+                email_address='test@example.com',
+            )
+
+    def buckets(self):
+        return {
+            (granularity, day, hour): tuple(bucket.values())
+            for granularity in ('day', 'hour')
+            for (day, hour), bucket in PayFastPaymentBucket.objects.totals(granularity).items()
+        }
+
+    def setUp(self):
+        for name, value in [('PAYFAST_STATS_HOURLY', True), ('PAYFAST_STATS_TIME_ZONE', 'Africa/Johannesburg')]:
+            patcher = mock.patch.object(conf, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        utc = dt_timezone.utc
+        # 23:30 UTC on 1 March is 01:30 on 2 March in Johannesburg
+        self.create('PF_TS_0', datetime(2024, 3, 1, 21, 30, tzinfo=utc))
+        self.create('PF_TS_1', datetime(2024, 3, 1, 23, 30, tzinfo=utc), amount='20.00')
+        self.create('PF_TS_2', datetime(2024, 3, 2, 8, 0, tzinfo=utc), amount='30.00')
+        self.create('PF_TS_3', datetime(2024, 3, 4, 12, 0, tzinfo=utc), amount='40.00')
+
+    def test_buckets_use_the_local_day_and_hour(self):
+        """Test payments are bucketed by creation time in the configured zone"""
+        buckets = self.buckets()
+
+        self.assertEqual(buckets[('day', date(2024, 3, 1), 0)][:2], (1, Decimal('10.00')))
+        self.assertEqual(buckets[('day', date(2024, 3, 2), 0)][:2], (2, Decimal('50.00')))
+        self.assertEqual(buckets[('hour', date(2024, 3, 1), 23)][0], 1)
+        self.assertEqual(buckets[('hour', date(2024, 3, 2), 1)][0], 1)
+        self.assertEqual(buckets[('hour', date(2024, 3, 2), 10)][0], 1)
+
+    def test_transitions_move_counts_within_their_buckets(self):
+        """Test ITNs, bulk updates and saves match a full rebuild"""
+        PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_TS_1', 'payment_status': 'COMPLETE'})
+        bulk_update_status(['PF_TS_0', 'PF_TS_2', 'PF_TS_3'], 'failed')
+        payment = PayFastPayment.objects.get(m_payment_id='PF_TS_3')
+        payment.status = 'complete'
+        payment.save()
+
+        incremental = self.buckets()
+        self.assertEqual(
+            incremental[('day', date(2024, 3, 2), 0)],
+            (2, Decimal('50.00'), 0, 1, Decimal('20.00'), 1, 0),
+        )
+        PayFastPaymentBucket.objects.rebuild('day')
+        PayFastPaymentBucket.objects.rebuild('hour')
+        self.assertEqual(incremental, self.buckets())
+
+    def test_rebuild_locks_buckets_it_has_to_create(self):
+        """Test a bucket missing from the table is created, then locked before it is written"""
+        expected = self.buckets()
+        PayFastPaymentBucket.objects.filter(date=date(2024, 3, 4)).delete()
+        # Left over from a higher PAYFAST_STATS_STRIPES
+        PayFastPaymentBucket.objects.create(
+            granularity='day', date=date(2024, 3, 2), stripe=conf.PAYFAST_STATS_STRIPES, payment_count=5,
+        )
+        locked = []
+
+        def lock(queryset, *args, **kwargs):
+            locked.append(set(queryset.values_list('date', flat=True)))
+            return QuerySet.select_for_update(queryset, *args, **kwargs)
+
+        with mock.patch.object(PayFastPaymentBucketQuerySet, 'select_for_update', autospec=True, side_effect=lock):
+            self.assertEqual(PayFastPaymentBucket.objects.rebuild('day'), 3)
+
+        self.assertEqual(len(locked), 2)
+        self.assertNotIn(date(2024, 3, 4), locked[0])
+        self.assertIn(date(2024, 3, 4), locked[1])
+        PayFastPaymentBucket.objects.rebuild('hour')
+        self.assertEqual(self.buckets(), expected)
+        self.assertFalse(PayFastPaymentBucket.objects.filter(stripe__gte=conf.PAYFAST_STATS_STRIPES).exists())
+
+    def test_endpoint_fills_empty_days(self):
+        """Test a range is one bucket query and empty days are zero"""
+        url = reverse('payfast:payment-timeseries')
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                url, {'start': '2024-03-01', 'end': '2024-03-05'}, HTTP_ACCEPT='application/json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()
+        self.assertEqual([row['date'] for row in rows], [f'2024-03-0{day}' for day in range(1, 6)])
+        self.assertEqual([row['payment_count'] for row in rows], [1, 2, 0, 1, 0])
+        self.assertEqual(rows[1]['total_amount'], '50.00')
+        self.assertEqual(rows[1]['start'], '2024-03-02T00:00:00+02:00')
+
+    def test_hourly_endpoint(self):
+        """Test hourly series have 24 local hours per day"""
+        response = self.client.get(
+            reverse('payfast:payment-timeseries'),
+            {'start': '2024-03-02', 'end': '2024-03-02', 'interval': 'hour'},
+            HTTP_ACCEPT='application/json',
+        )
+
+        rows = response.json()
+        self.assertEqual(len(rows), 24)
+        self.assertEqual([row['payment_count'] for row in rows if row['payment_count']], [1, 1])
+        self.assertEqual(rows[10]['start'], '2024-03-02T10:00:00+02:00')
+
+    def test_range_validation(self):
+        """Test reversed, oversized and disabled-hourly ranges are rejected"""
+        url = reverse('payfast:payment-timeseries')
+        get = lambda **params: self.client.get(url, params, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(get(start='2024-03-05', end='2024-03-01').status_code, 400)
+        self.assertEqual(get(start='2024-01-01', end='2024-03-01', interval='hour').status_code, 400)
+        with mock.patch.object(conf, 'PAYFAST_STATS_HOURLY', False):
+            self.assertEqual(get(interval='hour').status_code, 400)
+
@@ -0,0 +1,196 @@
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.apps import apps
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from payfast import conf, utils
+from payfast.allowlist import IPIntervalIndex, PayFastIPAllowlist
+from payfast.models import PayFastPayment, PayFastNotification
+from payfast.views.normal_payment_views import get_client_ip
+
+
+class IPIntervalIndexTestCase(SimpleTestCase):
+    """Test cases for the CIDR interval index"""
+
+    def test_cidr_membership(self):
+        """Test addresses inside and outside a range"""
+        index = IPIntervalIndex(['197.97.145.144/28'])
+
+        self.assertIn('197.97.145.144', index)
+        self.assertIn('197.97.145.159', index)
+        self.assertNotIn('197.97.145.143', index)
+        self.assertNotIn('197.97.145.160', index)
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        """Test ranges are merged into the fewest intervals"""
+        index = IPIntervalIndex([
+            '10.0.0.0/25', '10.0.0.128/25', '10.0.0.5', '192.168.1.1', '2001:db8::/32',
+        ])
+
+        self.assertEqual(len(index), 3)
+        self.assertIn('10.0.0.255', index)
+        self.assertIn('2001:db8::1', index)
+        self.assertNotIn('10.0.1.0', index)
+
+    def test_ipv4_mapped_ipv6_address(self):
+        """Test IPv4-mapped IPv6 addresses are matched as IPv4"""
+        index = IPIntervalIndex(['41.74.179.192/27'])
+        self.assertIn('::ffff:41.74.179.200', index)
+
+    def test_invalid_addresses_are_rejected(self):
+        """Test malformed or missing addresses are never allowed"""
+        index = IPIntervalIndex(['0.0.0.0/0'])
+
+        self.assertNotIn('not-an-ip', index)
+        self.assertNotIn(None, index)
+        self.assertNotIn('', index)
+
+
+class PayFastIPAllowlistTestCase(SimpleTestCase):
+    """Test cases for the resolving allowlist"""
+
+    def test_ranges_are_allowed_before_dns_resolves(self):
+        """Test the configured ranges work without any DNS lookup"""
+        resolver = mock.Mock(return_value=[])
+        allowlist = PayFastIPAllowlist(hosts=['pf.test'], ip_ranges=['102.216.36.0/28'], resolver=resolver)
+
+        self.assertIn('102.216.36.1', allowlist._index)
+        resolver.assert_not_called()
+
+    def test_refresh_uses_pluggable_resolver(self):
+        """Test resolved host addresses are added to the index"""
+        allowlist = PayFastIPAllowlist(
+            hosts=['w1w.pf.test', 'w2w.pf.test'],
+            ip_ranges=[],
+            resolver={'w1w.pf.test': ['203.0.113.10'], 'w2w.pf.test': ['203.0.113.20']}.get,
+        )
+        allowlist.refresh()
+
+        self.assertIn('203.0.113.10', allowlist._index)
+        self.assertIn('203.0.113.20', allowlist._index)
+        self.assertNotIn('203.0.113.11', allowlist._index)
+
+    def test_failed_resolution_keeps_previous_addresses(self):
+        """Test a DNS failure does not shrink the allowlist"""
+        answers = [['203.0.113.10'], OSError('DNS down')]
+
+        def resolver(host):
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        allowlist = PayFastIPAllowlist(hosts=['pf.test'], ip_ranges=[], resolver=resolver)
+        allowlist.refresh()
+        with self.assertLogs('payfast.allowlist', 'WARNING'):
+            allowlist.refresh()
+
+        self.assertIn('203.0.113.10', allowlist._index)
+
+    def test_first_check_does_not_wait_for_dns(self):
+        """Test the first lookup is answered from the ranges while the hosts resolve in the background"""
+        release = threading.Event()
+        resolver = mock.Mock(side_effect=lambda host: release.wait(5) and ['203.0.113.10'])
+        allowlist = PayFastIPAllowlist(hosts=['pf.test'], ip_ranges=['102.216.36.0/28'], resolver=resolver, ttl=60)
+        try:
+            self.assertTrue(allowlist.is_allowed('102.216.36.1'))
+            self.assertFalse(allowlist.is_allowed('203.0.113.10'))
+
+            release.set()
+            for _ in range(500):
+                if allowlist.is_allowed('203.0.113.10'):
+                    break
+                time.sleep(0.01)
+            self.assertTrue(allowlist.is_allowed('203.0.113.10'))
+            resolver.assert_called_once_with('pf.test')
+        finally:
+            allowlist.stop()
+
+    def test_started_when_the_app_loads(self):
+        """Test the allowlist starts resolving from AppConfig.ready() when IP validation is on"""
+        allowlist = mock.Mock()
+        with mock.patch.object(utils, 'get_ip_allowlist', return_value=allowlist):
+            with mock.patch.object(conf, 'PAYFAST_VALIDATE_IP', False):
+                apps.get_app_config('payfast').ready()
+            allowlist.start.assert_not_called()
+
+            with mock.patch.object(conf, 'PAYFAST_VALIDATE_IP', True):
+                apps.get_app_config('payfast').ready()
+            allowlist.start.assert_called_once_with()
+
+
+class ValidateIPTestCase(TestCase):
+    """Test cases for validate_ip and the notify view"""
+
+    def setUp(self):
+        allowlist = PayFastIPAllowlist(hosts=[], ip_ranges=['197.97.145.144/28'])
+        allowlist.start = lambda: None
+        patcher = mock.patch.object(utils, '_ip_allowlist', allowlist)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_validation_disabled(self):
+        """Test every address passes when PAYFAST_VALIDATE_IP is off"""
+        with mock.patch.object(conf, 'PAYFAST_VALIDATE_IP', False):
+            self.assertTrue(utils.validate_ip('127.0.0.1'))
+
+    @mock.patch.object(conf, 'PAYFAST_VALIDATE_IP', True)
+    def test_validation_enabled(self):
+        """Test only allowlisted addresses pass"""
+        self.assertTrue(utils.validate_ip('197.97.145.150'))
+        self.assertFalse(utils.validate_ip('127.0.0.1'))
+
+    def test_forwarded_for_is_ignored_without_trusted_proxies(self):
+        """Test a client cannot pick its address with X-Forwarded-For"""
+        request = RequestFactory().post('/', REMOTE_ADDR='203.0.113.1', HTTP_X_FORWARDED_FOR='197.97.145.150')
+
+        self.assertEqual(get_client_ip(request), '203.0.113.1')
+
+    @mock.patch.object(conf, 'PAYFAST_TRUSTED_PROXY_COUNT', 2)
+    def test_forwarded_for_behind_trusted_proxies(self):
+        """Test the address added by the outermost trusted proxy is used"""
+        factory = RequestFactory()
+        request = factory.post('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='197.97.145.150, 203.0.113.1, 10.0.0.1')
+        self.assertEqual(get_client_ip(request), '203.0.113.1')
+
+        # Fewer entries than proxies: the header was not set by them
+        request = factory.post('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='197.97.145.150')
+        self.assertEqual(get_client_ip(request), '10.0.0.2')
+
+    @mock.patch.object(conf, 'PAYFAST_VALIDATE_IP', True)
+    def test_notify_view_rejects_unknown_ip(self):
+        """Test an ITN from outside PayFast is logged and rejected"""
+        payment = PayFastPayment.objects.create(
+            amount=Decimal('10.00'), item_name='Test', email_address='test@example.com',
+        )
+        data = {'m_payment_id': payment.m_payment_id, 'payment_status': 'COMPLETE'}
+
+        response = self.client.post(
+            reverse('payfast:notify'), data, REMOTE_ADDR='203.0.113.1', HTTP_X_FORWARDED_FOR='197.97.145.150',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(PayFastNotification.objects.get().validation_errors, 'Invalid IP address')
+
+        response = self.client.post(reverse('payfast:notify'), data, REMOTE_ADDR='197.97.145.150')
+        self.assertEqual(response.status_code, 200)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'complete')
+
+    @mock.patch.object(conf, 'PAYFAST_VALIDATE_IP', True)
+    def test_rejection_behind_an_untrusted_proxy_is_logged(self):
+        """Test a rejected ITN carrying X-Forwarded-For points at PAYFAST_TRUSTED_PROXY_COUNT"""
+        payment = PayFastPayment.objects.create(
+            amount=Decimal('10.00'), item_name='Test', email_address='test@example.com',
+        )
+        data = {'m_payment_id': payment.m_payment_id, 'payment_status': 'COMPLETE'}
+
+        with self.assertLogs('payfast.views.normal_payment_views', 'WARNING') as logs:
+            response = self.client.post(
+                reverse('payfast:notify'), data, REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='197.97.145.150',
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('PAYFAST_TRUSTED_PROXY_COUNT', logs.output[0])
@@ -0,0 +1,230 @@
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qsl
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from payfast import conf, validation
+from payfast.checks import check_validation_failure_mode
+from payfast.exceptions import PayFastValidationUnavailable
+from payfast.models import PayFastPayment, PayFastNotification
+from payfast.validation import CircuitBreaker, PayFastValidationClient
+
+
+class StubPayFastServer:
+    """Local stand-in for PAYFAST_VALIDATE_URL that replays scripted responses"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                stub.requests.append(body)
+                status, text, delay = stub.responses.pop(0) if stub.responses else (200, 'VALID', 0)
+                time.sleep(delay)
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(text)))
+                self.end_headers()
+                self.wfile.write(text.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/eng/query/validate'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault('connect_timeout', 1)
+    kwargs.setdefault('read_timeout', 1)
+    kwargs.setdefault('max_retries', 2)
+    kwargs.setdefault('backoff', 0)
+    return PayFastValidationClient(validate_url=server.url, **kwargs)
+
+
+ITN = {'m_payment_id': 'PF1', 'pf_payment_id': '123', 'item_name': 'A & B', 'signature': 'abc'}
+
+
+class PayFastValidationClientTestCase(SimpleTestCase):
+    """Test cases for the pooled validation client"""
+
+    def test_valid_and_invalid_answers(self):
+        """Test VALID and INVALID responses"""
+        with StubPayFastServer([(200, 'VALID', 0), (200, 'INVALID', 0)]) as server:
+            client = make_client(server)
+            self.assertTrue(client.validate(ITN))
+            self.assertFalse(client.validate(ITN))
+
+        # The signature is not posted back
+        self.assertEqual(
+            dict(parse_qsl(server.requests[0])),
+            {'m_payment_id': 'PF1', 'pf_payment_id': '123', 'item_name': 'A & B'},
+        )
+
+    def test_retries_server_errors(self):
+        """Test 5xx responses are retried"""
+        with StubPayFastServer([(503, 'busy', 0), (200, 'VALID', 0)]) as server:
+            self.assertTrue(make_client(server).validate(ITN))
+        self.assertEqual(len(server.requests), 2)
+
+    def test_read_timeout_makes_validation_unavailable(self):
+        """Test slow answers time out instead of blocking the caller"""
+        with StubPayFastServer([(200, 'VALID', 0.5)] * 2) as server:
+            client = make_client(server, read_timeout=0.1, max_retries=1)
+            with self.assertRaises(PayFastValidationUnavailable):
+                client.validate(ITN)
+
+    def test_breaker_opens_and_fails_fast(self):
+        """Test repeated failures open the circuit and skip PayFast entirely"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        with StubPayFastServer([(500, 'error', 0)] * 10) as server:
+            client = make_client(server, max_retries=0, breaker=breaker)
+            for _ in range(2):
+                with self.assertRaises(PayFastValidationUnavailable):
+                    client.validate(ITN)
+
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            with self.assertRaisesMessage(PayFastValidationUnavailable, 'circuit is open'):
+                client.validate(ITN)
+        self.assertEqual(len(server.requests), 2)
+
+    def test_breaker_half_open_allows_one_trial(self):
+        """Test only one trial call is let through after the reset timeout"""
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+
+        now[0] = 31
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+
+        # A failed trial re-opens the breaker for another reset timeout
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_breaker_successful_trial_closes_circuit(self):
+        """Test a successful call after the reset timeout closes the breaker"""
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 31
+
+        with StubPayFastServer([(200, 'VALID', 0)]) as server:
+            self.assertTrue(make_client(server, breaker=breaker).validate(ITN))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+    def test_unexpected_error_in_a_trial_reopens_the_breaker(self):
+        """Test an error other than a request failure still ends the half-open trial"""
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 31
+
+        with StubPayFastServer([]) as server:
+            client = make_client(server, breaker=breaker)
+            with mock.patch.object(client.session, 'post', side_effect=RuntimeError('boom')):
+                with self.assertRaises(RuntimeError):
+                    client.validate(ITN)
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+            # The next trial is let through once the reset timeout has passed again
+            now[0] = 62
+            self.assertTrue(client.validate(ITN))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+@mock.patch.object(conf, 'PAYFAST_VALIDATE_WITH_SERVER', True)
+class NotifyServerValidationTestCase(TestCase):
+    """Test cases for server validation in the notify view"""
+
+    def setUp(self):
+        self.payment = PayFastPayment.objects.create(
+            m_payment_id='PF_VALIDATE',
+            amount=Decimal('10.00'),
+            item_name='Test',
+            email_address='test@example.com',
+        )
+        self.data = {'m_payment_id': 'PF_VALIDATE', 'pf_payment_id': '1', 'payment_status': 'COMPLETE'}
+
+    def post_with(self, server, breaker=None):
+        client = make_client(server, max_retries=0, breaker=breaker)
+        with mock.patch.object(validation, '_client', client):
+            return self.client.post(reverse('payfast:notify'), self.data)
+
+    def test_invalid_notification_is_rejected(self):
+        """Test PayFast answering INVALID rejects the ITN"""
+        with StubPayFastServer([(200, 'INVALID', 0)]) as server:
+            response = self.post_with(server)
+
+        self.assertEqual(response.status_code, 400)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')
+        self.assertEqual(PayFastNotification.objects.get().validation_errors, 'Server validation failed')
+
+    def test_valid_notification_is_applied(self):
+        """Test PayFast answering VALID applies the ITN"""
+        with StubPayFastServer([(200, 'VALID', 0)]) as server:
+            response = self.post_with(server)
+
+        self.assertEqual(response.status_code, 200)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
+
+    @mock.patch.object(conf, 'PAYFAST_VALIDATION_FAILURE_MODE', 'defer')
+    def test_open_circuit_defers_to_worker(self):
+        """Test an unreachable PayFast queues the ITN and still answers OK"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        with StubPayFastServer([]) as server:
+            response = self.post_with(server, breaker=breaker)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.requests, [])
+        self.assertEqual(PayFastNotification.objects.get().processing_state, 'queued')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')
+
+    def test_open_circuit_rejects_by_default(self):
+        """Test reject mode answers 503 so PayFast retries"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        with StubPayFastServer([]) as server:
+            response = self.post_with(server, breaker=breaker)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(PayFastNotification.objects.get().processing_state, 'failed')
+
+
+class ValidationFailureModeCheckTestCase(SimpleTestCase):
+    """Test cases for the PAYFAST_VALIDATION_FAILURE_MODE system check"""
+
+    def check(self, mode, queue_mode):
+        with mock.patch.object(conf, 'PAYFAST_VALIDATION_FAILURE_MODE', mode), \
+                mock.patch.object(conf, 'PAYFAST_ITN_QUEUE_MODE', queue_mode):
+            return [error.id for error in check_validation_failure_mode(None)]
+
+    def test_defer_needs_queue_mode(self):
+        """Test deferring without the worker's queue is refused"""
+        self.assertEqual(self.check('defer', False), ['payfast.E002'])
+        self.assertEqual(self.check('defer', True), [])
+        self.assertEqual(self.check('reject', False), [])
+        self.assertEqual(self.check('retry', True), ['payfast.E001'])
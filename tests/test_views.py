@@ -0,0 +1,658 @@
+import importlib
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import clear_url_caches, resolve, reverse
+
+from payfast import checkout, conf, status, views
+from payfast import urls as payfast_urls
+from payfast.checks import check_async_views
+from payfast.itn import queue_depth, recent_notifications
+from payfast.models import PayFastPayment, PayFastNotification
+
+
+def itn_data(payment, payment_status='COMPLETE', **extra):
+    """Build a minimal ITN payload for a payment"""
+    data = {
+        'm_payment_id': payment.m_payment_id,
+        'pf_payment_id': '1089250',
+        'payment_status': payment_status,
+        'item_name': payment.item_name,
+        'amount_gross': '100.00',
+        'amount_fee': '-2.30',
+        'amount_net': '97.70',
+    }
+    data.update(extra)
+    return data
+
+
+class PayFastNotifyViewTestCase(TestCase):
+    """Test cases for the inline ITN handler"""
+
+    def setUp(self):
+        self.url = reverse('payfast:notify')
+        self.payment = PayFastPayment.objects.create(
+            m_payment_id='PF_NOTIFY',
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+
+    def test_complete_notification_marks_payment_complete(self):
+        """Test a COMPLETE ITN completes the payment"""
+        response = self.client.post(self.url, itn_data(self.payment))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'OK')
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
+        self.assertEqual(self.payment.pf_payment_id, '1089250')
+        self.assertEqual(self.payment.amount_net, Decimal('97.70'))
+        self.assertIsNotNone(self.payment.completed_at)
+
+        notification = PayFastNotification.objects.get()
+        self.assertTrue(notification.is_valid)
+        self.assertEqual(notification.payment, self.payment)
+        self.assertEqual(notification.processing_state, 'processed')
+
+    def test_failed_notification_marks_payment_failed(self):
+        """Test a non-COMPLETE ITN fails the payment"""
+        response = self.client.post(self.url, itn_data(self.payment, 'FAILED'))
+
+        self.assertEqual(response.status_code, 200)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'failed')
+
+    def test_unknown_payment_is_rejected(self):
+        """Test an ITN for an unknown payment is logged and rejected"""
+        data = itn_data(self.payment, m_payment_id='PF_UNKNOWN')
+        response = self.client.post(self.url, data)
+
+        self.assertEqual(response.status_code, 400)
+        notification = PayFastNotification.objects.get()
+        self.assertFalse(notification.is_valid)
+        self.assertEqual(notification.validation_errors, 'Payment not found')
+        self.assertEqual(notification.processing_state, 'failed')
+
+    @mock.patch('payfast.signals.send_confirmation_email')
+    def test_accepted_notification_query_count(self, send_email):
+        """Test an ITN is applied with one payment UPDATE and one INSERT"""
+        # SAVEPOINT, locked SELECT of the payment, conditional UPDATE, re-read
+        # of the changed payment, two rollup UPDATEs (new and old status), one
+        # time-series UPDATE, INSERT with FK subquery, RELEASE; the payment has
+        # no user, so there is no API change counter to bump
+        with self.assertNumQueries(9):
+            self.client.post(self.url, itn_data(self.payment, 'FAILED'))
+
+        send_email.assert_not_called()
+        self.assertEqual(PayFastNotification.objects.get().payment, self.payment)
+
+    @mock.patch('payfast.signals.send_confirmation_email')
+    def test_complete_notification_query_count(self, send_email):
+        """Test completion handlers run after the commit, not in the ITN request"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertNumQueries(9):
+                self.client.post(self.url, itn_data(self.payment))
+        send_email.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        send_email.assert_called_once()
+        self.assertEqual(send_email.call_args[0][0].pk, self.payment.pk)
+
+    @mock.patch('payfast.signals.send_confirmation_email')
+    def test_lost_transition_does_not_fire_handlers(self, send_email):
+        """Test an ITN that would move a payment down the chain is logged but not applied"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, itn_data(self.payment, 'COMPLETE'))
+        send_email.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, itn_data(self.payment, 'FAILED'))
+
+        self.assertEqual(response.status_code, 200)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
+        self.assertEqual(PayFastNotification.objects.filter(is_valid=True).count(), 2)
+        send_email.assert_not_called()
+
+    def test_get_not_allowed(self):
+        """Test the ITN endpoint only accepts POST"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 405)
+
+
+@mock.patch('payfast.signals.send_confirmation_email')
+class PayFastNotifyIdempotencyTestCase(TestCase):
+    """Test cases for ITN retry deduplication"""
+
+    def setUp(self):
+        self.url = reverse('payfast:notify')
+        self.payment = PayFastPayment.objects.create(
+            m_payment_id='PF_RETRY',
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+
+    def test_retry_is_acknowledged_from_memory(self, send_email):
+        """Test a retry is answered OK without logging or re-applying it"""
+        data = itn_data(self.payment)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PayFastNotification.objects.count(), 1)
+        send_email.assert_called_once()
+
+    def test_retry_is_caught_by_unique_constraint(self, send_email):
+        """Test another process's retry is stopped by the database"""
+        data = itn_data(self.payment)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data)
+            recent_notifications.clear()
+
+            response = self.client.post(self.url, data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PayFastNotification.objects.count(), 1)
+        send_email.assert_called_once()
+
+    def test_different_status_is_not_a_duplicate(self, send_email):
+        """Test a new payment_status for the same payment is processed"""
+        self.client.post(self.url, itn_data(self.payment, 'FAILED'))
+        self.client.post(self.url, itn_data(self.payment, 'COMPLETE'))
+
+        notification = PayFastNotification.objects.order_by('pk').last()
+        self.assertEqual(PayFastNotification.objects.count(), 2)
+        self.assertEqual(notification.payment_status, 'COMPLETE')
+        self.assertEqual(len(notification.payload_hash), 64)
+
+    def test_rejected_notification_does_not_block_retry(self, send_email):
+        """Test a retry of a rejected ITN is processed once the cause is fixed"""
+        data = itn_data(self.payment, m_payment_id='PF_LATE')
+        self.assertEqual(self.client.post(self.url, data).status_code, 400)
+
+        PayFastPayment.objects.create(
+            m_payment_id='PF_LATE',
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+        self.assertEqual(self.client.post(self.url, data).status_code, 200)
+        self.assertEqual(PayFastPayment.objects.get(m_payment_id='PF_LATE').status, 'complete')
+
+
+class CheckoutFormCacheTestCase(TestCase):
+    """Test cases for the cached, pre-signed checkout form"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'secret')
+        self.client.force_login(self.user)
+        self.payment = PayFastPayment.objects.create(
+            user=self.user,
+            m_payment_id='PF_CHECKOUT',
+            amount=Decimal('10.00'),
+            item_name='Test <Product>',
+            email_address='buyer@example.com',
+        )
+        self.url = reverse('payfast:payfast_payment_view', kwargs={'pk': self.payment.pk})
+
+    def test_form_is_signed_once_per_payment_version(self):
+        """Test reloads reuse the cached form until the payment changes"""
+        with mock.patch.object(checkout, 'generate_signature', wraps=checkout.generate_signature) as sign:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+            self.assertEqual(sign.call_count, 1)
+            self.assertEqual(first.context['htmlForm'], second.context['htmlForm'])
+
+            self.payment.item_name = 'Renamed'
+            self.payment.save()
+            third = self.client.get(self.url)
+
+        self.assertEqual(sign.call_count, 2)
+        self.assertIn('value="Renamed"', third.context['htmlForm'])
+
+    def test_form_fields_are_escaped_and_signed(self):
+        """Test the rendered form escapes values and carries the signature"""
+        response = self.client.get(self.url)
+        data = response.context['form_data']
+
+        self.assertEqual(data['amount'], '10.00')
+        self.assertEqual(data['return_url'], f'http://testserver/payfast/payment/success/{self.payment.pk}')
+        self.assertIn('value="Test &lt;Product&gt;"', response.context['htmlForm'])
+        self.assertIn(f'name="signature" type="hidden" value="{data["signature"]}"', response.context['htmlForm'])
+
+    def test_checkout_view_shares_the_builder(self):
+        """Test the session checkout reuses the existing payment's cached form"""
+        session = self.client.session
+        session['pending_payment_id'] = self.payment.m_payment_id
+        session.save()
+
+        from_view = self.client.get(self.url).context['htmlForm']
+        with mock.patch.object(checkout, 'generate_signature') as sign:
+            response = self.client.get(reverse('payfast:checkout'))
+
+        sign.assert_not_called()
+        self.assertEqual(response.context['htmlForm'], from_view)
+
+    def test_host_is_part_of_the_key(self):
+        """Test forms with different absolute callback URLs are cached apart"""
+        self.client.get(self.url)
+        with self.settings(ALLOWED_HOSTS=['shop.example.com']):
+            response = self.client.get(self.url, HTTP_HOST='shop.example.com')
+
+        self.assertTrue(response.context['form_data']['notify_url'].startswith('http://shop.example.com/'))
+
+
+@mock.patch.object(conf, 'PAYFAST_ITN_QUEUE_MODE', True)
+class PayFastNotifyQueueModeTestCase(TestCase):
+    """Test cases for queue-backed ITN ingestion"""
+
+    def setUp(self):
+        self.url = reverse('payfast:notify')
+        self.payment = PayFastPayment.objects.create(
+            m_payment_id='PF_QUEUED',
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+
+    def test_notification_is_queued_without_touching_payment(self):
+        """Test queue mode stores the payload and answers immediately"""
+        response = self.client.post(self.url, itn_data(self.payment))
+
+        self.assertEqual(response.status_code, 200)
+        notification = PayFastNotification.objects.get()
+        self.assertEqual(notification.processing_state, 'queued')
+        self.assertIsNone(notification.payment)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')
+        self.assertEqual(queue_depth()['queued'], 1)
+
+    def test_worker_applies_queued_notifications(self):
+        """Test the worker command drains the queue"""
+        self.client.post(self.url, itn_data(self.payment))
+        self.client.post(self.url, itn_data(self.payment, m_payment_id='PF_UNKNOWN'))
+
+        out = StringIO()
+        call_command('payfast_process_notifications', once=True, concurrency=1, stdout=out)
+
+        self.assertIn('1 applied, 1 rejected', out.getvalue())
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
+        self.assertEqual(queue_depth()['queued'], 0)
+        self.assertEqual(
+            set(PayFastNotification.objects.values_list('processing_state', flat=True)),
+            {'processed', 'failed'},
+        )
+
+    def test_duplicate_is_queued_once(self):
+        """Test retries of a queued ITN are not queued again"""
+        data = itn_data(self.payment)
+        self.client.post(self.url, data)
+        recent_notifications.clear()
+
+        response = self.client.post(self.url, data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queue_depth()['queued'], 1)
+
+    def test_worker_status_reports_queue_depth(self):
+        """Test --status prints the queue depth"""
+        self.client.post(self.url, itn_data(self.payment))
+
+        out = StringIO()
+        call_command('payfast_process_notifications', status=True, stdout=out)
+
+        self.assertIn('queued: 1', out.getvalue())
+        self.assertEqual(PayFastNotification.objects.get().processing_state, 'queued')
+
+    def test_requeue_stale_notifications(self):
+        """Test --requeue recovers rows claimed by a crashed worker"""
+        self.client.post(self.url, itn_data(self.payment))
+        PayFastNotification.objects.update(processing_state='processing')
+
+        call_command(
+            'payfast_process_notifications', once=True, requeue=True,
+            concurrency=1, stdout=StringIO(),
+        )
+
+        self.assertEqual(PayFastNotification.objects.get().processing_state, 'processed')
+
+
+# Cached sessions, so a poll that hits the status cache runs no query at all
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+class PaymentStatusCacheTestCase(TestCase):
+    """Test cases for the cached payment status lookup"""
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment = PayFastPayment.objects.create(
+                m_payment_id='PF_STATUS',
+                amount=Decimal('100.00'),
+                item_name='Test Product',
+                email_address='test@example.com',
+            )
+        self.url = reverse('payfast:payment_status', kwargs={'pk': self.payment.pk})
+        # The browser that checked the payment out
+        session = self.client.session
+        session['pending_payment_id'] = self.payment.m_payment_id
+        session.save()
+
+    def poll(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['status']
+
+    def notify(self, payment_status='COMPLETE'):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('payfast:notify'), itn_data(self.payment, payment_status))
+
+    def test_create_and_itn_update_the_cache(self):
+        """Test polls are served from the cache before and after the ITN"""
+        with self.assertNumQueries(0):
+            self.assertEqual(self.poll(), 'pending')
+
+        self.notify()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.poll(), 'complete')
+
+    def test_miss_reads_the_database_once(self):
+        """Test a cold entry is loaded once and then served from the cache"""
+        cache.delete(status.status_cache_key(self.payment.pk))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.poll(), 'pending')
+            self.assertEqual(self.poll(), 'pending')
+        self.assertEqual(self.client.get(reverse('payfast:payment_status', kwargs={'pk': 0})).status_code, 404)
+
+    def test_reader_racing_an_itn_does_not_cache_the_old_status(self):
+        """Test a poll that read 'pending' before the ITN committed loses to the ITN"""
+        cache.delete(status.status_cache_key(self.payment.pk))
+        read_status = status._read_status
+
+        def read_then_itn_commits(pk):
+            # The poll has read the old row; the ITN commits before it caches
+            data = read_status(pk)
+            self.notify()
+            return data
+
+        with mock.patch.object(status, '_read_status', side_effect=read_then_itn_commits):
+            self.assertEqual(status.get_payment_status(self.payment.pk)['status'], 'pending')
+
+        self.assertEqual(self.poll(), 'complete')
+
+    def test_itn_committing_after_a_stale_fill_replaces_it(self):
+        """Test an entry filled before the ITN committed is overwritten on commit"""
+        cache.delete(status.status_cache_key(self.payment.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_STATUS', 'payment_status': 'FAILED'})
+            # Another process fills the cache from the last committed row
+            cache.add(
+                status.status_cache_key(self.payment.pk),
+                status.status_data(self.payment.pk, 'PF_STATUS', 'pending', self.payment.updated_at),
+            )
+            self.assertEqual(self.poll(), 'pending')
+
+        self.assertEqual(self.poll(), 'failed')
+
+    def test_concurrent_itns_cache_the_winner(self):
+        """Test only the ITN that won the transition writes the cache"""
+        self.notify('COMPLETE')
+        self.notify('FAILED')
+
+        self.assertEqual(self.poll(), 'complete')
+        self.assertEqual(PayFastPayment.objects.get(pk=self.payment.pk).status, 'complete')
+
+    def test_older_commit_does_not_replace_a_newer_status(self):
+        """Test a status written after a newer version was cached is dropped"""
+        self.notify()
+        stale = status.status_data(self.payment.pk, 'PF_STATUS', 'pending', self.payment.updated_at, version=0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            status.cache_payment_statuses([stale])
+
+        self.assertEqual(self.poll(), 'complete')
+        self.assertEqual(cache.get(status.status_cache_key(self.payment.pk))['version'], 1)
+
+    def test_held_lock_drops_the_entry(self):
+        """Test a writer that cannot take the entry lock leaves the entry to be reloaded"""
+        key = status.status_cache_key(self.payment.pk)
+        cache.add(f'{key}:lock', True)
+
+        with mock.patch.object(status, 'LOCK_ATTEMPTS', 2):
+            status.store_payment_status(cache, status.status_data(self.payment.pk, 'PF_STATUS', 'failed', None, 5))
+
+        self.assertIsNone(cache.get(key))
+
+    def test_status_is_only_served_to_the_owner_and_checkout_session(self):
+        """Test other visitors cannot read a payment's status by its id"""
+        owner = get_user_model().objects.create_user('owner', 'owner@example.com', 'secret')
+        self.payment.user = owner
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment.save()
+
+        self.assertEqual(self.poll(), 'pending')
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        self.client.force_login(owner)
+        self.assertEqual(self.poll(), 'pending')
+        self.client.force_login(get_user_model().objects.create_user('other', 'other@example.com', 'secret'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_delete_forgets_the_status(self):
+        """Test a deleted payment is no longer served"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment.delete()
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class AsyncViewsTestCase(TestCase):
+    """Test cases for the async checkout and ITN views (PAYFAST_ASYNC_VIEWS)"""
+
+    @staticmethod
+    def reload_urls():
+        # The root URLconf holds a resolver built from payfast.urls
+        importlib.reload(payfast_urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with mock.patch.object(conf, 'PAYFAST_ASYNC_VIEWS', True):
+            cls.reload_urls()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.reload_urls()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        recent_notifications.clear()
+        self.user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'secret')
+        self.async_client.force_login(self.user)
+        self.payment = PayFastPayment.objects.create(
+            user=self.user,
+            m_payment_id='PF_ASYNC',
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='buyer@example.com',
+        )
+        self.notify_url = reverse('payfast:notify')
+
+    def test_async_views_need_django_4_2(self):
+        """Test the system check refuses the async views on older Django"""
+        with mock.patch.object(conf, 'PAYFAST_ASYNC_VIEWS', True):
+            self.assertEqual(check_async_views(None), [])
+            with mock.patch('django.VERSION', (4, 1, 0, 'final', 0)):
+                self.assertEqual([error.id for error in check_async_views(None)], ['payfast.E003'])
+
+    def test_async_views_are_routed(self):
+        """Test the setting swaps the checkout and ITN views"""
+        self.assertIs(resolve(reverse('payfast:checkout')).func, views.acheckout_view)
+        self.assertIs(resolve(self.notify_url).func.view_class, views.AsyncPayFastNotifyView)
+
+    async def test_checkout_reuses_the_session_payment(self):
+        """Test the first checkout creates a payment and reloads reuse it"""
+        url = reverse('payfast:checkout')
+        first = await self.async_client.get(url, {'amount': '25.00', 'item_name': 'Gold'})
+        second = await self.async_client.get(url)
+
+        self.assertEqual(first.status_code, 200)
+        payment = await PayFastPayment.objects.exclude(pk=self.payment.pk).aget()
+        self.assertEqual((payment.user_id, payment.amount, payment.item_name), (self.user.pk, Decimal('25.00'), 'Gold'))
+        self.assertEqual(first.context['payment'], payment)
+        self.assertEqual(second.context['payment'], payment)
+        self.assertEqual(second.context['htmlForm'], first.context['htmlForm'])
+
+    async def test_checkout_requires_login(self):
+        """Test anonymous buyers are sent to the login page"""
+        response = await AsyncClient().get(reverse('payfast:checkout'))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(settings.LOGIN_URL))
+        self.assertEqual(await PayFastPayment.objects.acount(), 1)
+
+    async def test_payment_view(self):
+        """Test a pending payment is rendered and a finished one redirects"""
+        url = reverse('payfast:payfast_payment_view', kwargs={'pk': self.payment.pk})
+        response = await self.async_client.get(url)
+        self.assertEqual(response.context['form_data']['m_payment_id'], 'PF_ASYNC')
+
+        await PayFastPayment.objects.filter(pk=self.payment.pk).aupdate(status='complete')
+        response = await self.async_client.get(url)
+        self.assertRedirects(
+            response, reverse('payfast:payment_success', kwargs={'pk': self.payment.pk}),
+            fetch_redirect_response=False,
+        )
+
+        missing = await self.async_client.get(reverse('payfast:payfast_payment_view', kwargs={'pk': 0}))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_notify_completes_payment(self):
+        """Test an ITN is applied and logged by the async view"""
+        response = await self.async_client.post(self.notify_url, itn_data(self.payment))
+
+        self.assertEqual(response.content, b'OK')
+        payment = await PayFastPayment.objects.aget(pk=self.payment.pk)
+        self.assertEqual(payment.status, 'complete')
+        notification = await PayFastNotification.objects.aget()
+        self.assertEqual((notification.payment_id, notification.processing_state), (payment.pk, 'processed'))
+
+        retry = await self.async_client.post(self.notify_url, itn_data(self.payment))
+        self.assertEqual(retry.content, b'OK')
+        self.assertEqual(await PayFastNotification.objects.acount(), 1)
+
+    async def test_notify_rejects_unknown_payment(self):
+        """Test an ITN for an unknown payment is logged and rejected"""
+        response = await self.async_client.post(self.notify_url, itn_data(self.payment, m_payment_id='PF_UNKNOWN'))
+
+        self.assertEqual(response.status_code, 400)
+        notification = await PayFastNotification.objects.aget()
+        self.assertEqual(notification.validation_errors, 'Payment not found')
+
+    async def test_notify_get_not_allowed(self):
+        """Test the async ITN endpoint only accepts POST"""
+        response = await self.async_client.get(self.notify_url)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_notify_queue_mode(self):
+        """Test queue mode stores the payload without touching the payment"""
+        with mock.patch.object(conf, 'PAYFAST_ITN_QUEUE_MODE', True):
+            await self.async_client.post(self.notify_url, itn_data(self.payment))
+            await self.async_client.post(self.notify_url, itn_data(self.payment))
+
+        notification = await PayFastNotification.objects.aget()
+        self.assertEqual(notification.processing_state, 'queued')
+        self.assertEqual((await PayFastPayment.objects.aget(pk=self.payment.pk)).status, 'pending')
+
+    async def test_server_validation_runs_in_its_own_thread(self):
+        """Test PayFast is asked outside the thread shared by sync code"""
+        sync_thread = threading.current_thread()
+        threads = []
+
+        def validate(post_data):
+            threads.append(threading.current_thread())
+            return post_data['payment_status'] == 'COMPLETE'
+
+        with mock.patch.object(conf, 'PAYFAST_VALIDATE_WITH_SERVER', True), \
+                mock.patch('payfast.itn.validate_with_payfast', side_effect=validate):
+            rejected = await self.async_client.post(self.notify_url, itn_data(self.payment, 'FAILED'))
+            accepted = await self.async_client.post(self.notify_url, itn_data(self.payment))
+
+        self.assertEqual(rejected.status_code, 400)
+        self.assertEqual(accepted.status_code, 200)
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(sync_thread, threads)
+        self.assertEqual((await PayFastPayment.objects.aget(pk=self.payment.pk)).status, 'complete')
+
+
+class PaymentAdminTestCase(TestCase):
+    """Test cases for editing payments in the admin"""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.payment = PayFastPayment.objects.create(
+            m_payment_id='PF_ADMIN',
+            amount=Decimal('100.00'),
+            item_name='Test Product',
+            email_address='test@example.com',
+        )
+        self.url = reverse('admin:payfast_payfastpayment_change', args=[self.payment.pk])
+
+    def post(self, **changes):
+        form = self.client.get(self.url).context['adminform'].form
+        data = {name: value for name, value in form.initial.items() if value is not None}
+        data.update(changes)
+        return data
+
+    def test_status_follows_the_table(self):
+        """Test a status change STATUS_TRANSITIONS does not allow is a form error"""
+        PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_ADMIN', 'payment_status': 'COMPLETE'})
+
+        response = self.client.post(self.url, self.post(status='pending'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('status', response.context['adminform'].form.errors)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'complete')
+
+    def test_stale_page_is_a_form_error(self):
+        """Test saving a page opened before an ITN does not write the old status back"""
+        data = self.post(item_name='Edited')
+        PayFastPayment.objects.apply_itn({'m_payment_id': 'PF_ADMIN', 'payment_status': 'FAILED'})
+
+        response = self.client.post(self.url, data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('changed by someone else', str(response.context['adminform'].form.non_field_errors()))
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.item_name), ('failed', 'Test Product'))
+
+    def test_change_is_saved(self):
+        """Test an up-to-date page saves and bumps the version"""
+        response = self.client.post(self.url, self.post(status='cancelled', item_name='Edited'))
+
+        self.assertEqual(response.status_code, 302)
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.item_name, self.payment.version), ('cancelled', 'Edited', 1))